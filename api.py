@@ -0,0 +1,233 @@
+"""Versioned JSON read API.
+
+Batch endpoints return compact projections of messages and users, built
+from column queries rather than full ORM objects. Each endpoint answers a
+whole batch in a fixed number of queries (per shard, with sharding on;
+see sharding.py), however many ids it is asked for.
+
+    GET /api/v1/messages?ids=1,2,3
+    GET /api/v1/users?ids=1,2,3
+    GET /api/v1/users/<id>/timeline?cursor=...&limit=...
+"""
+
+import base64
+from datetime import datetime
+
+from flask import Blueprint, Response, request
+from sqlalchemy import func, or_, and_
+
+from archive import archived_messages, archived_messages_by_ids
+from models import db, User, Message, Follows
+from sharding import router
+
+try:
+    from orjson import dumps
+except ImportError:
+    import json
+
+    def dumps(data):
+        return json.dumps(data, separators=(',', ':')).encode()
+
+
+MAX_BATCH = 100
+DEFAULT_PAGE = 20
+MAX_PAGE = 100
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class BadRequest(Exception):
+    """Invalid query string parameters."""
+
+
+@api.errorhandler(BadRequest)
+def bad_request(error):
+    return json_response({'error': str(error)}, 400)
+
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def parse_ids():
+    """Parse the comma-separated 'ids' query string param."""
+
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',')
+               if value]
+    except ValueError:
+        raise BadRequest("ids must be comma-separated integers")
+
+    if not ids:
+        raise BadRequest("ids is required")
+
+    if len(ids) > MAX_BATCH:
+        raise BadRequest(f"at most {MAX_BATCH} ids per request")
+
+    return list(dict.fromkeys(ids))
+
+
+def message_json(row):
+    id, text, timestamp, user_id, username, image_url = row
+    return {
+        'id': id,
+        'text': text,
+        'timestamp': timestamp.isoformat(),
+        'user': {'id': user_id, 'username': username, 'image_url': image_url},
+    }
+
+
+MESSAGE_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                   Message.user_id, User.username, User.image_url)
+
+
+@api.route('/messages')
+def messages_batch():
+    """Messages (with their authors) for up to MAX_BATCH ids, in one query
+    (and a look in the archive for any not found).
+    """
+
+    ids = parse_ids()
+
+    if router.enabled:
+        # authors are on the main database, messages on any shard
+        rows = [(msg.id, msg.text, msg.timestamp, msg.user_id,
+                 msg.user.username, msg.user.image_url)
+                for msg in router.get_messages(ids).values()]
+    else:
+        rows = (db.session
+                .query(*MESSAGE_COLUMNS)
+                .join(User, User.id == Message.user_id)
+                .filter(Message.id.in_(ids)))
+
+    by_id = {row[0]: message_json(row) for row in rows}
+
+    # the rest may have been moved to the archive
+    missing = [id for id in ids if id not in by_id]
+    if missing:
+        by_id.update((msg.id, message_json((msg.id, msg.text, msg.timestamp,
+                                            msg.user_id, msg.user.username,
+                                            msg.user.image_url)))
+                     for msg in archived_messages_by_ids(missing).values())
+
+    return json_response({
+        'messages': [by_id[id] for id in ids if id in by_id],
+    })
+
+
+def count_by(column, ids, session=None):
+    """{id: number of rows with `column` == id}, in one grouped query."""
+
+    return dict((session or db.session)
+                .query(column, func.count())
+                .filter(column.in_(ids))
+                .group_by(column))
+
+
+def count_messages(ids):
+    """{user id: number of messages}, one query per shard holding any."""
+
+    counts = {}
+    for session, user_ids in router.group_by_shard(ids):
+        counts.update(count_by(Message.user_id, user_ids, session))
+    return counts
+
+
+@api.route('/users')
+def users_batch():
+    """Profiles and counts for up to MAX_BATCH user ids, in four queries
+    (and one more per extra shard holding their messages).
+    """
+
+    ids = parse_ids()
+
+    rows = (db.session
+            .query(User.id, User.username, User.image_url,
+                   User.header_image_url, User.bio, User.location)
+            .filter(User.id.in_(ids)))
+    users = {row.id: row._asdict() for row in rows}
+
+    counts = {
+        'messages': count_messages(ids),
+        'followers': count_by(Follows.user_being_followed_id, ids),
+        'following': count_by(Follows.user_following_id, ids),
+    }
+
+    for id, user in users.items():
+        for name, by_user in counts.items():
+            user[name] = by_user.get(id, 0)
+
+    return json_response({
+        'users': [users[id] for id in ids if id in users],
+    })
+
+
+def encode_cursor(timestamp, id):
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except ValueError:
+        raise BadRequest("invalid cursor")
+
+
+@api.route('/users/<int:user_id>/timeline')
+def user_timeline(user_id):
+    """A page of a user's messages, newest first, in two queries (more
+    once the page reaches their archived messages).
+
+    Pages with a keyset cursor on (timestamp, id): pass the previous
+    response's 'next_cursor' to get the next page.
+    """
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE)), MAX_PAGE)
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+
+    author = (db.session
+              .query(User.username, User.image_url)
+              .filter(User.id == user_id)
+              .first())
+    if not author:
+        return json_response({'error': "user not found"}, 404)
+
+    # from the user's shard, which has no users table to join
+    query = (router.session_for(user_id)
+             .query(Message.id, Message.text, Message.timestamp)
+             .filter(Message.user_id == user_id))
+
+    cursor = request.args.get('cursor')
+    before = decode_cursor(cursor) if cursor else None
+    if before:
+        timestamp, id = before
+        query = query.filter(or_(
+            Message.timestamp < timestamp,
+            and_(Message.timestamp == timestamp, Message.id < id)))
+
+    rows = (query
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit + 1)
+            .all())
+
+    if len(rows) <= limit:
+        # the rest may have been moved to the archive
+        archived = archived_messages(user_id, limit=limit + 1 - len(rows),
+                                     before=before)
+        rows += [(msg.id, msg.text, msg.timestamp) for msg in archived]
+        rows.sort(key=lambda row: (row[2], row[0]), reverse=True)
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        id, _, timestamp = page[-1]
+        next_cursor = encode_cursor(timestamp, id)
+
+    return json_response({
+        'messages': [message_json((*row, user_id, *author)) for row in page],
+        'next_cursor': next_cursor,
+    })
@@ -1,45 +1,176 @@
+import hmac
 import os
+import shutil
+import tempfile
+import time
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Flask, Blueprint, render_template, request, flash, redirect, session, g, Response, stream_with_context, current_app, jsonify, abort, get_flashed_messages
 from sqlalchemy.exc import IntegrityError
 
+from api import api, BadRequest, encode_cursor, decode_cursor
+from changes import changes
+from compress import Compressor
+from archive import archived_message, archived_messages, delete_archived_message
+from config import PROFILES
+from export import export_stream, FORMATS as EXPORT_FORMATS
 from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
+from importer import start_import, ImportJob, FORMATS as IMPORT_FORMATS
+from mutuals import summaries
+from models import db, connect_db, User, Follows
+from notifications import (deliver, mention_events, follow_event, like_event,
+                           inbox_page, mark_read, unread_counts, MAX_UNREAD,
+                           VERBS as NOTIFICATION_VERBS)
+from feed import home_feed
+from follows import follow, unfollow, parse_ids as parse_follow_ids
+from graph import follow_graph
+from live import hub, channel_poller, event_stream, message_event
+from trending import tracker, WINDOWS as TRENDING_WINDOWS
+from ratelimit import RateLimiter, client_ip, form_username, session_id
+from search import search
+from sharding import router
+import profiler
+import queries
+from queries import (user_by_id, user_by_username, following_ids,
+                     suggestions as suggestions_for)
+import slowlog
+from tags import (index_messages, unindex_message, unindex_user, timeline,
+                  tag_term, mention_term, link_terms, mentioned_user_ids)
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+# liked messages shown per page of /users/<id>/likes
+LIKES_PAGE = 50
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+# messages shown per page of tag and mention timelines
+TIMELINE_PAGE = 50
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+# clients allowed to read /metrics without METRICS_TOKEN
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
 
-connect_db(app)
+# users followed or unfollowed per bulk request
+MAX_BULK_FOLLOWS = 1000
+
+bp = Blueprint('warbler', __name__)
+bp.add_app_template_filter(link_terms)
+limiter = RateLimiter()
+
+
+def create_app(config=None):
+    """Create and configure the Warbler app.
+
+    `config` is a profile name from config.PROFILES or a config object; by
+    default the WARBLER_CONFIG environ variable picks the profile, falling
+    back to development.
+
+    Nothing here connects to the database: engines and their connection
+    pools are created on first use, so a server can preload the app and
+    fork workers that each open their own connections.
+    """
+
+    started = time.perf_counter()
+
+    if config is None:
+        config = os.environ.get('WARBLER_CONFIG', 'development')
+
+    app = Flask(__name__)
+
+    app.config.from_object(PROFILES.get(config, config))
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    router.init_app(app)
+    changes.init_app(app)
+    follow_graph.init_app(app)
+    slowlog.init_app(app)
+    profiler.init_app(app)
+    queries.init_app(app)
+
+    # Installed before the blueprint's add_user_to_g so over-limit requests
+    # are turned away before any database or bcrypt work.
+    limiter.init_app(app)
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    app.register_blueprint(metrics)
+
+    if app.config['COMPRESS']:
+        app.wsgi_app = Compressor(app.wsgi_app,
+                                  level=app.config['COMPRESS_LEVEL'],
+                                  brotli_quality=app.config['BROTLI_QUALITY'],
+                                  min_size=app.config['COMPRESS_MIN_SIZE'])
+
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    app.logger.debug("App created in %.1f ms",
+                     app.config['STARTUP_SECONDS'] * 1000)
+
+    return app
+
+
+def stream_template(template_name, **context):
+    """Like render_template, but send the page as it's rendered.
+
+    For long lists: the first bytes go out before the whole page is built.
+    Turn it off with the STREAM_TEMPLATES setting.
+    """
+
+    if not current_app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+
+    # Take the flashed messages now: the session cookie is sent before the
+    # template gets to them, so popping them later wouldn't be saved.
+    get_flashed_messages()
+
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(current_app.config['STREAM_BUFFER'])
+
+    return Response(stream_with_context(stream))
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = user_by_id(db.session).get(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+@bp.app_context_processor
+def add_unread_count():
+    """Give templates the current user's unread notification count."""
+
+    if not getattr(g, 'user', None):
+        return {}
+
+    return {'unread_count': unread_counts.get(g.user.id),
+            'max_unread': MAX_UNREAD}
+
+
+@bp.app_context_processor
+def add_follow_summary():
+    """Give templates how a user relates to the current user."""
+
+    if not getattr(g, 'user', None):
+        return {}
+
+    def follow_summary(user):
+        if user.id == g.user.id:
+            return None
+        return summaries.get(g.user.id, user.id)
+
+    return {'follow_summary': follow_summary}
+
+
 def do_login(user):
     """Log in user."""
 
@@ -51,15 +182,21 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+def find_user(username):
+    """The user named `username`, or None, through the baked query."""
+
+    return user_by_username(db.session).params(username=username).first()
+
 def validate_password(username, password):
     """Validate user's password and return a boolean of the result"""
-    user = User.authenticate(username, password)
+    user = User.authenticate(username, password, find=find_user)
     if user:
         return True
     
     return False
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
+@limiter.limit('ip', client_ip, rate=5, per=60)
 def signup():
     """Handle user signup.
 
@@ -95,7 +232,9 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
+@limiter.limit('ip', client_ip, rate=20, per=60)
+@limiter.limit('username', form_username, rate=5, per=60)
 def login():
     """Handle user login."""
 
@@ -103,7 +242,8 @@ def login():
 
     if form.validate_on_submit():
         user = User.authenticate(form.username.data,
-                                 form.password.data)
+                                 form.password.data,
+                                 find=find_user)
 
         if user:
             do_login(user)
@@ -115,7 +255,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -128,7 +268,7 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
@@ -142,27 +282,28 @@ def list_users():
     else:
         users = User.query.filter(User.username.like(f"%{search}%")).all()
 
-    return render_template('users/index.html', users=users)
+    return stream_template('users/index.html', users=users)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = user_by_id(db.session).get(user_id)
+    if user is None:
+        abort(404)
 
-    # snagging messages in order from the database;
+    # snagging messages in order from the user's shard;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    messages = router.user_messages(user_id, limit=100)
+    if len(messages) < 100:
+        # the rest may have been moved to the archive
+        messages += archived_messages(user_id, limit=100 - len(messages))
+
     return render_template('users/show.html', user=user, messages=messages)
 
 
-@app.route('/users/<int:user_id>/following')
+@bp.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -171,10 +312,10 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return stream_template('users/following.html', user=user)
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -183,10 +324,10 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    return stream_template('users/followers.html', user=user)
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -194,14 +335,16 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed = follow(g.user.id, [follow_id])
+    if not followed and not User.query.get(follow_id):
+        abort(404)
+    deliver([follow_event(g.user.id, user_id) for user_id in followed])
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -209,14 +352,69 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    unfollow(g.user.id, [follow_id])
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/<int:user_id>/profile', methods=["GET", "POST"])
+def bulk_follow_ids():
+    """The user ids of a bulk follow or unfollow, or an error response."""
+
+    try:
+        user_ids = parse_follow_ids(request.form.getlist('ids'))
+    except ValueError:
+        return None, (jsonify(error="ids must be integers"), 400)
+
+    if len(set(user_ids)) > MAX_BULK_FOLLOWS:
+        return None, (jsonify(
+            error=f"at most {MAX_BULK_FOLLOWS} ids per request"), 400)
+
+    return user_ids, None
+
+
+@bp.route('/users/follow', methods=['POST'])
+@limiter.limit('session', session_id(CURR_USER_KEY), rate=10, per=60)
+def add_follows():
+    """Follow many users at once.
+
+    Takes their ids, comma-separated, in the 'ids' form field. Responds
+    with the ids newly followed.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    user_ids, error = bulk_follow_ids()
+    if error:
+        return error
+
+    followed = follow(g.user.id, user_ids)
+    deliver([follow_event(g.user.id, user_id) for user_id in followed])
+    db.session.commit()
+
+    return jsonify(followed=followed)
+
+
+@bp.route('/users/stop-following', methods=['POST'])
+def stop_following_many():
+    """Stop following many users at once; as add_follows()."""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    user_ids, error = bulk_follow_ids()
+    if error:
+        return error
+
+    unfollowed = unfollow(g.user.id, user_ids)
+    db.session.commit()
+
+    return jsonify(unfollowed=unfollowed)
+
+
+@bp.route('/users/<int:user_id>/profile', methods=["GET", "POST"])
+@limiter.limit('session', session_id(CURR_USER_KEY), rate=5, per=60)
 def profile(user_id):
     """Update profile for current user."""
 
@@ -248,7 +446,7 @@ def profile(user_id):
         return render_template("/users/edit.html", form=form)
 
 
-@app.route('/users/<int:id>/delete', methods=["POST"])
+@bp.route('/users/<int:id>/delete', methods=["POST"])
 def delete_user(id):
     """Delete user."""
 
@@ -258,12 +456,14 @@ def delete_user(id):
 
     do_logout()
 
+    router.delete_user_data(id)
+    unindex_user(id)
     db.session.delete(g.user)
     db.session.commit()
 
     return redirect("/signup")
 
-@app.route('/users/add_like/<int:message_id>', methods=["POST"])
+@bp.route('/users/add_like/<int:message_id>', methods=["POST"])
 def likes_add(message_id):
     """Toggle like"""
 
@@ -271,33 +471,48 @@ def likes_add(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
-    
+    message = router.get_message(message_id)
+    if message is None:
+        abort(404)
+
     # check if message belongs to user
     if message.user_id == g.user.id:
         flash("You can't like your own warble!", "danger")
         return redirect("/")
 
-    user_like = Likes.query.filter_by(message_id=message_id,user_id=g.user.id).first()
-    if user_like:
+    if router.liked_ids(g.user.id, [message.id]):
         try:
-            db.session.delete(user_like)
-            db.session.commit()
+            router.unlike(g.user.id, message.id)
+            tracker.record_like(message.id, -1)
         except Exception as e:
             flash(f"Error removing Like:{e}", "danger")
 
     else:
-        new_like = Likes(user_id=g.user.id, message_id=message.id)
-
         try:
-            db.session.add(new_like)
+            router.like(g.user.id, message.id)
+            tracker.record_like(message.id, 1)
+            deliver([like_event(g.user.id, message)])
             db.session.commit()
         except Exception as e:
             flash(f"Error adding Like:{e}", "danger")
 
     return redirect(f"/")
 
-@app.route('/users/<int:user_id>/likes')
+
+def cursor_arg():
+    """Decode the page cursor in the query string, if any."""
+
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return None
+
+    try:
+        return decode_cursor(cursor)
+    except BadRequest:
+        abort(400)
+
+
+@bp.route('/users/<int:user_id>/likes')
 def users_likes(user_id):
     """Show list of liked messages of this user."""
 
@@ -306,14 +521,79 @@ def users_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    likes = [msg.id for msg in g.user.likes]
-    return render_template('users/likes.html', user=user, likes=likes)
+
+    before = cursor_arg()
+
+    # the profile user's likes, newest first, with each message's author
+    rows = router.liked_page(user_id, before, limit=LIKES_PAGE + 1)
+
+    page = rows[:LIKES_PAGE]
+    next_cursor = None
+    if len(rows) > LIKES_PAGE:
+        _, liked_at, like_id = page[-1]
+        next_cursor = encode_cursor(liked_at, like_id)
+
+    messages = [msg for msg, _, _ in page]
+
+    # which of just these messages the viewer has liked
+    likes = router.liked_ids(g.user.id, [msg.id for msg in messages])
+
+    return render_template('users/likes.html', user=user, messages=messages,
+                           likes=likes, next_cursor=next_cursor)
+
+
+@bp.route('/notifications')
+def notifications():
+    """Show the current user's notifications, newest first.
+
+    Takes a 'before' notification id in the querystring for older pages.
+    Seeing the first page marks everything on it read.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    before = request.args.get('before', type=int)
+    items, next_before = inbox_page(g.user.id, before)
+
+    if before is None and items:
+        mark_read(g.user.id, items[0][0].id)
+
+    return render_template('users/notifications.html', items=items,
+                           verbs=NOTIFICATION_VERBS, next_before=next_before)
+
+
+@bp.route('/users/<int:user_id>/export')
+def users_export(user_id):
+    """Download all of the current user's data.
+
+    Can take a 'format' param in querystring ('ndjson' (default) or 'csv')
+    and 'gzip=1' to compress it. The export is streamed as it is read from
+    the database, so it never sits in memory all at once.
+    """
+
+    if not g.user or not g.user.id == user_id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    format = request.args.get('format', 'ndjson')
+    if format not in EXPORT_FORMATS:
+        format = 'ndjson'
+
+    chunks, mimetype, filename = export_stream(
+        user_id, format=format, compress=request.args.get('gzip') == '1')
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
 
 
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
+@limiter.limit('session', session_id(CURR_USER_KEY), rate=30, per=60)
 def messages_add():
     """Add a message:
 
@@ -327,24 +607,141 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = router.add_message(g.user, form.text.data)
+        session = router.session_for(g.user.id)
+        index_messages([msg], session)
+        if router.enabled:
+            # the message and its index entries, on the author's shard
+            session.commit()
+        deliver(mention_events(msg, mentioned_user_ids(msg.text)))
         db.session.commit()
+        hub.publish(g.user.id, message_event(msg))
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/import', methods=["POST"])
+def messages_import():
+    """Start importing a batch of the current user's messages.
+
+    Takes an NDJSON or CSV file upload named 'file' (or the raw request
+    body), and a 'format' param ('ndjson' (default) or 'csv'). Responds
+    with the import job, whose progress can be polled at its status URL.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    format = request.args.get('format') or request.form.get('format', 'ndjson')
+    if format not in IMPORT_FORMATS:
+        return jsonify(error=f"format must be one of {IMPORT_FORMATS}"), 400
+
+    # the upload goes away with the request, so keep a copy for the job
+    source = request.files['file'].stream if 'file' in request.files else request.stream
+    upload = tempfile.TemporaryFile()
+    shutil.copyfileobj(source, upload)
+    upload.seek(0)
+
+    job = start_import(current_app._get_current_object(), g.user.id, upload,
+                       format, background=current_app.config['IMPORT_IN_BACKGROUND'])
+
+    return jsonify(dict(job.to_dict(),
+                        status_url=f"/messages/import/{job.id}")), 202
+
+
+@bp.route('/messages/import/<job_id>')
+def messages_import_status(job_id):
+    """Show the progress of one of the current user's imports."""
+
+    job = ImportJob.load(job_id)
+
+    if not g.user or not job or not job.user_id == g.user.id:
+        return jsonify(error="Import not found."), 404
+
+    return jsonify(job.to_dict())
+
+
+@bp.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = router.get_message(message_id) or archived_message(message_id)
+    if msg is None:
+        abort(404)
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/trending')
+def messages_trending():
+    """Show messages ranked by like velocity over the last hour or day.
+
+    Can take a 'window' param in querystring: 'hour' (default) or 'day'.
+    """
+
+    window = request.args.get('window')
+    if window not in TRENDING_WINDOWS:
+        window = 'hour'
+
+    ranking = tracker.trending(window)
+
+    ids = [message_id for message_id, _ in ranking]
+    found = router.get_messages(ids)
+    messages = [(found[message_id], rate)
+                for message_id, rate in ranking if message_id in found]
+
+    return render_template('messages/trending.html', messages=messages,
+                           window=window, windows=TRENDING_WINDOWS)
+
+
+@bp.route('/search')
+def messages_search():
+    """Search messages, best matches first.
+
+    Takes a 'q' param in querystring, and 'page' (from 0) for later pages.
+    """
+
+    query = request.args.get('q', '').strip()
+
+    try:
+        page = max(int(request.args.get('page', 0)), 0)
+    except ValueError:
+        page = 0
+
+    results, has_next = search(query, page) if query else ([], False)
+
+    return render_template('messages/search.html', query=query,
+                           results=results, page=page, has_next=has_next)
+
+
+@bp.route('/tags/<tag>')
+def tag_timeline(tag):
+    """Show messages with a hashtag, newest first, a page at a time."""
+
+    messages, next_key = timeline(tag_term(tag), cursor_arg(), TIMELINE_PAGE)
+
+    return render_template('messages/timeline.html', messages=messages,
+                           title=f"#{tag.lower()}", next_cursor=next_key
+                           and encode_cursor(*next_key))
+
+
+@bp.route('/users/<int:user_id>/mentions')
+def users_mentions(user_id):
+    """Show messages mentioning this user, newest first, a page at a time."""
+
+    user = User.query.get_or_404(user_id)
+
+    messages, next_key = timeline(mention_term(user.id), cursor_arg(),
+                                  TIMELINE_PAGE)
+
+    return render_template('messages/timeline.html', messages=messages,
+                           title=f"Mentions of @{user.username}",
+                           next_cursor=next_key and encode_cursor(*next_key))
+
+
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -352,8 +749,16 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    msg = router.get_message(message_id)
+    if msg is not None:
+        router.delete_message(msg)
+    else:
+        msg = archived_message(message_id)
+        if msg is None:
+            abort(404)
+        delete_archived_message(msg)
+
+    unindex_message(msg.id, msg.user_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
@@ -363,7 +768,7 @@ def messages_destroy(message_id):
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
 def homepage():
     """Show homepage:
 
@@ -372,23 +777,89 @@ def homepage():
     """
 
     if g.user:
-        feedusers = [user.id for user in g.user.following]
+        following = following_ids(db.session).params(user_id=g.user.id)
+        feedusers = [user_id for (user_id,) in following]
         feedusers.append(g.user.id)
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(feedusers))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # merged from cached per-author timelines; see feed.py
+        messages = home_feed(feedusers, limit=100)
 
-        likes = [msg.id for msg in g.user.likes]
-        return render_template('home.html', messages=messages, likes=likes)
+        likes = router.liked_ids(g.user.id, [msg.id for msg in messages])
+
+        # "who to follow" suggestions are precomputed by recommendations.py
+        suggestions = (suggestions_for(db.session)
+                       .params(user_id=g.user.id)
+                       .all())
+
+        return stream_template('home.html', messages=messages, likes=likes,
+                               suggestions=suggestions)
 
     else:
         return render_template('home-anon.html')
 
 
+##############################################################################
+# Metrics, for the monitoring system rather than the public
+
+metrics = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+
+@metrics.before_request
+def metrics_access():
+    """Let in local clients and those with the METRICS_TOKEN bearer token."""
+
+    token = current_app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+
+    if token and hmac.compare_digest(authorization, f"Bearer {token}"):
+        return None
+    if request.remote_addr in LOCAL_ADDRESSES:
+        return None
+
+    abort(403)
+
+
+@metrics.route('/ratelimit')
+def ratelimit_metrics():
+    """Export rate limiter rejection counters for this worker."""
+
+    return Response(limiter.metrics(), mimetype='text/plain')
+
+
+@metrics.route('/queries')
+def query_metrics():
+    """Export time spent compiling and executing SQL for this worker."""
+
+    return Response(queries.timer.metrics(), mimetype='text/plain')
+
+
+@bp.route('/feed/stream')
+def feed_stream():
+    """Push new messages from followed users as server-sent events."""
+
+    if not current_app.config['LIVE_FEED']:
+        abort(404)
+
+    if not g.user:
+        return Response("Access unauthorized.", 401)
+
+    following = (db.session
+                 .query(Follows.user_being_followed_id)
+                 .filter(Follows.user_following_id == g.user.id))
+    subscription = hub.subscribe([user_id for (user_id,) in following]
+                                 + [g.user.id])
+
+    # not wrapped in stream_with_context, so the request's database session
+    # is released before streaming starts instead of held open per client
+    poll = channel_poller(current_app._get_current_object())
+    stream = event_stream(
+        subscription, poll=poll,
+        poll_interval=current_app.config['CHANGES_POLL_SECONDS'])
+
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -396,7 +867,7 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
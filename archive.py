@@ -0,0 +1,284 @@
+"""Hot/cold tiering of messages.
+
+Feeds and profiles show recent warbles, so old ones shouldn't weigh down the
+messages table and its indexes. The tiering job moves messages older than
+ARCHIVE_AFTER_DAYS into message_archive: one row per chunk of up to
+CHUNK_SIZE of a user's messages, stored as zlib-compressed JSON. Chunks are
+only ever appended; deleting an archived message replaces its chunk. The
+archive sits beside the messages it came from, so with sharding a user's
+chunks are on their shard.
+
+Messages that have been liked stay hot, since likes refer to them, and
+archived messages can't be liked.
+
+Profiles, message pages, tag timelines and the JSON API's user timelines
+fall back to the archive for messages that aren't in the messages table,
+and the data export includes it. Run the job (say, nightly) with:
+
+    python archive.py [--days N]
+"""
+
+import argparse
+import json
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import attrgetter
+
+from flask import current_app
+from sqlalchemy import and_, or_, func
+
+from models import Message, Likes, MessageArchive
+from sharding import router
+
+CHUNK_SIZE = 200
+
+# old messages read (per shard) per transaction
+BATCH_SIZE = 5000
+
+# chunks loaded per query when looking messages up by id
+LOOKUP_BATCH = 500
+
+
+def pack(messages):
+    """Compress `messages` (anything with id, timestamp, text) for a chunk."""
+
+    rows = [[msg.id, msg.timestamp.isoformat(), msg.text] for msg in messages]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9)
+
+
+def unpack(chunk):
+    """The messages in `chunk`, as unsaved Message objects, oldest first."""
+
+    return [Message(id=id, timestamp=datetime.fromisoformat(timestamp),
+                    text=text, user_id=chunk.user_id)
+            for id, timestamp, text in json.loads(zlib.decompress(chunk.data))]
+
+
+def _chunk_row(user_id, messages):
+    return {
+        'first_id': messages[0].id,
+        'last_id': messages[-1].id,
+        'user_id': user_id,
+        'count': len(messages),
+        'data': pack(messages),
+    }
+
+
+def _liked(message_ids):
+    """Which of `message_ids` has anyone liked? (Likes can be on any shard.)"""
+
+    liked = set()
+    for session in router.sessions():
+        liked.update(message_id for (message_id,) in (
+            session
+            .query(Likes.message_id)
+            .filter(Likes.message_id.in_(message_ids))))
+
+    return liked
+
+
+def _archive_shard(session, older_than, batch_size, chunk_size):
+    archived = 0
+    last_user_id = last_id = 0
+
+    while True:
+        # keyset paging on (user_id, id), which also groups each batch by user
+        messages = (session
+                    .query(Message.id, Message.user_id, Message.timestamp,
+                           Message.text)
+                    .filter(Message.timestamp < older_than,
+                            or_(Message.user_id > last_user_id,
+                                and_(Message.user_id == last_user_id,
+                                     Message.id > last_id)))
+                    .order_by(Message.user_id, Message.id)
+                    .limit(batch_size)
+                    .all())
+        if not messages:
+            return archived
+
+        last_user_id, last_id = messages[-1].user_id, messages[-1].id
+
+        liked = _liked([msg.id for msg in messages])
+        moving = [msg for msg in messages if msg.id not in liked]
+        if not moving:
+            continue
+
+        chunks = []
+        for user_id, user_messages in groupby(moving, key=attrgetter('user_id')):
+            user_messages = list(user_messages)
+            for start in range(0, len(user_messages), chunk_size):
+                chunks.append(_chunk_row(
+                    user_id, user_messages[start:start + chunk_size]))
+
+        session.execute(MessageArchive.__table__.insert(), chunks)
+        (session
+         .query(Message)
+         .filter(Message.id.in_([msg.id for msg in moving]))
+         .delete(synchronize_session=False))
+        session.commit()
+
+        archived += len(moving)
+
+
+def archive_messages(older_than, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """Move messages posted before `older_than` to the archive.
+
+    Returns the number of messages moved.
+    """
+
+    return sum(_archive_shard(session, older_than, batch_size, chunk_size)
+               for session in router.sessions())
+
+
+def _chunks_holding(session, message_ids, user_id=None):
+    """The chunks (of `user_id`'s, if given) that can hold `message_ids`."""
+
+    ids = sorted(message_ids)
+    if not ids:
+        return []
+
+    ranges = (session
+              .query(MessageArchive.first_id, MessageArchive.last_id)
+              .filter(MessageArchive.first_id <= ids[-1],
+                      MessageArchive.last_id >= ids[0]))
+    if user_id is not None:
+        ranges = ranges.filter(MessageArchive.user_id == user_id)
+
+    # chunks overlap (one user's, and more so different users'), so the
+    # range query is loose: only load the chunks with an id in their range
+    keys = [first_id for first_id, last_id in ranges
+            if bisect_left(ids, first_id) < bisect_right(ids, last_id)]
+
+    return [chunk
+            for start in range(0, len(keys), LOOKUP_BATCH)
+            for chunk in (session
+                          .query(MessageArchive)
+                          .filter(MessageArchive.first_id.in_(
+                              keys[start:start + LOOKUP_BATCH])))]
+
+
+def archived_messages_by_ids(message_ids, authors=None):
+    """{id: message, with its author} for those of `message_ids` archived.
+
+    `authors` maps message ids to their authors' ids, where known: those
+    are looked for in their author's chunks on their shard, the rest in
+    every shard's chunks. Each chunk is decompressed once.
+    """
+
+    authors = authors or {}
+    by_author = defaultdict(set)
+    for message_id in message_ids:
+        by_author[authors.get(message_id)].add(message_id)
+
+    searches = [(router.session_for(user_id), user_id, ids)
+                for user_id, ids in by_author.items() if user_id is not None]
+    if None in by_author:
+        searches += [(session, None, by_author[None])
+                     for session in router.sessions()]
+
+    found = {}
+    for session, user_id, ids in searches:
+        for chunk in _chunks_holding(session, ids, user_id):
+            found.update((msg.id, msg) for msg in unpack(chunk)
+                         if msg.id in ids)
+
+    router.attach_authors(list(found.values()))
+    return found
+
+
+def archived_message(message_id, user_id=None):
+    """An archived message (`user_id`'s, if known), with author, or None."""
+
+    authors = {message_id: user_id} if user_id is not None else None
+    return archived_messages_by_ids([message_id], authors).get(message_id)
+
+
+def archived_messages(user_id, limit, before=None):
+    """A user's newest `limit` archived messages, with their author.
+
+    With `before`, a (timestamp, id) key, only messages older than it.
+    """
+
+    chunks = (router
+              .session_for(user_id)
+              .query(MessageArchive)
+              .filter(MessageArchive.user_id == user_id)
+              .order_by(MessageArchive.last_id.desc())
+              .yield_per(4))
+
+    messages = []
+    for chunk in chunks:
+        messages.extend(msg for msg in unpack(chunk)
+                        if before is None or (msg.timestamp, msg.id) < before)
+        if len(messages) >= limit:
+            break
+
+    messages.sort(key=attrgetter('timestamp', 'id'), reverse=True)
+    return router.attach_authors(messages[:limit])
+
+
+def all_archived(user_id):
+    """Every archived message of a user's, a chunk at a time (no authors)."""
+
+    chunks = (router
+              .session_for(user_id)
+              .query(MessageArchive)
+              .filter(MessageArchive.user_id == user_id)
+              .order_by(MessageArchive.first_id)
+              .yield_per(4))
+
+    for chunk in chunks:
+        yield from unpack(chunk)
+
+
+def count_archived(user_id):
+    return (router
+            .session_for(user_id)
+            .query(func.coalesce(func.sum(MessageArchive.count), 0))
+            .filter(MessageArchive.user_id == user_id)
+            .scalar())
+
+
+def delete_archived_message(msg):
+    """Delete an archived message by replacing its chunk."""
+
+    session = router.session_for(msg.user_id)
+
+    for chunk in _chunks_holding(session, [msg.id], msg.user_id):
+        messages = unpack(chunk)
+        remaining = [other for other in messages if other.id != msg.id]
+        if len(remaining) == len(messages):
+            continue
+
+        session.delete(chunk)
+        session.flush()
+        if remaining:
+            session.execute(MessageArchive.__table__.insert(),
+                            [_chunk_row(msg.user_id, remaining)])
+        session.commit()
+        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int,
+                        help='archive messages older than this '
+                             '(default: ARCHIVE_AFTER_DAYS)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        days = args.days or current_app.config['ARCHIVE_AFTER_DAYS']
+        older_than = datetime.utcnow() - timedelta(days=days)
+        archived = archive_messages(older_than, batch_size=args.batch_size)
+
+    print(f"Archived {archived} messages older than {days} days.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark the home feed: cached k-way merge vs. the IN (...) query.
+
+Builds a throwaway database (the benchmark profile; in-memory SQLite unless
+BENCHMARK_DATABASE_URL is set) with enough authors for the largest
+following count, then times building a 100-message feed for viewers
+following 10, 1k and 10k accounts three ways: the original single SQL
+query, the cached merge on a cold cache, and on a warm cache.
+
+run it like:
+
+    python -m benchmarks.bench_feed --messages-per-author 20
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from feed import FEED_SIZE, TimelineCache, feed_message_ids
+from models import db, User, Message
+
+
+def seed(authors, messages_per_author):
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"author{i}", email=f"author{i}@test.com",
+             password="x")
+        for i in range(1, authors + 1)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text="warble", user_id=i,
+             timestamp=start + timedelta(seconds=rng.randrange(10 ** 8)))
+        for i in range(1, authors + 1)
+        for _ in range(messages_per_author)
+    ])
+    db.session.commit()
+
+
+def sql_feed(author_ids):
+    """The original homepage() query."""
+
+    return [msg.id for msg in (Message
+                               .query
+                               .filter(Message.user_id.in_(author_ids))
+                               .order_by(Message.timestamp.desc())
+                               .limit(FEED_SIZE))]
+
+
+def timed(func, runs):
+    times = []
+    for _ in range(runs):
+        db.session.expire_all()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--following', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--messages-per-author', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    create_app('benchmark')
+    db.create_all()
+    seed(max(args.following), args.messages_per_author)
+
+    print(f"{'following':>9} {'sql ms':>9} {'cold ms':>9} {'warm ms':>9}")
+
+    for following in args.following:
+        author_ids = list(range(1, following + 1))
+
+        cache = TimelineCache()
+        assert feed_message_ids(author_ids, cache=cache) == sql_feed(author_ids)
+
+        sql_ms = timed(lambda: sql_feed(author_ids), args.runs)
+        cold_ms = timed(lambda: feed_message_ids(author_ids,
+                                                 cache=TimelineCache()),
+                        args.runs)
+        warm_ms = timed(lambda: feed_message_ids(author_ids, cache=cache),
+                        args.runs)
+
+        print(f"{following:>9} {sql_ms:>9.2f} {cold_ms:>9.2f} {warm_ms:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark time to first byte and bytes sent for long pages.
+
+Builds a throwaway database (the benchmark profile; in-memory SQLite unless
+BENCHMARK_DATABASE_URL is set) in which the viewer follows, and is followed
+by, --follows users who have each posted a few messages. Then it fetches
+the users list, the viewer's followers and following pages and home feed,
+rendered all at once and streamed, sent uncompressed, gzipped and (if the
+brotli package is installed) brotli-compressed. It reports the median time
+to the first byte of the body, time to the last byte, and bytes sent.
+
+run it like:
+
+    python -m benchmarks.bench_pages --follows 1000
+"""
+
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, CURR_USER_KEY
+from compress import brotli
+from models import db, User, Message, Follows
+
+PAGES = ['/users', '/users/1/followers', '/users/1/following', '/']
+
+
+def seed(follows, messages_per_user):
+    start = datetime(2020, 1, 1)
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@test.com",
+             password="x", bio="Warbling since forever.")
+        for i in range(1, follows + 2)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=i, user_following_id=1)
+        for i in range(2, follows + 2)
+    ] + [
+        dict(user_being_followed_id=1, user_following_id=i)
+        for i in range(2, follows + 2)
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(user_id=i, text=f"Message {n} from user {i}, #warble",
+             timestamp=start + timedelta(minutes=i * messages_per_user + n))
+        for i in range(1, follows + 2)
+        for n in range(messages_per_user)
+    ])
+    db.session.commit()
+
+
+def fetch(client, path, encoding):
+    """(ms to the first byte of the body, ms to the last, bytes)."""
+
+    start = time.perf_counter()
+    resp = client.get(path, headers={'Accept-Encoding': encoding},
+                      buffered=False)
+
+    first = None
+    size = 0
+    for chunk in resp.response:
+        if chunk and first is None:
+            first = time.perf_counter()
+        size += len(chunk)
+    resp.close()
+
+    end = time.perf_counter()
+    return (first - start) * 1000, (end - start) * 1000, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--follows', type=int, default=1000)
+    parser.add_argument('--messages-per-user', type=int, default=3)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app('benchmark')
+    db.create_all()
+    seed(args.follows, args.messages_per_user)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = 1
+
+    encodings = ['identity', 'gzip'] + (['br'] if brotli else [])
+
+    print(f"{'page':<20} {'mode':<9} {'encoding':<9} "
+          f"{'ttfb ms':>8} {'total ms':>9} {'bytes':>9}")
+
+    for path in PAGES:
+        for streamed in (False, True):
+            app.config['STREAM_TEMPLATES'] = streamed
+
+            for encoding in encodings:
+                runs = [fetch(client, path, encoding)
+                        for _ in range(args.runs)]
+                ttfb, total, size = (statistics.median(column)
+                                     for column in zip(*runs))
+
+                print(f"{path:<20} {'streamed' if streamed else 'buffered':<9} "
+                      f"{encoding:<9} {ttfb:>8.1f} {total:>9.1f} {size:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Benchmark the baked hot-path queries against the ORM queries they replace.
+
+Builds a throwaway database (the benchmark profile; in-memory SQLite unless
+BENCHMARK_DATABASE_URL is set) of --users users, each following --follows
+others, with a few messages and recommendations each. Then, for each query
+in queries.py, times the original ORM query and the baked one, reporting
+the median CPU time per call, split into the time in the DBAPI cursor's
+execute() and the rest: building the query, compiling its SQL, and
+turning the rows into objects. Last, the CPU saved on a home page and a
+profile page's queries.
+
+run it like:
+
+    python -m benchmarks.bench_queries --runs 2000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from models import db, User, Message, Likes, Follows, Recommendation
+import queries
+
+# queries each page runs
+PAGES = {
+    'home': ['user_by_id', 'following_ids', 'suggestions'],
+    'profile': ['user_by_id', 'user_by_id', 'user_messages', 'count_messages',
+                'count_likes'],
+}
+
+
+def seed(users, follows, messages_per_user):
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@test.com",
+             password="x")
+        for i in range(1, users + 1)
+    ])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_following_id=i, user_being_followed_id=j)
+        for i in range(1, users + 1)
+        for j in rng.sample(range(1, users + 1), follows) if j != i
+    ])
+    db.session.bulk_insert_mappings(Message, [
+        dict(user_id=i, text="warble",
+             timestamp=start + timedelta(seconds=rng.randrange(10 ** 8)))
+        for i in range(1, users + 1)
+        for _ in range(messages_per_user)
+    ])
+    db.session.bulk_insert_mappings(Recommendation, [
+        dict(user_id=i, recommended_user_id=j, score=rng.random())
+        for i in range(1, users + 1)
+        for j in rng.sample(range(1, users + 1), 5) if j != i
+    ])
+    db.session.commit()
+
+
+def orm_queries(user_id):
+    """The queries as they were written before queries.py."""
+
+    return {
+        'user_by_id': lambda: User.query.get(user_id),
+        'user_by_username': lambda: (User.query
+                                     .filter_by(username=f"user{user_id}")
+                                     .first()),
+        'following_ids': lambda: (db.session
+                                  .query(Follows.user_being_followed_id)
+                                  .filter(Follows.user_following_id == user_id)
+                                  .all()),
+        'suggestions': lambda: (User
+                                .query
+                                .join(Recommendation,
+                                      Recommendation.recommended_user_id
+                                      == User.id)
+                                .filter(Recommendation.user_id == user_id)
+                                .order_by(Recommendation.score.desc())
+                                .all()),
+        'user_messages': lambda: (db.session
+                                  .query(Message)
+                                  .filter(Message.user_id == user_id)
+                                  .order_by(Message.timestamp.desc())
+                                  .limit(100)
+                                  .all()),
+        'count_messages': lambda: (db.session
+                                   .query(func.count(Message.id))
+                                   .filter(Message.user_id == user_id)
+                                   .scalar()),
+        'count_likes': lambda: (db.session
+                                .query(func.count(Likes.id))
+                                .filter(Likes.user_id == user_id)
+                                .scalar()),
+    }
+
+
+def baked_queries(user_id):
+    session = db.session
+
+    return {
+        'user_by_id': lambda: queries.user_by_id(session).get(user_id),
+        'user_by_username': lambda: (queries.user_by_username(session)
+                                     .params(username=f"user{user_id}")
+                                     .first()),
+        'following_ids': lambda: (queries.following_ids(session)
+                                  .params(user_id=user_id).all()),
+        'suggestions': lambda: (queries.suggestions(session)
+                                .params(user_id=user_id).all()),
+        'user_messages': lambda: (queries.user_messages(session)
+                                  .params(user_id=user_id, limit=100).all()),
+        'count_messages': lambda: (queries.count_messages(session)
+                                   .params(user_id=user_id).scalar()),
+        'count_likes': lambda: (queries.count_likes(session)
+                                .params(user_id=user_id).scalar()),
+    }
+
+
+class Split:
+    """CPU time of a call, split into the cursor's execute() and the rest."""
+
+    def __init__(self):
+        self.cursor_times = []
+
+    def before_cursor(self, *args):
+        self.cursor_times.append(time.process_time())
+
+    def after_cursor(self, *args):
+        self.cursor_times.append(time.process_time())
+
+    def time(self, func):
+        """(total, outside the cursor, in it), microseconds."""
+
+        # as on a new request: nothing in the identity map
+        db.session.expunge_all()
+        self.cursor_times.clear()
+
+        start = time.process_time()
+        func()
+        end = time.process_time()
+
+        executing = sum(after - before for before, after
+                        in zip(self.cursor_times[::2], self.cursor_times[1::2]))
+        total = end - start
+        return total * 1e6, (total - executing) * 1e6, executing * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--follows', type=int, default=50)
+    parser.add_argument('--messages-per-user', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app('benchmark')
+    db.create_all()
+    seed(args.users, args.follows, args.messages_per_user)
+
+    split = Split()
+    event.listen(Engine, 'before_cursor_execute', split.before_cursor)
+    event.listen(Engine, 'after_cursor_execute', split.after_cursor)
+
+    rng = random.Random(1)
+    user_ids = [rng.randrange(1, args.users + 1) for _ in range(args.runs)]
+    medians = {}
+
+    print(f"{'query':<16} {'kind':<6} {'total us':>9} {'python us':>10} "
+          f"{'cursor us':>10}")
+
+    for name in queries.REGISTRY:
+        for kind, make in (('orm', orm_queries), ('baked', baked_queries)):
+            # once to warm the bakery and the statement caches
+            make(user_ids[0])[name]()
+
+            runs = [split.time(make(user_id)[name]) for user_id in user_ids]
+            total, python, executing = (statistics.median(column)
+                                        for column in zip(*runs))
+            medians[name, kind] = total
+
+            print(f"{name:<16} {kind:<6} {total:>9.1f} {python:>10.1f} "
+                  f"{executing:>10.1f}")
+
+    print()
+    for page, names in PAGES.items():
+        orm = sum(medians[name, 'orm'] for name in names)
+        baked = sum(medians[name, 'baked'] for name in names)
+        print(f"{page} page queries: {orm:.0f} us -> {baked:.0f} us CPU "
+              f"per request, {orm - baked:.0f} us ({1 - baked / orm:.0%}) saved")
+
+
+if __name__ == '__main__':
+    main()
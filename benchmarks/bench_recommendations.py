@@ -0,0 +1,78 @@
+"""Benchmark the "who to follow" batch job on a synthetic follow graph.
+
+Builds a random graph of --users users following --follows others each
+(a few popular accounts get a share of the follows, as in a real graph),
+then times compute_recommendations() and reports the chunks it used and
+the peak memory of the process and of its workers.
+
+run it like:
+
+    python -m benchmarks.bench_recommendations --users 1000000 --workers 4
+"""
+
+import argparse
+import resource
+import time
+
+import numpy as np
+
+from recommendations import (DEFAULT_CHUNK_SIZE, DEFAULT_MAX_PATHS,
+                             build_adjacency, chunk_bounds,
+                             compute_recommendations)
+
+
+def make_graph(users, follows, popular_share, seed=0):
+    """(follower_ids, followed_ids): `follows` follows per user, a
+    `popular_share` of them of the top 1% of users.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    follower_ids = np.repeat(np.arange(1, users + 1), follows)
+    followed_ids = rng.integers(1, users + 1, size=len(follower_ids))
+
+    popular = rng.random(len(followed_ids)) < popular_share
+    followed_ids[popular] = rng.integers(1, max(users // 100, 1) + 1,
+                                         size=int(popular.sum()))
+
+    return follower_ids, followed_ids
+
+
+def peak_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--popular-share', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--max-paths', type=int, default=DEFAULT_MAX_PATHS)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    follower_ids, followed_ids = make_graph(args.users, args.follows,
+                                            args.popular_share)
+    adjacency, _ = build_adjacency(follower_ids, followed_ids)
+    bounds = chunk_bounds(adjacency, args.chunk_size, args.max_paths)
+    del adjacency
+    print(f"{len(follower_ids)} follows among {args.users} users, "
+          f"{len(bounds)} chunks (made in "
+          f"{time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    users, _, _ = compute_recommendations(
+        follower_ids, followed_ids, workers=args.workers,
+        chunk_size=args.chunk_size, max_paths=args.max_paths)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(users)} recommendations in {elapsed:.1f}s; peak RSS "
+          f"{peak_mb(resource.RUSAGE_SELF):.0f} MB here, "
+          f"{peak_mb(resource.RUSAGE_CHILDREN):.0f} MB in a worker")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark full-text search latency as the messages table grows.
+
+Builds a throwaway database (the benchmark profile; in-memory SQLite with
+FTS5 unless BENCHMARK_DATABASE_URL is set) of messages drawn from a
+Zipf-like vocabulary, then times a first page of results for a common, a
+middling and a rare word, and for a two-word query.
+
+run it like:
+
+    python -m benchmarks.bench_search --messages 1000000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from models import db, User, Message
+from search import search
+
+VOCABULARY = 5000
+BATCH = 10000
+
+
+def word(rank):
+    return f"w{rank}"
+
+
+def seed(messages):
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    weights = [1 / rank for rank in range(1, VOCABULARY + 1)]
+    ranks = list(range(1, VOCABULARY + 1))
+
+    db.session.add(User(id=1, username="author", email="author@test.com",
+                        password="x"))
+    db.session.commit()
+
+    for first in range(0, messages, BATCH):
+        db.session.bulk_insert_mappings(Message, [
+            dict(user_id=1,
+                 text=' '.join(word(rank) for rank in
+                               rng.choices(ranks, weights, k=12)),
+                 timestamp=start + timedelta(seconds=i * 30))
+            for i in range(first, min(first + BATCH, messages))
+        ])
+        db.session.commit()
+
+
+def timed(query, runs):
+    times = []
+    for _ in range(runs):
+        db.session.expire_all()
+        start = time.perf_counter()
+        search(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    create_app('benchmark')
+    db.create_all()
+
+    start = time.perf_counter()
+    seed(args.messages)
+    print(f"seeded {args.messages} messages in "
+          f"{time.perf_counter() - start:.1f}s")
+
+    queries = {
+        'common': word(1),
+        'middling': word(100),
+        'rare': word(VOCABULARY),
+        'two words': f"{word(2)} {word(50)}",
+    }
+
+    print(f"{'query':>10} {'ms':>9}")
+    for name, query in queries.items():
+        print(f"{name:>10} {timed(query, args.runs):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
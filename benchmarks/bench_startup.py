@@ -0,0 +1,62 @@
+"""Measure Warbler's cold-start time.
+
+Each run starts a fresh interpreter and times importing the app module,
+create_app() for the given profile, the first database round-trip (which
+is when the engine and its pool are actually created) and the first
+request.
+
+run it like:
+
+    python -m benchmarks.bench_startup --profile benchmark --runs 10
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CHILD = '''
+import json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({profile!r})
+created = time.perf_counter()
+from models import db
+db.session.execute('SELECT 1')
+connected = time.perf_counter()
+app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps(dict(
+    import_ms=(imported - started) * 1000,
+    create_app_ms=(created - imported) * 1000,
+    connect_ms=(connected - created) * 1000,
+    first_request_ms=(served - connected) * 1000,
+    total_ms=(served - started) * 1000,
+)))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', default='benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, '-c',
+                              CHILD.format(profile=args.profile)],
+                             check=True, capture_output=True, text=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"cold start, profile={args.profile}, {args.runs} runs")
+    for phase in samples[0]:
+        values = [sample[phase] for sample in samples]
+        print(f"{phase:>17}: median {statistics.median(values):7.1f} ms, "
+              f"max {max(values):7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark trending counters under a sustained like rate.
+
+Simulates `--duration` seconds of likes arriving at `--rate` likes/second
+(with a simulated clock, so it runs as fast as the counters allow) and
+reports the cost of recording likes and of re-ranking each window.
+
+run it like:
+
+    python -m benchmarks.bench_trending --rate 2000 --duration 7200
+"""
+
+import argparse
+import random
+import time
+
+from trending import TrendingTracker, WINDOWS
+
+
+class SimulatedClock:
+    """A clock the benchmark advances by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=int, default=1000,
+                        help='likes per simulated second')
+    parser.add_argument('--duration', type=int, default=2 * 60 * 60,
+                        help='simulated seconds')
+    parser.add_argument('--messages', type=int, default=100000,
+                        help='number of distinct messages being liked')
+    parser.add_argument('--unlike-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    clock = SimulatedClock()
+    tracker = TrendingTracker(clock=clock)
+    rng = random.Random(0)
+
+    record_time = 0.0
+    rank_times = {window: [] for window in WINDOWS}
+
+    for second in range(args.duration):
+        clock.now = float(second)
+
+        # popular messages get most of the likes
+        likes = [int(rng.paretovariate(1.2)) % args.messages
+                 for _ in range(args.rate)]
+        deltas = [-1 if rng.random() < args.unlike_ratio else 1
+                  for _ in range(args.rate)]
+
+        start = time.perf_counter()
+        for message_id, delta in zip(likes, deltas):
+            tracker.record_like(message_id, delta)
+        record_time += time.perf_counter() - start
+
+        if second % 60 == 0:
+            for window in WINDOWS:
+                start = time.perf_counter()
+                tracker.snapshot(window)
+                rank_times[window].append(time.perf_counter() - start)
+
+    total_likes = args.rate * args.duration
+    print(f"likes recorded:    {total_likes}")
+    print(f"record throughput: {total_likes / record_time:,.0f} likes/s")
+    print(f"record latency:    {record_time / total_likes * 1e6:.2f} us/like")
+
+    for window, times in rank_times.items():
+        active = len(tracker.counters[window].totals)
+        print(f"{window:>4} ranking:      "
+              f"{sum(times) / len(times) * 1e3:.2f} ms avg, "
+              f"{max(times) * 1e3:.2f} ms max "
+              f"({active} active messages)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""Load-test Warbler with simulated user sessions.
+
+Each simulated session logs in as one of the seeded users (or signs up a
+new one), then takes --actions steps picked at random in the proportions
+given by --mix (browse the home feed, view a profile, follow, unfollow,
+like, post, search), pausing --think seconds on average between them.
+Throughput, error rate and latency percentiles are reported per action.
+
+The population is the seeded data in generator/*.csv, with every user's
+password set to --password. By default the load runs against the app
+in-process, on a throwaway SQLite file seeded from the CSVs. With --url it
+runs against a server instead; start it with WARBLER_CONFIG=benchmark (so
+there's no CSRF or rate limiting) and seed its database first with --seed.
+
+Sessions arrive in one of two ways:
+
+- closed loop (the default): --sessions users, each starting a new session
+  as soon as the last one ends, so load backs off as the app slows down;
+- open loop (--rate): new sessions arrive at random at --rate per second
+  however the app is coping. Action latencies are measured from when the
+  action was due, so time spent waiting for a free worker counts.
+
+run it like:
+
+    python -m benchmarks.loadgen --sessions 8 --duration 30
+    python -m benchmarks.loadgen --rate 5 --mix browse=60,post=10,search=30
+    python -m benchmarks.loadgen --url http://localhost:5000 --seed
+"""
+
+import argparse
+import csv
+import http.cookiejar
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import create_app
+from config import BenchmarkConfig
+from models import db, bcrypt, User, Message, Follows
+
+GENERATOR_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'generator')
+
+DEFAULT_MIX = {
+    'browse': 40,
+    'profile': 15,
+    'follow': 5,
+    'unfollow': 3,
+    'like': 15,
+    'post': 7,
+    'search': 15,
+}
+
+WORDS = ("warble song morning coffee city rain code music friends weekend "
+         "travel book garden sunset").split()
+
+
+##############################################################################
+# Population
+
+class Population:
+    """The seeded users, their follows and the messages, by id."""
+
+    def __init__(self, directory=GENERATOR_DIR):
+        with open(os.path.join(directory, 'users.csv')) as file:
+            self.users = [(id, row) for id, row in
+                          enumerate(csv.DictReader(file), start=1)]
+
+        with open(os.path.join(directory, 'messages.csv')) as file:
+            self.messages = [(id, row) for id, row in
+                             enumerate(csv.DictReader(file), start=1)]
+
+        with open(os.path.join(directory, 'follows.csv')) as file:
+            self.follows = list(csv.DictReader(file))
+
+        self.following = defaultdict(set)
+        for row in self.follows:
+            self.following[int(row['user_following_id'])].add(
+                int(row['user_being_followed_id']))
+
+        self.user_ids = [id for id, _ in self.users]
+        self.usernames = {id: row['username'] for id, row in self.users}
+        self.message_ids = [id for id, _ in self.messages]
+
+    def seed(self, password):
+        """Replace the app's database contents with the population."""
+
+        hashed = bcrypt.generate_password_hash(password).decode('UTF-8')
+
+        db.drop_all()
+        db.create_all()
+
+        db.session.bulk_insert_mappings(User, [
+            dict(row, id=id, password=hashed) for id, row in self.users])
+        db.session.bulk_insert_mappings(Message, [
+            dict(row, id=id, user_id=int(row['user_id']),
+                 timestamp=datetime.fromisoformat(row['timestamp']))
+            for id, row in self.messages])
+        db.session.bulk_insert_mappings(Follows, [
+            {key: int(value) for key, value in row.items()}
+            for row in self.follows])
+        db.session.commit()
+
+
+##############################################################################
+# Clients: one per session, each with its own cookies
+
+class AppClient:
+    """Requests against the app in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class HTTPClient:
+    """Requests against a server, without following redirects."""
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            self.NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+
+        try:
+            with self.opener.open(urllib.request.Request(
+                    self.url + path, data=body, method=method)) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+##############################################################################
+# Sessions
+
+class Session:
+    """One simulated user's visit."""
+
+    def __init__(self, client, population, rng, password):
+        self.client = client
+        self.population = population
+        self.rng = rng
+        self.password = password
+        self.user_id = None
+        self.following = set()
+
+    def pick_user(self):
+        return self.rng.choice(self.population.user_ids)
+
+    def login(self):
+        user_id = self.pick_user()
+        status = self.client.request('POST', '/login', {
+            'username': self.population.usernames[user_id],
+            'password': self.password,
+        })
+
+        self.user_id = user_id
+        self.following = set(self.population.following[user_id])
+
+        # a successful login redirects; a failed one shows the form again
+        return status if status == 302 else 401
+
+    def signup(self):
+        name = f"load{self.rng.getrandbits(48):x}"
+        status = self.client.request('POST', '/signup', {
+            'username': name,
+            'email': f"{name}@example.com",
+            'password': self.password,
+        })
+
+        return status if status == 302 else 409
+
+    def browse(self):
+        return self.client.request('GET', '/')
+
+    def profile(self):
+        return self.client.request('GET', f"/users/{self.pick_user()}")
+
+    def follow(self):
+        candidates = set(self.population.user_ids) - self.following
+        candidates.discard(self.user_id)
+        if not candidates or self.user_id is None:
+            return self.browse()
+
+        user_id = self.rng.choice(sorted(candidates))
+        status = self.client.request('POST', f"/users/follow/{user_id}")
+        self.following.add(user_id)
+        return status
+
+    def unfollow(self):
+        if not self.following or self.user_id is None:
+            return self.follow()
+
+        user_id = self.rng.choice(sorted(self.following))
+        status = self.client.request('POST', f"/users/stop-following/{user_id}")
+        self.following.discard(user_id)
+        return status
+
+    def like(self):
+        message_id = self.rng.choice(self.population.message_ids)
+        return self.client.request('POST', f"/users/add_like/{message_id}")
+
+    def post(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(3, 12))
+        if self.rng.random() < 0.3:
+            words.append(f"#{self.rng.choice(WORDS)}")
+        if self.rng.random() < 0.2:
+            words.append(f"@{self.population.usernames[self.pick_user()]}")
+
+        return self.client.request('POST', '/messages/new',
+                                   {'text': ' '.join(words)})
+
+    def search(self):
+        query = urllib.parse.urlencode({'q': self.rng.choice(WORDS)})
+        return self.client.request('GET', f"/search?{query}")
+
+
+##############################################################################
+# Running and reporting
+
+class Results:
+    """Latencies and errors by action, shared by every session."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, action, seconds, ok):
+        with self.lock:
+            self.latencies[action].append(seconds)
+            if not ok:
+                self.errors[action] += 1
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction),
+                             len(sorted_values) - 1)]
+
+
+def run_session(make_client, population, options, results, rng, deadline,
+                due=None):
+    """Run one session; `due` is when an open-loop session should've started."""
+
+    session = Session(make_client(), population, rng, options.password)
+    actions, weights = zip(*options.mix.items())
+
+    steps = ['signup' if rng.random() < options.signup else 'login']
+    steps += rng.choices(actions, weights, k=options.actions)
+
+    started = due or time.perf_counter()
+
+    for n, step in enumerate(steps):
+        # every session that arrived gets measured, however late it starts
+        now = time.perf_counter()
+        if n and now >= deadline:
+            return
+
+        try:
+            status = getattr(session, step)()
+            ok = status < 400
+        except Exception:
+            ok = False
+
+        # open loop: count from when this step was due, queueing included
+        results.add(step, time.perf_counter() - min(started, now), ok)
+
+        think = rng.expovariate(1 / options.think) if options.think else 0
+        started = time.perf_counter() + think
+        if think:
+            time.sleep(think)
+
+
+def closed_loop(make_client, population, options, results):
+    deadline = time.perf_counter() + options.duration
+
+    def worker(n):
+        rng = random.Random(options.random_seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            run_session(make_client, population, options, results, rng,
+                        deadline)
+
+    with ThreadPoolExecutor(options.sessions) as pool:
+        list(pool.map(worker, range(options.sessions)))
+
+
+def open_loop(make_client, population, options, results):
+    rng = random.Random(options.random_seed)
+    start = time.perf_counter()
+    deadline = start + options.duration
+
+    with ThreadPoolExecutor(options.sessions) as pool:
+        due = start
+        n = 0
+        while True:
+            due += rng.expovariate(options.rate)
+            if due >= deadline:
+                break
+
+            time.sleep(max(due - time.perf_counter(), 0))
+            n += 1
+            pool.submit(run_session, make_client, population, options,
+                        results, random.Random(options.random_seed * 1000 + n),
+                        deadline, due)
+
+
+def report(results, elapsed):
+    print(f"{'action':<9} {'count':>7} {'errors':>7} {'req/s':>7} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+    everything = []
+    for action in sorted(results.latencies):
+        latencies = sorted(results.latencies[action])
+        everything.extend(latencies)
+        _print_row(action, latencies, results.errors[action], elapsed)
+
+    _print_row('all', sorted(everything), sum(results.errors.values()),
+               elapsed)
+
+
+def _print_row(name, latencies, errors, elapsed):
+    if not latencies:
+        return
+
+    print(f"{name:<9} {len(latencies):>7} "
+          f"{errors / len(latencies):>6.1%} "
+          f"{len(latencies) / elapsed:>7.1f} "
+          f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+          f"{percentile(latencies, 0.9) * 1000:>8.1f} "
+          f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+          f"{latencies[-1] * 1000:>8.1f}")
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, text.split(',')):
+        action, weight = part.split('=')
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}")
+        mix[action] = float(weight)
+
+    return {action: weight for action, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='load this server rather than the app '
+                                      'in-process')
+    parser.add_argument('--seed', action='store_true',
+                        help="with --url, seed the database of the "
+                             "WARBLER_CONFIG app from the CSVs first")
+    parser.add_argument('--sessions', type=int, default=8,
+                        help='concurrent sessions (closed loop), or the most '
+                             'at once (open loop)')
+    parser.add_argument('--rate', type=float,
+                        help='new sessions per second (open loop)')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--actions', type=int, default=20,
+                        help='actions per session, after logging in')
+    parser.add_argument('--think', type=float, default=0,
+                        help='mean pause between actions, in seconds')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='action=weight,... (default %(default)s)')
+    parser.add_argument('--signup', type=float, default=0.05,
+                        help='fraction of sessions that sign up')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--random-seed', type=int, default=0)
+    options = parser.parse_args()
+
+    population = Population()
+
+    if options.url:
+        if options.seed:
+            with create_app().app_context():
+                population.seed(options.password)
+        make_client = lambda: HTTPClient(options.url)
+
+    else:
+        # a file rather than memory, so every thread sees the same database
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'load.sqlite')
+        url = os.environ.get('BENCHMARK_DATABASE_URL',
+                             f"sqlite:///{path}?timeout=30")
+
+        app = create_app(type('LoadConfig', (BenchmarkConfig,),
+                              {'SQLALCHEMY_DATABASE_URI': url}))
+        with app.app_context():
+            population.seed(options.password)
+        make_client = lambda: AppClient(app)
+
+    results = Results()
+    start = time.perf_counter()
+
+    if options.rate:
+        open_loop(make_client, population, options, results)
+    else:
+        closed_loop(make_client, population, options, results)
+
+    report(results, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
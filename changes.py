@@ -0,0 +1,355 @@
+"""Change events for cache invalidation.
+
+Caches need to hear when users, messages, follows and likes change,
+wherever in the code the change was made. Rather than every write path
+telling every cache, SQLAlchemy session events collect a Change for each
+row of those tables written in a transaction:
+
+- after_flush sees what the unit of work wrote, including follows added
+  or removed through User.following and User.followers;
+- after_bulk_update and after_bulk_delete see Query.update() and
+  Query.delete(), with whatever column == value conditions they had (say,
+  the user and message of an unlike);
+
+and after_commit publishes the transaction's changes, in one list, to the
+subscribers. A rollback discards them (a rolled back SAVEPOINT discards the
+whole transaction's, which at worst costs a cache a needless miss). Writes
+that go around the ORM, like the importer's multi-row INSERTs, publish
+their own changes with changes.publish().
+
+Subscribers run in the process that committed. To reach the caches of the
+other worker processes too, set CHANGES_CHANNEL to the path of a SQLite
+file: each worker appends its changes there and, at most every
+CHANGES_POLL_SECONDS, picks up the others' at the start of a request.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import BinaryExpression, BindParameter
+from sqlalchemy.sql.operators import eq, and_
+
+from models import User, Message, Follows, Likes
+
+# Change.values holds these columns of the row, where known
+TRACKED = {
+    User: ('id',),
+    Message: ('id', 'user_id', 'timestamp'),
+    Follows: ('user_being_followed_id', 'user_following_id'),
+    Likes: ('id', 'user_id', 'message_id'),
+}
+
+TABLES = {model.__table__: model for model in TRACKED}
+
+# how long the SQLite channel keeps changes for other workers, and how
+# often a worker deletes the older ones
+CHANNEL_RETENTION = 300
+CHANNEL_PRUNE_INTERVAL = 60
+
+log = logging.getLogger(__name__)
+
+
+class Change(namedtuple('Change', 'model action values columns')):
+    """A row written: model name, 'insert', 'update' or 'delete', some of its
+    TRACKED column values, and for updates the names of the columns set.
+    """
+
+    def to_json(self):
+        values = {name: value.isoformat() if hasattr(value, 'isoformat')
+                  else value for name, value in self.values.items()}
+        return [self.model, self.action, values, sorted(self.columns)]
+
+    @classmethod
+    def from_json(cls, data):
+        model, action, values, columns = data
+        if 'timestamp' in values:
+            values['timestamp'] = datetime.fromisoformat(values['timestamp'])
+        return cls(model, action, values, frozenset(columns))
+
+
+def _values(obj, model):
+    # only what's loaded: looking up an expired attribute here would query
+    state = obj.__dict__
+    return {name: state[name] for name in TRACKED[model] if name in state}
+
+
+def _criteria(clause):
+    """{column: value} for the `column == value` terms ANDed in `clause`."""
+
+    if clause is None:
+        return {}
+
+    if isinstance(clause, BinaryExpression):
+        if (clause.operator is eq and hasattr(clause.left, 'name')
+                and isinstance(clause.right, BindParameter)):
+            return {clause.left.name: clause.right.effective_value}
+        return {}
+
+    if getattr(clause, 'operator', None) is and_:
+        criteria = {}
+        for term in clause.clauses:
+            criteria.update(_criteria(term))
+        return criteria
+
+    return {}
+
+
+def _edges(obj):
+    """Follows rows added and removed through obj's secondary relationships."""
+
+    mapper = obj.__mapper__
+
+    for prop in mapper.relationships:
+        model = TABLES.get(prop.secondary)
+        if model is None:
+            continue
+
+        history = getattr(type(obj), prop.key).impl.get_history(
+            obj._sa_instance_state, obj._sa_instance_state.dict,
+            passive=True)
+
+        for action, others in (('insert', history.added),
+                               ('delete', history.deleted)):
+            for other in others or ():
+                values = {column.name: obj.__dict__.get(source.key)
+                          for source, column in prop.synchronize_pairs}
+                values.update({column.name: other.__dict__.get(source.key)
+                               for source, column
+                               in prop.secondary_synchronize_pairs})
+                yield Change(model.__name__, action, values, frozenset())
+
+
+class ChangeBus:
+    """Collect changes per session and publish them after commit."""
+
+    def __init__(self):
+        self.subscribers = []
+        self.remote_subscribers = []
+        self.channel = None
+
+    def subscribe(self, callback, models=None, remote=False):
+        """Call `callback(changes)` with each committed list of changes.
+
+        `models` (names) limits which changes it's given; with `remote`,
+        it's only given those other workers sent over the channel (which
+        arrive inside a request, or an app context, so it can query).
+        """
+
+        subscribers = self.remote_subscribers if remote else self.subscribers
+        subscribers.append((callback, models and set(models)))
+
+    def publish(self, changes, remote=False):
+        """Hand committed `changes` to subscribers (and other workers)."""
+
+        if not changes:
+            return
+
+        subscribers = self.subscribers
+        if remote:
+            subscribers = subscribers + self.remote_subscribers
+
+        for callback, models in subscribers:
+            wanted = [change for change in changes
+                      if models is None or change.model in models]
+            if wanted:
+                try:
+                    callback(wanted)
+                except Exception:
+                    # the commit has happened; a broken cache mustn't undo it
+                    log.exception("change subscriber %r failed", callback)
+
+        if self.channel is not None and not remote:
+            try:
+                self.channel.send(changes)
+            except Exception:
+                # as above: the commit has happened, so don't fail it
+                log.exception("sending changes to other workers failed")
+
+    def pending(self, session):
+        return session.info.setdefault('pending_changes', [])
+
+    def record(self, session, *changes):
+        """Add changes to `session`'s transaction, to publish on commit."""
+
+        self.pending(session).extend(changes)
+
+    ##########################################################################
+    # Session events
+
+    def after_flush(self, session, flush_context):
+        changes = self.pending(session)
+
+        for action, objects in (('insert', session.new),
+                                ('update', session.dirty),
+                                ('delete', session.deleted)):
+            for obj in objects:
+                model = type(obj)
+                if action != 'delete' and hasattr(obj, '__mapper__'):
+                    changes.extend(_edges(obj))
+
+                if model not in TRACKED:
+                    continue
+
+                columns = frozenset()
+                if action == 'update':
+                    columns = frozenset(
+                        attr.key for attr in obj._sa_instance_state.attrs
+                        if attr.key in obj.__mapper__.column_attrs
+                        and attr.history.has_changes())
+                    if not columns:
+                        continue
+
+                changes.append(Change(model.__name__, action,
+                                      _values(obj, model), columns))
+
+    def after_bulk(self, action):
+        def listener(context):
+            model = context.mapper.class_
+            if model not in TRACKED:
+                return
+
+            columns = frozenset()
+            if action == 'update':
+                columns = frozenset(getattr(key, 'key', key)
+                                    for key in context.values)
+
+            self.record(context.session, Change(
+                model.__name__, action,
+                _criteria(context.query.whereclause), columns))
+
+        return listener
+
+    def after_commit(self, session):
+        changes = session.info.pop('pending_changes', None)
+        if changes:
+            self.publish(_unique(changes))
+
+    def after_rollback(self, session):
+        session.info.pop('pending_changes', None)
+
+    def listen(self):
+        if event.contains(Session, 'after_flush', self.after_flush):
+            return
+
+        event.listen(Session, 'after_flush', self.after_flush)
+        event.listen(Session, 'after_bulk_update', self.after_bulk('update'))
+        event.listen(Session, 'after_bulk_delete', self.after_bulk('delete'))
+        event.listen(Session, 'after_commit', self.after_commit)
+        event.listen(Session, 'after_rollback', self.after_rollback)
+
+    def init_app(self, app):
+        self.listen()
+
+        path = app.config.get('CHANGES_CHANNEL')
+        if path:
+            self.channel = SQLiteChannel(
+                path, poll_interval=app.config.get('CHANGES_POLL_SECONDS', 1))
+            app.before_request(lambda: self.channel.poll(self))
+
+
+def _unique(changes):
+    # the same follow can be seen from both of its users
+    seen = set()
+    unique = []
+
+    for change in changes:
+        key = (change.model, change.action,
+               tuple(sorted(change.values.items())), change.columns)
+        if key not in seen:
+            seen.add(key)
+            unique.append(change)
+
+    return unique
+
+
+class SQLiteChannel:
+    """Pass changes between the worker processes on this machine."""
+
+    def __init__(self, path, poll_interval=1, retention=CHANNEL_RETENTION,
+                 prune_interval=CHANNEL_PRUNE_INTERVAL, clock=time.time):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.clock = clock
+        self.local = threading.local()
+        self.last_seq = None
+        self.last_poll = 0
+        self.last_prune = 0
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        # connections can't cross threads or a fork; see ratelimit.py
+        conn = getattr(self.local, 'conn', None)
+
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS changes ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'pid INTEGER NOT NULL, '
+                         'at REAL NOT NULL, '
+                         'data TEXT NOT NULL)')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+
+        return conn
+
+    def send(self, changes):
+        now = self.clock()
+        conn = self._connection()
+
+        conn.execute('INSERT INTO changes (pid, at, data) VALUES (?, ?, ?)',
+                      (os.getpid(), now,
+                       json.dumps([change.to_json() for change in changes])))
+
+        # not on every commit: the DELETE scans for old rows each time
+        with self.lock:
+            if now - self.last_prune < self.prune_interval:
+                return
+            self.last_prune = now
+
+        conn.execute('DELETE FROM changes WHERE at < ?',
+                     (now - self.retention,))
+
+    def receive(self):
+        """Changes other processes sent since the last call."""
+
+        conn = self._connection()
+
+        with self.lock:
+            if self.last_seq is None:
+                # start from now, not from whatever is still in the file
+                self.last_seq = conn.execute(
+                    'SELECT coalesce(max(seq), 0) FROM changes').fetchone()[0]
+                return []
+
+            rows = conn.execute('SELECT seq, pid, data FROM changes '
+                                'WHERE seq > ? ORDER BY seq',
+                                (self.last_seq,)).fetchall()
+            if rows:
+                self.last_seq = rows[-1][0]
+
+        return [Change.from_json(data)
+                for _, pid, batch in rows if pid != os.getpid()
+                for data in json.loads(batch)]
+
+    def poll(self, bus):
+        now = self.clock()
+        if now - self.last_poll < self.poll_interval:
+            return
+
+        self.last_poll = now
+        bus.publish(self.receive(), remote=True)
+
+
+# The bus shared by every session and cache in this process.
+changes = ChangeBus()
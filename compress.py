@@ -0,0 +1,165 @@
+"""Response compression.
+
+WSGI middleware that gzips (or, with the optional brotli package installed,
+brotli-compresses) text responses for clients that accept it. It compresses
+each chunk as the app yields it and flushes the compressor after each one,
+so a streamed page still goes out piece by piece: compression doesn't undo
+the early first byte. It flushes after the first chunk and then once every
+FLUSH_SIZE bytes of input, since every flush costs some compression. Small
+buffered responses (under COMPRESS_MIN_SIZE bytes) aren't worth it and go
+out as they are, as do event streams, which are all small, long-lived
+writes.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FLUSH_SIZE = 16 * 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'image/svg+xml',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+}
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows."""
+
+    accepted = set()
+
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+
+    return accepted
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits 31: a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data, flush):
+        data = self.compressor.compress(data)
+        if flush:
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data, flush):
+        data = self.compressor.process(data)
+        if flush:
+            data += self.compressor.flush()
+        return data
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compressor:
+    """Compress an app's responses."""
+
+    def __init__(self, app, level=6, brotli_quality=4, min_size=500,
+                 flush_size=FLUSH_SIZE):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.flush_size = flush_size
+
+    def encoder(self, environ):
+        """An encoder for the best coding the client accepts, or None."""
+
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+
+        if brotli is not None and 'br' in accepted:
+            return BrotliEncoder(self.brotli_quality)
+        if 'gzip' in accepted:
+            return GzipEncoder(self.level)
+        return None
+
+    def compressible(self, status, headers):
+        headers = {name.lower(): value for name, value in headers}
+        mimetype = headers.get('content-type', '').split(';')[0].strip()
+        length = headers.get('content-length')
+
+        return (status[:3] not in ('204', '206', '304')
+                and mimetype in COMPRESSIBLE_TYPES
+                and 'content-encoding' not in headers
+                and (length is None or int(length) >= self.min_size))
+
+    def __call__(self, environ, start_response):
+        encoder = self.encoder(environ)
+        if encoder is None:
+            return self.app(environ, start_response)
+
+        compressing = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            if self.compressible(status, headers):
+                compressing.append(True)
+                vary = [value for name, value in headers
+                        if name.lower() == 'vary'] + ['Accept-Encoding']
+                headers = [(name, value) for name, value in headers
+                           if name.lower() not in ('content-length', 'vary')]
+                headers.append(('Content-Encoding', encoder.name))
+                headers.append(('Vary', ', '.join(vary)))
+
+            return start_response(status, headers, exc_info)
+
+        # Flask has called start_response by the time it returns
+        body = self.app(environ, compressing_start_response)
+        if not compressing:
+            return body
+
+        return self.compress(body, encoder)
+
+    def compress(self, body, encoder):
+        # the first chunk goes out at once; after that, every flush_size bytes
+        unflushed = self.flush_size
+
+        try:
+            for data in body:
+                unflushed += len(data)
+                flush = unflushed >= self.flush_size
+                if flush:
+                    unflushed = 0
+
+                data = encoder.chunk(data, flush)
+                if data:
+                    yield data
+
+            yield encoder.finish()
+
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
@@ -0,0 +1,154 @@
+"""Configuration profiles for create_app()."""
+
+import os
+import tempfile
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres:///warbler')
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # only set up the debug toolbar (and import it) when asked for
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    RATELIMIT_ENABLED = True
+
+    # /metrics is open to local clients only, unless they send
+    # "Authorization: Bearer <METRICS_TOKEN>"
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # run message imports in a background thread
+    IMPORT_IN_BACKGROUND = True
+
+    # archive.py moves messages older than this out of the messages table
+    ARCHIVE_AFTER_DAYS = 365
+
+    # Optionally shard messages and likes by user (see sharding.py) across
+    # the databases in SHARD_DATABASE_URLS, a comma-separated list.
+    SQLALCHEMY_BINDS = {
+        f'shard{i}': url for i, url in enumerate(
+            url for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',')
+            if url)
+    }
+    SHARDS = list(SQLALCHEMY_BINDS)
+
+    # log statements taking at least this long (0 turns it off); see slowlog.py
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', os.path.join(
+        tempfile.gettempdir(), 'warbler-slow-queries.log'))
+    SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 5
+
+    # Profile requests carrying this token, and/or one in this many requests
+    # at random (0 for none); see profiler.py
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+    PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL_MS = 5
+    PROFILE_FORMAT = 'collapsed'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(
+        tempfile.gettempdir(), 'warbler-profiles'))
+
+    # split each statement's time into compiling and executing, served at
+    # /metrics/queries; see queries.py
+    QUERY_TIMING = os.environ.get('QUERY_TIMING', '') == '1'
+
+    # share committed changes with the other workers through this SQLite
+    # file, checking for theirs at most every CHANGES_POLL_SECONDS; see
+    # changes.py. Set it whenever there's more than one worker: without
+    # it, each worker's follow graph (see graph.py) never hears of the
+    # others' follows
+    CHANGES_CHANNEL = os.environ.get('CHANGES_CHANNEL')
+    CHANGES_POLL_SECONDS = 1
+
+    # memory-map the follow graph from a snapshot in this directory, written
+    # by `python graph.py build`, replaying the follows journaled since; see
+    # graph.py
+    GRAPH_PATH = os.environ.get('GRAPH_PATH')
+
+    # push new messages to open home pages over /feed/stream; each open
+    # stream holds a worker, so only turn this on with a cooperative worker
+    # (gunicorn -k gevent); see live.py
+    LIVE_FEED = os.environ.get('LIVE_FEED', '') == '1'
+
+    # send long pages as they're rendered, this many template chunks at a time
+    STREAM_TEMPLATES = True
+    STREAM_BUFFER = 20
+
+    # gzip (or brotli, if installed) responses; see compress.py
+    COMPRESS = True
+    COMPRESS_LEVEL = 6
+    BROTLI_QUALITY = 4
+    COMPRESS_MIN_SIZE = 500
+
+
+class DevelopmentConfig(Config):
+    """Local development: debug toolbar on."""
+
+    DEBUG_TOOLBAR = True
+
+
+class ProductionConfig(Config):
+    """Production: no debugging aids."""
+
+
+class TestConfig(Config):
+    """Unit tests."""
+
+    TESTING = True
+
+    # in-memory SQLite by default; set TEST_DATABASE_URL (e.g. to
+    # postgresql:///warbler-test) to test against Postgres
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+
+    # cheap password hashes; the tests hash a lot of them
+    BCRYPT_LOG_ROUNDS = 4
+
+    # Don't have WTForms use CSRF at all, since it's a pain to test
+    WTF_CSRF_ENABLED = False
+
+    # Tests log in and sign up far faster than a person would
+    RATELIMIT_ENABLED = False
+
+    # background threads can't see the test's uncommitted transaction
+    IMPORT_IN_BACKGROUND = False
+
+    # sharding tests set up their own shards
+    SQLALCHEMY_BINDS = {}
+    SHARDS = []
+
+    # the live feed tests stream from the test client, not a worker
+    LIVE_FEED = True
+
+    # slow query tests turn it on for themselves
+    SLOW_QUERY_MS = 0
+    PROFILE_TOKEN = ''
+    PROFILE_SAMPLE_RATE = 0
+
+
+class BenchmarkConfig(Config):
+    """Benchmarks: production settings against a throwaway database."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'BENCHMARK_DATABASE_URL', 'sqlite://')
+
+    WTF_CSRF_ENABLED = False
+    RATELIMIT_ENABLED = False
+
+    # timing is the benchmark's job
+    SLOW_QUERY_MS = 0
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'test': TestConfig,
+    'benchmark': BenchmarkConfig,
+}
@@ -0,0 +1,173 @@
+"""Streaming export of a user's data as NDJSON or CSV.
+
+Every section is read with a server-side cursor (`yield_per` plus
+`stream_results`) and written out as it is read, so memory use stays flat
+however many rows a user has. Output can be gzipped on the fly.
+"""
+
+import csv
+import io
+import zlib
+from itertools import chain
+
+from sqlalchemy.orm import aliased
+
+from api import dumps
+from archive import all_archived
+from models import db, User, Message, Likes, Follows
+from sharding import router
+
+BATCH_SIZE = 1000
+
+# flush output to the client in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = ['type', 'id', 'user_id', 'username', 'text', 'timestamp']
+
+
+def _stream(query):
+    return query.execution_options(stream_results=True).yield_per(BATCH_SIZE)
+
+
+def _liked_messages(user_id):
+    """(id, author id, text, timestamp) of each message the user liked."""
+
+    session = router.session_for(user_id)
+
+    if not router.enabled:
+        yield from _stream(session
+                           .query(Message.id, Message.user_id, Message.text,
+                                  Message.timestamp)
+                           .join(Likes, Likes.message_id == Message.id)
+                           .filter(Likes.user_id == user_id)
+                           .order_by(Likes.id))
+        return
+
+    # the likes are on the user's shard, the messages on their authors'
+    likes = _stream(session
+                    .query(Likes.message_id)
+                    .filter(Likes.user_id == user_id)
+                    .order_by(Likes.id))
+
+    batch = []
+    for (message_id,) in likes:
+        batch.append(message_id)
+        if len(batch) == BATCH_SIZE:
+            yield from _message_rows(batch)
+            batch = []
+    yield from _message_rows(batch)
+
+
+def _message_rows(ids):
+    found = router.get_messages(ids)
+    for id in ids:
+        if id in found:
+            msg = found[id]
+            yield msg.id, msg.user_id, msg.text, msg.timestamp
+
+
+def export_records(user_id):
+    """Yield a dict for each of the user's messages, likes and follows."""
+
+    messages = (router.session_for(user_id)
+                .query(Message.id, Message.text, Message.timestamp)
+                .filter(Message.user_id == user_id)
+                .order_by(Message.id))
+
+    # archived messages (the oldest, liked ones aside) first
+    archived = ((msg.id, msg.text, msg.timestamp)
+                for msg in all_archived(user_id))
+
+    for id, text, timestamp in chain(archived, _stream(messages)):
+        yield {'type': 'message', 'id': id, 'text': text,
+               'timestamp': timestamp.isoformat()}
+
+    for id, author_id, text, timestamp in _liked_messages(user_id):
+        yield {'type': 'like', 'id': id, 'user_id': author_id, 'text': text,
+               'timestamp': timestamp.isoformat()}
+
+    other = aliased(User)
+    sections = [
+        ('follower', Follows.user_following_id, Follows.user_being_followed_id),
+        ('following', Follows.user_being_followed_id, Follows.user_following_id),
+    ]
+
+    for kind, other_id, this_id in sections:
+        follows = (db.session
+                   .query(other.id, other.username)
+                   .join(Follows, other_id == other.id)
+                   .filter(this_id == user_id)
+                   .order_by(other.id))
+
+        for id, username in _stream(follows):
+            yield {'type': kind, 'user_id': id, 'username': username}
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield dumps(record) + b'\n'
+
+
+def csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue().encode()
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """Join small byte strings into chunks of roughly `size` bytes."""
+
+    chunk = []
+    length = 0
+
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+
+        if length >= size:
+            yield b''.join(chunk)
+            chunk = []
+            length = 0
+
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzipped(chunks):
+    """Gzip a stream of byte chunks on the fly."""
+
+    compressor = zlib.compressobj(wbits=31)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+def export_stream(user_id, format='ndjson', compress=False):
+    """Return (byte chunk generator, mimetype, filename) for an export."""
+
+    to_lines, mimetype = FORMATS[format]
+    stream = chunked(to_lines(export_records(user_id)))
+    filename = f"warbler-export-{user_id}.{format}"
+
+    if compress:
+        return gzipped(stream), 'application/gzip', f"{filename}.gz"
+
+    return stream, mimetype, filename
@@ -0,0 +1,185 @@
+"""Home feed assembled from per-author timeline caches.
+
+Rather than asking the database for the newest messages of every followed
+author at once (`user_id IN (...) ORDER BY timestamp`), we keep a bounded
+cache of each author's most recent (timestamp, id) pairs and build the feed
+with a k-way heap merge of the followed authors' lists. Only authors
+missing from the cache are loaded from SQL, in one query per shard.
+
+The cache follows committed changes (see changes.py): a new message is
+pushed onto its author's cached timeline, and deleting a message (or the
+author) invalidates it. With a CHANGES_CHANNEL, that includes changes made
+by other workers; without one, entries expiring after `ttl` seconds bound
+how stale a worker's cache can get when another worker posts.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from sqlalchemy import func
+
+from changes import changes
+from models import Message
+from sharding import router
+
+FEED_SIZE = 100
+
+# each author's cached timeline must hold a whole feed's worth of messages
+# for the merge to be exact
+PER_AUTHOR = FEED_SIZE
+MAX_AUTHORS = 100000
+TTL = 60
+
+
+class TimelineCache:
+    """LRU cache of author id -> newest (timestamp, message id) pairs."""
+
+    def __init__(self, per_author=PER_AUTHOR, max_authors=MAX_AUTHORS,
+                 ttl=TTL, clock=time.monotonic):
+        self.per_author = per_author
+        self.max_authors = max_authors
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, author_ids):
+        """Return ({author_id: timeline}, [missing author ids])."""
+
+        now = self.clock()
+        found = {}
+        missing = []
+
+        with self.lock:
+            for author_id in author_ids:
+                entry = self.entries.get(author_id)
+
+                if entry is None or now - entry[0] > self.ttl:
+                    missing.append(author_id)
+                else:
+                    self.entries.move_to_end(author_id)
+                    found[author_id] = entry[1]
+
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def set(self, author_id, timeline):
+        """Cache an author's timeline, newest first."""
+
+        with self.lock:
+            self.entries[author_id] = (self.clock(),
+                                       timeline[:self.per_author])
+            self.entries.move_to_end(author_id)
+
+            while len(self.entries) > self.max_authors:
+                self.entries.popitem(last=False)
+
+    def push(self, author_id, timestamp, message_id):
+        """Add a new message to an author's cached timeline, if cached."""
+
+        with self.lock:
+            entry = self.entries.get(author_id)
+            if entry is None or (timestamp, message_id) in entry[1]:
+                return
+
+            timeline = [(timestamp, message_id)] + entry[1]
+            timeline.sort(reverse=True)
+            self.entries[author_id] = (entry[0], timeline[:self.per_author])
+
+    def invalidate(self, author_id):
+        with self.lock:
+            self.entries.pop(author_id, None)
+
+    def apply(self, changes):
+        """Bring the cache up to date with committed Message and User changes."""
+
+        for change in changes:
+            values = change.values
+
+            if change.model == 'User' and change.action == 'delete':
+                self.invalidate(values.get('id'))
+
+            elif change.model != 'Message' or 'user_id' not in values:
+                continue
+
+            elif (change.action == 'insert'
+                  and {'id', 'timestamp'} <= values.keys()):
+                self.push(values['user_id'], values['timestamp'], values['id'])
+
+            else:
+                self.invalidate(values['user_id'])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def load_timelines(author_ids, per_author):
+    """Load the newest `per_author` messages of each author in one query.
+
+    Returns {author_id: [(timestamp, message_id), ...]}, newest first, with
+    an entry (maybe empty) for every requested author.
+    """
+
+    rank = (func.row_number()
+            .over(partition_by=Message.user_id,
+                  order_by=(Message.timestamp.desc(), Message.id.desc()))
+            .label('rank'))
+
+    timelines = {author_id: [] for author_id in author_ids}
+
+    # one query per shard holding any of the authors
+    for session, shard_author_ids in router.group_by_shard(author_ids):
+        ranked = (session
+                  .query(Message.user_id, Message.timestamp, Message.id, rank)
+                  .filter(Message.user_id.in_(shard_author_ids))
+                  .subquery())
+
+        rows = (session
+                .query(ranked.c.user_id, ranked.c.timestamp, ranked.c.id)
+                .filter(ranked.c.rank <= per_author)
+                .order_by(ranked.c.user_id, ranked.c.rank))
+
+        for author_id, timestamp, message_id in rows:
+            timelines[author_id].append((timestamp, message_id))
+
+    return timelines
+
+
+def feed_message_ids(author_ids, limit=FEED_SIZE, cache=None):
+    """Return ids of the `limit` newest messages by any of `author_ids`."""
+
+    if cache is None:
+        cache = timelines
+
+    found, missing = cache.get_many(author_ids)
+
+    if missing:
+        loaded = load_timelines(missing, cache.per_author)
+        for author_id, timeline in loaded.items():
+            cache.set(author_id, timeline)
+        found.update(loaded)
+
+    merged = heapq.merge(*found.values(), reverse=True)
+    return [message_id for _, message_id in islice(merged, limit)]
+
+
+def home_feed(author_ids, limit=FEED_SIZE, cache=None):
+    """Return the `limit` newest messages by any of `author_ids`, newest first."""
+
+    ids = feed_message_ids(author_ids, limit, cache)
+    by_id = router.get_messages(ids)
+
+    return [by_id[message_id] for message_id in ids if message_id in by_id]
+
+
+# Cache shared by every request in this worker.
+timelines = TimelineCache()
+changes.subscribe(timelines.apply, models={'Message', 'User'})
@@ -0,0 +1,181 @@
+"""Follow and unfollow writes.
+
+Following or unfollowing through User.following.append() and .remove()
+loads the user's whole following collection to change one row. These write
+the follows table directly instead, for any number of users at once:
+
+- follow() finds which of the users exist and aren't followed yet in one
+  SELECT, then adds them, ignoring edges another request added in
+  between: on Postgres in one multi-row INSERT ... ON CONFLICT DO NOTHING
+  RETURNING the rows it added, on SQLite (which runs a multi-row INSERT a
+  row at a time anyway, in process) one INSERT OR IGNORE per row, whose
+  rowcount says whether it added it. Only the follows it added are
+  returned and recorded;
+- unfollow() finds which are followed, then deletes them in one DELETE
+  ... WHERE IN;
+
+a batch of BATCH_SIZE ids at a time. The caller commits. Since these go
+around the unit of work, they record their own Follows changes for the
+change bus (see changes.py).
+
+To follow or unfollow a list of users (say, an imported contact list), run:
+
+    python follows.py follow USERNAME 12 34 56
+    python follows.py unfollow USERNAME --file ids.txt
+"""
+
+import argparse
+import re
+import sys
+
+from sqlalchemy import and_
+
+from changes import Change, changes
+from models import db, User, Follows
+
+# ids per statement, well under SQLite's 999 bound parameters
+BATCH_SIZE = 500
+
+
+def _batches(user_ids, size):
+    user_ids = list(dict.fromkeys(user_ids))
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+
+def _insert_new(session, follower_id, user_ids):
+    """Add the follows, ignoring any that exist; returns the ids added."""
+
+    table = Follows.__table__
+    rows = [{'user_following_id': follower_id,
+             'user_being_followed_id': user_id} for user_id in user_ids]
+
+    if session.get_bind(Follows.__mapper__).dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+
+        added = {user_id for (user_id,) in session.execute(
+            insert(table)
+            .values(rows)
+            .on_conflict_do_nothing()
+            .returning(table.c.user_being_followed_id))}
+        return [user_id for user_id in user_ids if user_id in added]
+
+    statement = table.insert().prefix_with('OR IGNORE', dialect='sqlite')
+    return [row['user_being_followed_id'] for row in rows
+            if session.execute(statement, row).rowcount]
+
+
+def _record(session, action, follower_id, user_ids):
+    changes.record(session, *[
+        Change('Follows', action, {'user_following_id': follower_id,
+                                   'user_being_followed_id': user_id},
+               frozenset())
+        for user_id in user_ids])
+
+
+def follow(follower_id, user_ids, session=None, batch_size=BATCH_SIZE):
+    """Have `follower_id` follow `user_ids`; the caller commits.
+
+    Returns the ids newly followed: not the follower, users already
+    followed or ids of no user.
+    """
+
+    session = session or db.session
+    followed = []
+
+    for batch in _batches(user_ids, batch_size):
+        rows = (session
+                .query(User.id, Follows.user_following_id)
+                .outerjoin(Follows, and_(
+                    Follows.user_being_followed_id == User.id,
+                    Follows.user_following_id == follower_id))
+                .filter(User.id.in_(batch)))
+
+        fresh = {user_id for user_id, existing in rows if existing is None}
+        new = [user_id for user_id in batch
+               if user_id in fresh and user_id != follower_id]
+        if not new:
+            continue
+
+        added = _insert_new(session, follower_id, new)
+        if added:
+            _record(session, 'insert', follower_id, added)
+            followed.extend(added)
+
+    return followed
+
+
+def unfollow(follower_id, user_ids, session=None, batch_size=BATCH_SIZE):
+    """Have `follower_id` stop following `user_ids`; the caller commits.
+
+    Returns the ids that were followed.
+    """
+
+    session = session or db.session
+    table = Follows.__table__
+    unfollowed = []
+
+    for batch in _batches(user_ids, batch_size):
+        existing = [user_id for (user_id,) in (
+            session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == follower_id,
+                    Follows.user_being_followed_id.in_(batch)))]
+        if not existing:
+            continue
+
+        session.execute(table.delete().where(and_(
+            table.c.user_following_id == follower_id,
+            table.c.user_being_followed_id.in_(existing))))
+        _record(session, 'delete', follower_id, existing)
+        unfollowed.extend(existing)
+
+    return unfollowed
+
+
+def parse_ids(values):
+    """Integer ids from strings of ids separated by commas or whitespace."""
+
+    return [int(value) for text in values
+            for value in re.split(r'[\s,]+', text) if value]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['follow', 'unfollow'])
+    parser.add_argument('username')
+    parser.add_argument('ids', nargs='*', help='user ids')
+    parser.add_argument('--file', help="file of user ids ('-' for stdin)")
+    args = parser.parse_args()
+
+    texts = list(args.ids)
+    if args.file:
+        with (sys.stdin if args.file == '-' else open(args.file)) as file:
+            texts.append(file.read())
+
+    try:
+        user_ids = parse_ids(texts)
+    except ValueError:
+        parser.error("user ids must be integers")
+
+    from app import create_app
+    from notifications import deliver, follow_event
+
+    with create_app().app_context():
+        user = User.query.filter_by(username=args.username).first()
+        if not user:
+            parser.error(f"no user named {args.username}")
+
+        if args.action == 'follow':
+            done = follow(user.id, user_ids)
+            deliver([follow_event(user.id, user_id) for user_id in done])
+        else:
+            done = unfollow(user.id, user_ids)
+        db.session.commit()
+
+    print(f"{args.username}: {args.action}ed {len(done)} of "
+          f"{len(set(user_ids))} users.")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,15 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length
 
+# same as the length of Message.text
+MAX_MESSAGE_LENGTH = 140
+
 
 class MessageForm(FlaskForm):
     """Form for adding/editing messages."""
 
-    text = TextAreaField('text', validators=[DataRequired()])
+    text = TextAreaField('text', validators=[DataRequired(),
+                                             Length(max=MAX_MESSAGE_LENGTH)])
 
 
 class UserAddForm(FlaskForm):
@@ -0,0 +1,636 @@
+"""In-memory social graph.
+
+The follows table held as two CSR (compressed sparse row) adjacency
+arrays, one per direction: for user u, indices[indptr[u]:indptr[u + 1]] are
+the sorted ids of the users u follows (or of u's followers). That's 4 bytes
+per edge per direction plus 8 per user id, so 100M follows take about
+1.6 GB, and questions about the graph never build User objects:
+
+- is_following(a, b) is a binary search of a's row: O(log degree);
+- following_count() and followers_count() are O(1);
+- mutuals(), common_followers() and common_following() intersect sorted
+  rows;
+- neighborhood() walks k hops, gathering each hop's rows at once.
+
+Follows and unfollows committed after the arrays were built (see
+changes.py) are kept as small per-user sets of added and removed edges on
+top of them, and merged in once there are more than MAX_DELTA.
+
+Queries and changes take the graph's lock, so a request never reads the
+added and removed edges while a commit (or merging them) changes them.
+
+`python graph.py build` saves a snapshot as .npy files in GRAPH_PATH. A
+worker then memory-maps it rather than reading the follows table, so it
+starts quickly and every worker on the machine shares one copy in the page
+cache.
+
+With GRAPH_PATH set, every commit also journals its follows, unfollows
+and user deletions to the follow_changes table, in the same transaction.
+The snapshot records the last journal entry it includes, and a worker
+loading it replays only the entries after that (from REPLAY_OVERLAP
+before, for transactions that committed out of order); replaying a
+change twice does no harm. Each build prunes the entries older than that.
+
+wsgi.py loads the graph when the server starts (see FollowGraph.preload);
+elsewhere, like the development server, it's loaded on first use.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from changes import changes, Change
+
+MAX_DELTA = 100000
+
+# rows read from the follows table (or the journal) at a time
+BUILD_BATCH = 1000000
+
+# journal entries before a snapshot's last that are replayed too, in case
+# they were committed after it was read
+REPLAY_OVERLAP = 1000
+
+ARRAYS = ('following_indptr', 'following_indices',
+          'followers_indptr', 'followers_indices')
+
+EMPTY = np.array([], dtype=np.int32)
+
+log = logging.getLogger(__name__)
+
+
+def journaled(change):
+    return change.model == 'Follows' or (change.model == 'User'
+                                         and change.action == 'delete')
+
+
+def journal_seq(session):
+    """The last follow_changes entry's seq (0 if there are none)."""
+
+    from models import FollowChange
+
+    return session.query(func.max(FollowChange.seq)).scalar() or 0
+
+
+def read_journal(session, after, batch_size=BUILD_BATCH):
+    """Yield lists of the changes journaled after entry `after`, in order."""
+
+    from models import FollowChange
+
+    while True:
+        rows = (session
+                .query(FollowChange.seq, FollowChange.data)
+                .filter(FollowChange.seq > after)
+                .order_by(FollowChange.seq)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            return
+
+        after = rows[-1][0]
+        yield [Change.from_json(json.loads(data)) for _, data in rows]
+
+
+def prune_journal(session, seq):
+    """Delete the entries no snapshot from entry `seq` on will replay."""
+
+    from models import FollowChange
+
+    deleted = (session
+               .query(FollowChange)
+               .filter(FollowChange.seq <= seq - REPLAY_OVERLAP)
+               .delete(synchronize_session=False))
+    session.commit()
+    return deleted
+
+
+def apply_changes(graph, changes):
+    """Follow committed follows, unfollows and user deletions."""
+
+    for change in changes:
+        values = change.values
+
+        if change.model == 'User':
+            if change.action == 'delete' and 'id' in values:
+                graph.remove_user(values['id'])
+            continue
+
+        follower_id = values.get('user_following_id')
+        followed_id = values.get('user_being_followed_id')
+        if follower_id is None or followed_id is None:
+            continue
+
+        if change.action == 'insert':
+            graph.follow(follower_id, followed_id)
+        elif change.action == 'delete':
+            graph.unfollow(follower_id, followed_id)
+
+
+class Adjacency:
+    """One direction of the graph: a sorted row of neighbor ids per user."""
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def build(cls, sources, targets, size):
+        """From parallel arrays of edges (duplicates are dropped)."""
+
+        # sort by (source, target) as one 64-bit key, in place
+        keys = np.asarray(sources, dtype=np.int64) << 32
+        keys |= np.asarray(targets, dtype=np.int64)
+        keys.sort()
+        if len(keys):
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+        sources = (keys >> 32).astype(np.int64)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+
+        return cls(indptr, (keys & 0xFFFFFFFF).astype(np.int32))
+
+    @property
+    def size(self):
+        return len(self.indptr) - 1
+
+    def row(self, node):
+        if node >= self.size:
+            return EMPTY
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def degree(self, node):
+        if node >= self.size:
+            return 0
+        return int(self.indptr[node + 1] - self.indptr[node])
+
+    def has(self, node, other):
+        row = self.row(node)
+        i = np.searchsorted(row, other)
+        return bool(i < len(row) and row[i] == other)
+
+    def gather(self, nodes):
+        """The rows of `nodes`, concatenated."""
+
+        nodes = nodes[nodes < self.size]
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+
+        # the index of each element of each row in self.indices
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.indices[offsets + np.arange(len(offsets))]
+
+    def edges(self):
+        """(sources, targets) arrays of every edge."""
+
+        sources = np.repeat(np.arange(self.size, dtype=np.int64),
+                            np.diff(self.indptr))
+        return sources, self.indices
+
+
+class Direction:
+    """An Adjacency and the edges added to and removed from it since."""
+
+    def __init__(self, base):
+        self.base = base
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+
+    def has(self, node, other):
+        if other in self.added.get(node, ()):
+            return True
+        if other in self.removed.get(node, ()):
+            return False
+        return self.base.has(node, other)
+
+    def add(self, node, other):
+        if other in self.removed.get(node, ()):
+            self.removed[node].discard(other)
+        elif not self.base.has(node, other):
+            self.added[node].add(other)
+
+    def remove(self, node, other):
+        if other in self.added.get(node, ()):
+            self.added[node].discard(other)
+        elif self.base.has(node, other):
+            self.removed[node].add(other)
+
+    def degree(self, node):
+        return (self.base.degree(node) + len(self.added.get(node, ()))
+                - len(self.removed.get(node, ())))
+
+    def row(self, node):
+        """Sorted neighbor ids of `node`."""
+
+        row = self.base.row(node)
+        added = self.added.get(node)
+        removed = self.removed.get(node)
+
+        if removed:
+            row = row[~np.isin(row, list(removed))]
+        if added:
+            row = np.union1d(row, np.fromiter(added, dtype=np.int32))
+
+        return row
+
+    def gather(self, nodes):
+        """Neighbors of all `nodes`, with repeats."""
+
+        changed = np.fromiter(set(self.added) | set(self.removed),
+                              dtype=np.int64)
+        is_changed = np.isin(nodes, changed)
+
+        return np.concatenate([self.base.gather(nodes[~is_changed])]
+                              + [self.row(node) for node in nodes[is_changed]])
+
+    def delta_size(self):
+        return (sum(map(len, self.added.values()))
+                + sum(map(len, self.removed.values())))
+
+    def compact(self):
+        """Merge the added and removed edges into a new base."""
+
+        sources, targets = self.base.edges()
+
+        removed = [(node << 32) | other for node, others in self.removed.items()
+                   for other in others]
+        if removed:
+            keep = ~np.isin((sources << 32) | targets, removed)
+            sources, targets = sources[keep], targets[keep]
+
+        added = [(node, other) for node, others in self.added.items()
+                 for other in others]
+        if added:
+            added = np.array(added, dtype=np.int64)
+            sources = np.concatenate([sources, added[:, 0]])
+            targets = np.concatenate([targets, added[:, 1]])
+
+        size = max(self.base.size, int(sources.max()) + 1 if len(sources) else 0)
+        self.base = Adjacency.build(sources, targets, size)
+        self.added.clear()
+        self.removed.clear()
+
+
+class SocialGraph:
+    """Who follows whom."""
+
+    def __init__(self, following, followers, max_delta=MAX_DELTA):
+        self.following = Direction(following)
+        self.followers = Direction(followers)
+        self.max_delta = max_delta
+        # reentrant, so queries can be built from other queries
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_edges(cls, follower_ids, followed_ids, **kwargs):
+        follower_ids = np.asarray(follower_ids, dtype=np.int64)
+        followed_ids = np.asarray(followed_ids, dtype=np.int64)
+        size = int(max(follower_ids.max(), followed_ids.max())) + 1 \
+            if len(follower_ids) else 0
+
+        return cls(Adjacency.build(follower_ids, followed_ids, size),
+                   Adjacency.build(followed_ids, follower_ids, size),
+                   **kwargs)
+
+    @classmethod
+    def from_database(cls, session, batch_size=BUILD_BATCH, **kwargs):
+        """Read the whole follows table, a batch at a time."""
+
+        from models import Follows
+
+        result = session.execute(
+            Follows.__table__
+            .select()
+            .with_only_columns([Follows.user_following_id,
+                                Follows.user_being_followed_id]))
+
+        batches = []
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            batches.append(np.array(rows, dtype=np.int64).reshape(-1, 2))
+
+        edges = (np.concatenate(batches) if batches
+                 else np.empty((0, 2), dtype=np.int64))
+        return cls.from_edges(edges[:, 0], edges[:, 1], **kwargs)
+
+    ##########################################################################
+    # Snapshots
+
+    def save(self, path, seq=0):
+        """Write the graph (changes merged) as .npy files in `path`.
+
+        `seq` is the last journal entry (see journal_seq) it includes.
+        """
+
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+
+        arrays = {
+            'following_indptr': self.following.base.indptr,
+            'following_indices': self.following.base.indices,
+            'followers_indptr': self.followers.base.indptr,
+            'followers_indices': self.followers.base.indices,
+        }
+
+        # replace each file whole, so a worker never maps a half-written one
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.tmp.npy"), array)
+            os.replace(os.path.join(path, f"{name}.tmp.npy"),
+                       os.path.join(path, f"{name}.npy"))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump({'seq': seq, 'edges': self.edge_count(),
+                       'saved': time.time()}, file)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Memory-map a saved graph. Returns (graph, its meta.json)."""
+
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"),
+                                mmap_mode='r')
+                  for name in ARRAYS}
+
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+
+        graph = cls(Adjacency(arrays['following_indptr'],
+                              arrays['following_indices']),
+                    Adjacency(arrays['followers_indptr'],
+                              arrays['followers_indices']),
+                    **kwargs)
+        return graph, meta
+
+    ##########################################################################
+    # Changes
+
+    def follow(self, follower_id, followed_id):
+        with self.lock:
+            self.following.add(follower_id, followed_id)
+            self.followers.add(followed_id, follower_id)
+        self._maybe_compact()
+
+    def unfollow(self, follower_id, followed_id):
+        with self.lock:
+            self.following.remove(follower_id, followed_id)
+            self.followers.remove(followed_id, follower_id)
+        self._maybe_compact()
+
+    def remove_user(self, user_id):
+        with self.lock:
+            for followed_id in self.following_ids(user_id):
+                self.unfollow(user_id, int(followed_id))
+            for follower_id in self.follower_ids(user_id):
+                self.unfollow(int(follower_id), user_id)
+
+    def _maybe_compact(self):
+        if self.following.delta_size() > self.max_delta:
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            self.following.compact()
+            self.followers.compact()
+
+    ##########################################################################
+    # Queries
+
+    def is_following(self, follower_id, followed_id):
+        with self.lock:
+            return self.following.has(follower_id, followed_id)
+
+    def following_count(self, user_id):
+        with self.lock:
+            return self.following.degree(user_id)
+
+    def followers_count(self, user_id):
+        with self.lock:
+            return self.followers.degree(user_id)
+
+    def following_ids(self, user_id):
+        with self.lock:
+            return self.following.row(user_id)
+
+    def follower_ids(self, user_id):
+        with self.lock:
+            return self.followers.row(user_id)
+
+    def edge_count(self):
+        with self.lock:
+            return int(self.following.base.indptr[-1]) + sum(
+                len(added) for added in self.following.added.values()) - sum(
+                len(removed) for removed in self.following.removed.values())
+
+    def mutuals(self, user_id):
+        """Users who follow `user_id` and whom `user_id` follows back."""
+
+        with self.lock:
+            following, followers = (self.following_ids(user_id),
+                                    self.follower_ids(user_id))
+        return np.intersect1d(following, followers, assume_unique=True)
+
+    def common_followers(self, a, b):
+        """Users following both `a` and `b`."""
+
+        with self.lock:
+            first, second = self.follower_ids(a), self.follower_ids(b)
+        return np.intersect1d(first, second, assume_unique=True)
+
+    def common_following(self, a, b):
+        """Users both `a` and `b` follow."""
+
+        with self.lock:
+            first, second = self.following_ids(a), self.following_ids(b)
+        return np.intersect1d(first, second, assume_unique=True)
+
+    def followers_followed_by(self, user_id, viewer_id):
+        """Followers of `user_id` whom `viewer_id` follows."""
+
+        with self.lock:
+            followers, following = (self.follower_ids(user_id),
+                                    self.following_ids(viewer_id))
+        return np.intersect1d(followers, following, assume_unique=True)
+
+    def neighborhood(self, user_id, hops, followers=False, limit=None):
+        """Users first reachable in 1, 2, ... `hops` follows from `user_id`.
+
+        Returns a list with a sorted array of user ids per hop, following
+        follows outwards (or, with `followers`, backwards). With `limit`,
+        stops once that many users have been found.
+        """
+
+        direction = self.followers if followers else self.following
+        seen = np.array([user_id], dtype=np.int64)
+        frontier = seen
+        found = 0
+        layers = []
+
+        for _ in range(hops):
+            with self.lock:
+                gathered = direction.gather(frontier)
+            reached = np.unique(gathered)
+            frontier = np.setdiff1d(reached, seen, assume_unique=True)
+            if not len(frontier):
+                break
+
+            if limit is not None and found + len(frontier) >= limit:
+                layers.append(frontier[:limit - found])
+                break
+
+            layers.append(frontier)
+            found += len(frontier)
+            seen = np.union1d(seen, frontier)
+
+        return layers
+
+
+class FollowGraph:
+    """This worker's SocialGraph, loaded at start (or on first use), kept
+    up to date.
+    """
+
+    def __init__(self):
+        self.graph = None
+        self.path = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.path = app.config.get('GRAPH_PATH')
+
+        if not event.contains(Session, 'before_commit', self.journal):
+            event.listen(Session, 'before_commit', self.journal)
+
+    def preload(self, app):
+        """Load the graph now rather than in the first request to use it.
+
+        A server can call this before forking its workers (see wsgi.py):
+        they then share the loaded graph, and hear of the follows made
+        since over CHANGES_CHANNEL.
+        """
+
+        from models import db
+
+        with app.app_context():
+            if changes.channel is not None:
+                # the workers read the channel on from here, so a follow
+                # committed during the load isn't missed
+                changes.channel.receive()
+
+            with self.lock:
+                self.graph = self.load()
+
+            # don't hand pooled connections to forked workers
+            db.get_engine(app).dispose()
+
+    def get(self):
+        if self.graph is None:
+            with self.lock:
+                if self.graph is None:
+                    self.graph = self.load()
+        return self.graph
+
+    def load(self):
+        from models import db, FollowChange
+
+        if self.path and os.path.exists(os.path.join(self.path, 'meta.json')):
+            graph, meta = SocialGraph.load(self.path)
+            seq = meta.get('seq')
+
+            # the journal must still hold every entry after the snapshot
+            first = db.session.query(func.min(FollowChange.seq)).scalar()
+            if seq is not None and (first is None or first <= seq + 1):
+                for batch in read_journal(db.session,
+                                          max(seq - REPLAY_OVERLAP, 0)):
+                    apply_changes(graph, batch)
+                return graph
+
+            log.warning("graph snapshot in %s is older than the journal; "
+                        "building from the follows table", self.path)
+
+        return SocialGraph.from_database(db.session)
+
+    def journal(self, session):
+        """Write a committing transaction's follow changes to the journal
+        (a before_commit listener), with GRAPH_PATH set.
+        """
+
+        if not self.path:
+            return
+
+        from models import FollowChange
+
+        # flush first, so the pending changes are all there
+        session.flush()
+        rows = dict.fromkeys(json.dumps(change.to_json())
+                             for change in changes.pending(session)
+                             if journaled(change))
+        if rows:
+            session.execute(FollowChange.__table__.insert(),
+                            [{'data': data} for data in rows])
+
+    def apply(self, changes):
+        """Follow committed follows and unfollows, once loaded."""
+
+        if self.graph is not None:
+            apply_changes(self.graph, changes)
+
+    def clear(self):
+        self.graph = None
+
+
+# Shared by every request in this worker.
+follow_graph = FollowGraph()
+changes.subscribe(follow_graph.apply, models={'Follows', 'User'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='save a snapshot of the graph')
+    build.add_argument('--path', help='directory (default: GRAPH_PATH)')
+    commands.add_parser('stats', help='describe the graph')
+
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        # before reading the follows, so what's committed meanwhile is
+        # replayed on top
+        seq = journal_seq(db.session)
+        graph = SocialGraph.from_database(db.session)
+        built = time.perf_counter() - started
+
+        if args.command == 'build':
+            path = args.path or app.config.get('GRAPH_PATH')
+            if not path:
+                parser.error("no --path given and GRAPH_PATH isn't set")
+            graph.save(path, seq=seq)
+            pruned = prune_journal(db.session, seq)
+            print(f"Saved {graph.edge_count()} follows to {path} "
+                  f"(read in {built:.1f}s); pruned {pruned} journal "
+                  f"entries.")
+
+        else:
+            size = sum(array.nbytes for array in (
+                graph.following.base.indptr, graph.following.base.indices,
+                graph.followers.base.indptr, graph.followers.base.indices))
+            print(f"{graph.edge_count()} follows among ids up to "
+                  f"{graph.following.base.size - 1}; "
+                  f"{size / 2 ** 20:.1f} MB; read in {built:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""Bulk import of a user's message history.
+
+Reads NDJSON (one {"text": ..., "timestamp": ...} object per line) or CSV
+(with `text` and optional `timestamp` columns, like generator/messages.csv),
+validates each row with the same rules as MessageForm, and inserts valid
+rows a batch at a time with one multi-row INSERT per batch. Derived data
+(the author's cached feed timeline and their hashtags and mentions) is
+refreshed once at the end rather than per message.
+
+Imports started from the web run as background jobs whose progress can be
+polled from any worker: it's saved in the import_jobs table as the job
+goes, and finished jobs are deleted after JOB_TTL. The same code runs from
+the command line:
+
+    python importer.py USERNAME history.ndjson
+"""
+
+import argparse
+import csv
+import io
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from changes import changes, Change
+from forms import MAX_MESSAGE_LENGTH
+from models import db, User, Message, ImportStatus
+from sharding import router
+from tags import reindex_user
+
+BATCH_SIZE = 1000
+
+# keep this many error messages per job; the rest are only counted
+MAX_ERRORS = 20
+
+FORMATS = ('ndjson', 'csv')
+
+# finished jobs' status is kept this long
+JOB_TTL = timedelta(days=1)
+
+
+class ImportJob:
+    """Progress of one import."""
+
+    def __init__(self, user_id, id=None):
+        self.id = id or uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = 'pending'
+        self.processed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def error(self, line, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"line {line}: {reason}")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'processed': self.processed,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
+
+    def save(self):
+        """Write the job's progress to the import_jobs table and commit."""
+
+        db.session.merge(ImportStatus(
+            id=self.id, user_id=self.user_id, status=self.status,
+            processed=self.processed, imported=self.imported,
+            skipped=self.skipped, errors=json.dumps(self.errors),
+            updated=datetime.utcnow()))
+        db.session.commit()
+
+    @classmethod
+    def load(cls, job_id):
+        """The job with id `job_id`, as last saved by any worker, or None."""
+
+        row = ImportStatus.query.get(job_id)
+        if row is None:
+            return None
+
+        job = cls(row.user_id, id=row.id)
+        job.status = row.status
+        job.processed = row.processed
+        job.imported = row.imported
+        job.skipped = row.skipped
+        job.errors = json.loads(row.errors)
+        return job
+
+
+def expire_jobs(now=None):
+    """Delete the status of jobs that finished more than JOB_TTL ago."""
+
+    cutoff = (now or datetime.utcnow()) - JOB_TTL
+    (ImportStatus.query
+     .filter(ImportStatus.status.in_(['done', 'failed']),
+             ImportStatus.updated < cutoff)
+     .delete(synchronize_session=False))
+
+
+def read_rows(stream, format):
+    """Yield (line number, row dict or None if unparseable) from `stream`.
+
+    `stream` is a binary file object.
+    """
+
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def validate_row(row, now):
+    """Return (text, timestamp) for a valid row, or raise ValueError."""
+
+    if row is None:
+        raise ValueError("not a valid record")
+
+    text = (row.get('text') or '').strip()
+    if not text:
+        raise ValueError("text is required")
+    if len(text) > MAX_MESSAGE_LENGTH:
+        raise ValueError(f"text is longer than {MAX_MESSAGE_LENGTH} characters")
+
+    timestamp = row.get('timestamp')
+    if not timestamp:
+        return text, now
+
+    try:
+        timestamp = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError("timestamp must be an ISO 8601 date and time")
+
+    # stored timestamps are naive UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return text, timestamp
+
+
+def run_import(job, stream, format, batch_size=BATCH_SIZE):
+    """Validate and insert every row of `stream` for `job.user_id`."""
+
+    job.status = 'running'
+    job.save()
+    now = datetime.utcnow()
+    insert = Message.__table__.insert()
+    session = router.session_for(job.user_id)
+    batch = []
+
+    def flush():
+        session.execute(insert.values(batch))
+        session.commit()
+        job.imported += len(batch)
+        batch.clear()
+        job.save()
+
+    try:
+        for line_number, row in read_rows(stream, format):
+            job.processed += 1
+
+            try:
+                text, timestamp = validate_row(row, now)
+            except ValueError as e:
+                job.error(line_number, e)
+                continue
+
+            row = {'text': text, 'timestamp': timestamp, 'user_id': job.user_id}
+            if router.enabled:
+                row['id'] = router.next_id('messages')
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+
+    except Exception as e:
+        session.rollback()
+        job.status = 'failed'
+        job.errors.append(f"import stopped: {e}")
+        job.save()
+        raise
+
+    finally:
+        # the rows went in around the ORM, so announce them: one change for
+        # the whole import
+        changes.publish([Change('Message', 'insert', {'user_id': job.user_id},
+                                frozenset())])
+
+    reindex_user(job.user_id)
+
+    job.status = 'done'
+    job.save()
+    return job
+
+
+def start_import(app, user_id, stream, format, background=True):
+    """Start importing `stream` for a user; returns the ImportJob.
+
+    In the background, the import runs in a thread with its own app context
+    (and so its own database session). Either way, `stream` is closed when
+    the import finishes.
+    """
+
+    expire_jobs()
+    job = ImportJob(user_id)
+    job.save()
+
+    if not background:
+        with stream:
+            run_import(job, stream, format)
+        return job
+
+    def work():
+        with app.app_context():
+            try:
+                run_import(job, stream, format)
+            except Exception:
+                app.logger.exception("Import %s failed", job.id)
+            finally:
+                stream.close()
+
+    threading.Thread(target=work, daemon=True).start()
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('username')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='default: from the file extension')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    format = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+
+    from app import create_app
+
+    with create_app().app_context():
+        user = User.query.filter_by(username=args.username).first()
+        if not user:
+            parser.error(f"no user named {args.username}")
+
+        job = ImportJob(user.id)
+        with open(args.path, 'rb') as stream:
+            run_import(job, stream, format, batch_size=args.batch_size)
+
+    print(f"Imported {job.imported} of {job.processed} rows "
+          f"({job.skipped} skipped).")
+    for error in job.errors:
+        print(f"  {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Live feed updates over server-sent events.
+
+messages_add() publishes each new message to an in-process hub, which
+hands it to every open /feed/stream connection whose user follows the
+author. Each connection just waits on its own small queue, so thousands
+of mostly idle connections are cheap -- provided the server runs a
+cooperative worker (e.g. gunicorn -k gevent) rather than a thread per
+client. On a sync worker each open stream holds a whole worker, so a few
+open tabs would starve the server: the stream is off unless LIVE_FEED is
+set.
+
+The hub hears of messages posted through this worker directly. With more
+than one worker, set CHANGES_CHANNEL too: other workers' new messages
+then reach the hub over the change channel (see changes.py), as Message
+inserts that it loads by id. A worker holding only open streams may
+serve no other requests to poll the channel on, so the streams poll it
+too, every CHANGES_POLL_SECONDS while they wait.
+"""
+
+import queue
+import threading
+from collections import defaultdict
+
+from api import dumps
+from changes import changes
+from sharding import router
+
+HEARTBEAT = 15
+
+# a subscriber that falls this many events behind is disconnected
+MAX_PENDING = 100
+
+
+class Subscription:
+    """One client's queue of pending events."""
+
+    def __init__(self, author_ids):
+        self.author_ids = frozenset(author_ids)
+        self.events = queue.Queue(maxsize=MAX_PENDING)
+
+    def get(self, timeout):
+        """Next event, or raise queue.Empty after `timeout` seconds."""
+
+        return self.events.get(timeout=timeout)
+
+
+class Hub:
+    """Fan messages out to the subscriptions following their author."""
+
+    def __init__(self):
+        self.by_author = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, author_ids):
+        subscription = Subscription(author_ids)
+
+        with self.lock:
+            for author_id in subscription.author_ids:
+                self.by_author[author_id].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for author_id in subscription.author_ids:
+                subscribers = self.by_author.get(author_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_author[author_id]
+
+    def publish(self, author_id, event):
+        """Queue `event` for everyone following `author_id`."""
+
+        with self.lock:
+            subscribers = list(self.by_author.get(author_id, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                # too slow to keep up: end its stream, and let the browser
+                # reconnect and reload
+                self.unsubscribe(subscription)
+                _close(subscription)
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(set().union(*self.by_author.values()))
+
+    def apply(self, changes):
+        """Publish messages other workers posted, by followed authors."""
+
+        with self.lock:
+            ids = [change.values['id'] for change in changes
+                   if change.action == 'insert' and 'id' in change.values
+                   and change.values.get('user_id') in self.by_author]
+        if not ids:
+            return
+
+        found = router.get_messages(ids)
+        for message_id in ids:
+            msg = found.get(message_id)
+            if msg is not None:
+                self.publish(msg.user_id, message_event(msg))
+
+
+def _close(subscription):
+    """Make room for, and send, the end-of-stream marker."""
+
+    while True:
+        try:
+            subscription.events.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                subscription.events.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def message_event(msg):
+    """The payload sent for a new message."""
+
+    return {
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp.isoformat(),
+        'user': {
+            'id': msg.user.id,
+            'username': msg.user.username,
+            'image_url': msg.user.image_url,
+        },
+    }
+
+
+def channel_poller(app):
+    """A function picking up other workers' changes, in an app context (so
+    the hub can load their messages); None without a CHANGES_CHANNEL.
+    """
+
+    channel = changes.channel
+    if channel is None:
+        return None
+
+    def poll():
+        with app.app_context():
+            channel.poll(changes)
+
+    return poll
+
+
+def event_stream(subscription, heartbeat=HEARTBEAT, poll=None,
+                 poll_interval=1):
+    """Yield server-sent events for `subscription` until it is closed.
+
+    `poll` (see channel_poller) is called every `poll_interval` seconds
+    spent waiting for an event.
+    """
+
+    wait = min(poll_interval, heartbeat) if poll else heartbeat
+    idle = 0
+
+    try:
+        yield b"retry: 5000\n\n"
+
+        while True:
+            try:
+                event = subscription.get(timeout=wait)
+            except queue.Empty:
+                if poll:
+                    poll()
+                idle += wait
+                if idle >= heartbeat:
+                    idle = 0
+                    yield b": keepalive\n\n"
+                continue
+
+            idle = 0
+
+            if event is None:
+                return
+
+            yield (b"event: message\nid: %d\ndata: %s\n\n"
+                   % (event['id'], dumps(event)))
+
+    finally:
+        hub.unsubscribe(subscription)
+
+
+# Hub shared by every request in this worker.
+hub = Hub()
+changes.subscribe(hub.apply, models={'Message'}, remote=True)
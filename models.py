@@ -1,9 +1,12 @@
 """SQLAlchemy models for Warbler."""
 
+import os
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -47,6 +50,17 @@ class Likes(db.Model):
         db.ForeignKey('messages.id', ondelete='cascade')
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # a user's likes, newest first, for the paginated likes page
+    __table_args__ = (
+        db.Index('ix_likes_user_id_created_at', 'user_id', 'created_at'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -117,6 +131,19 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def count_messages(self):
+        """Number of messages this user has posted, without loading them."""
+
+        from archive import count_archived
+        from sharding import router
+        return router.count_messages(self.id) + count_archived(self.id)
+
+    def count_likes(self):
+        """Number of messages this user has liked, without loading them."""
+
+        from sharding import router
+        return router.count_likes(self.id)
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
@@ -149,17 +176,23 @@ class User(db.Model):
         return user
 
     @classmethod
-    def authenticate(cls, username, password):
+    def authenticate(cls, username, password, find=None):
         """Find user with `username` and `password`.
 
         This is a class method (call it on the class, not an individual user.)
         It searches for a user whose password hash matches this password
         and, if it finds such a user, returns that user object.
 
+        `find(username)` looks the user up, if given (app.py passes one using
+        the baked query in queries.py); otherwise a plain query does.
+
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        if find is not None:
+            user = find(username)
+        else:
+            user = cls.query.filter_by(username=username).first()
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -187,7 +220,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +232,308 @@ class Message(db.Model):
     user = db.relationship('User')
 
 
+class MessageArchive(db.Model):
+    """A compressed chunk of one user's old messages.
+
+    Written, and never updated, by the tiering job in archive.py, which
+    moves messages here from the messages table once they're old enough.
+    """
+
+    __tablename__ = 'message_archive'
+
+    # ids of the first and last messages in the chunk
+    first_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    last_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # zlib-compressed JSON list of [id, timestamp, text]
+    data = db.Column(
+        db.LargeBinary,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_archive_user_id_last_id', 'user_id', 'last_id'),
+        db.Index('ix_message_archive_last_id', 'last_id'),
+    )
+
+
+class MessageTerm(db.Model):
+    """A hashtag or mention in a message, for tag and mention timelines.
+
+    `term` is '#' and the lowercased tag, or '@' and the mentioned user's
+    id. Maintained by tags.py.
+    """
+
+    __tablename__ = 'message_terms'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # no foreign key: the message may be on a shard or in the archive
+    message_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    # the message's author
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+        index=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_terms_term_timestamp',
+                 'term', 'timestamp', 'message_id'),
+    )
+
+
+class ImportStatus(db.Model):
+    """Progress of a message import (see importer.py), kept in the database
+    so that any worker can answer a status poll.
+    """
+
+    __tablename__ = 'import_jobs'
+
+    id = db.Column(
+        db.String(32),
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # 'pending', 'running', 'done' or 'failed'
+    status = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    processed = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    imported = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    skipped = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # JSON list of error messages
+    errors = db.Column(
+        db.Text,
+        nullable=False,
+        default='[]',
+    )
+
+    updated = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        index=True,
+    )
+
+
+class Notification(db.Model):
+    """Something that happened to a user: a mention, a new follower or a
+    like. Written in batches by notifications.py.
+    """
+
+    __tablename__ = 'notifications'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # the user whose inbox this is in
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # notifications.MENTION, FOLLOW or LIKE
+    kind = db.Column(
+        db.SmallInteger,
+        nullable=False,
+    )
+
+    # the user who mentioned, followed or liked
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # no foreign key: the message may be on a shard or in the archive
+    message_id = db.Column(
+        db.Integer,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_notifications_user_id_id', 'user_id', 'id'),
+        # one notification per like or mention, however often it's
+        # repeated (follows, with no message, aren't covered: NULLs differ)
+        db.Index('uq_notifications_event', 'user_id', 'kind', 'actor_id',
+                 'message_id', unique=True),
+    )
+
+
+class Inbox(db.Model):
+    """How far through their notifications a user has read."""
+
+    __tablename__ = 'inboxes'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    last_read_id = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class Recommendation(db.Model):
+    """A precomputed "who to follow" suggestion for a user.
+
+    Rows are written in bulk by the batch job in recommendations.py.
+    """
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    recommended_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class ShardRange(db.Model):
+    """Buckets `first_bucket`..`last_bucket` of users live on `bind_key`.
+
+    Only used when messages and likes are sharded; see sharding.py.
+    """
+
+    __tablename__ = 'shard_ranges'
+
+    first_bucket = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    last_bucket = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    bind_key = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+
+class IdCounter(db.Model):
+    """Next unused id for a sharded table, handed out in blocks."""
+
+    __tablename__ = 'id_counters'
+
+    name = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    next_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class FollowChange(db.Model):
+    """A committed follow, unfollow or user deletion, in commit order, so a
+    follow graph snapshot can catch up with what came after it.
+
+    `data` is the change as JSON (see Change.to_json in changes.py).
+    Written and read by graph.py.
+    """
+
+    __tablename__ = 'follow_changes'
+
+    seq = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    data = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # never reuse a pruned entry's seq
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -207,3 +542,29 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
+
+    if not event.contains(Pool, 'checkout', _checkout_in_same_process):
+        event.listen(Pool, 'connect', _remember_process)
+        event.listen(Pool, 'checkout', _checkout_in_same_process)
+
+
+def _remember_process(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _checkout_in_same_process(dbapi_connection, connection_record,
+                              connection_proxy):
+    """Never hand a forked worker a connection opened by its parent.
+
+    Engines are created lazily, but if one was used before the server
+    forked, its pooled connections are dropped (not closed, since the parent
+    still owns them) and replaced the first time a worker checks one out.
+    """
+
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            f"Connection record belongs to pid {connection_record.info['pid']}, "
+            f"attempting to check out in pid {pid}")
@@ -0,0 +1,168 @@
+"""How a profile relates to the person looking at it.
+
+A profile shows its viewer whether the user follows them back and which
+of the people they follow also follow the user ("followed by @a, @b and 37
+others you follow"). That's the intersection of two sorted rows of the
+follow graph (see graph.py), so it costs time in proportion to the two
+users' follow counts and never loads their User objects; only the few
+users named are read from the database.
+
+Whether either user follows the other (the Follows you badge and the
+Follow/Unfollow button) is read from the follows table on every view, in
+one query on its primary key, so it is right even just after a follow on
+another worker. The "followed by" lists are cached per (viewer, profile)
+pair. A follow or unfollow between a and b drops every cached pair
+involving a or b, which is every pair it could change; a deleted user
+clears the cache. Renamed users can show under their old name for up to
+CACHE_TTL seconds.
+
+Each worker's follow graph hears only of the follows committed in that
+worker unless CHANGES_CHANNEL is set (see changes.py), so with more than
+one worker, set it; without it, "followed by" lists miss other workers'
+follows until the worker restarts.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple, defaultdict
+
+from sqlalchemy import and_, or_
+
+from changes import changes
+from graph import follow_graph
+from models import db, User, Follows
+
+# users named in "followed by ..."
+SHOWN = 3
+
+CACHE_TTL = 300
+MAX_PAIRS = 10000
+
+
+class FollowSummary(namedtuple('FollowSummary',
+                               'follows_you you_follow followed_by others')):
+    """follows_you and you_follow are bools; followed_by is up to SHOWN
+    (id, username) of the users the viewer follows who follow the profile,
+    and others how many more of them there are.
+    """
+
+
+def follow_edges(viewer_id, user_id):
+    """(follows_you, you_follow), from the follows table in one query."""
+
+    followers = {follower_id for (follower_id,) in (
+        db.session
+        .query(Follows.user_following_id)
+        .filter(or_(and_(Follows.user_following_id == user_id,
+                         Follows.user_being_followed_id == viewer_id),
+                    and_(Follows.user_following_id == viewer_id,
+                         Follows.user_being_followed_id == user_id))))}
+
+    return user_id in followers, viewer_id in followers
+
+
+def followed_by(viewer_id, user_id):
+    """(followed_by, others) of the FollowSummary, from the follow graph."""
+
+    followers = follow_graph.get().followers_followed_by(user_id, viewer_id)
+
+    shown = [int(id) for id in followers[:SHOWN]]
+    names = dict(User.query
+                 .filter(User.id.in_(shown))
+                 .with_entities(User.id, User.username)) if shown else {}
+
+    return ([(id, names[id]) for id in shown if id in names],
+            len(followers) - len(shown))
+
+
+def follow_summary(viewer_id, user_id):
+    """The FollowSummary of `user_id`'s profile for `viewer_id`."""
+
+    return FollowSummary(*follow_edges(viewer_id, user_id),
+                         *followed_by(viewer_id, user_id))
+
+
+class SummaryCache:
+    """LRU cache of (viewer id, user id) -> "followed by" part of the
+    FollowSummary; the rest is read fresh each time.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_pairs=MAX_PAIRS,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_pairs = max_pairs
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+        # user id -> the cached pairs it's in
+        self.pairs = defaultdict(set)
+
+    def get(self, viewer_id, user_id):
+        """The FollowSummary of `user_id`'s profile for `viewer_id`."""
+
+        key = (viewer_id, user_id)
+        now = self.clock()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self.entries.move_to_end(key)
+                cached = entry[1]
+            else:
+                cached = None
+
+        if cached is None:
+            cached = followed_by(viewer_id, user_id)
+
+            with self.lock:
+                self.entries[key] = (now, cached)
+                self.entries.move_to_end(key)
+                self.pairs[viewer_id].add(key)
+                self.pairs[user_id].add(key)
+
+                while len(self.entries) > self.max_pairs:
+                    self._forget(next(iter(self.entries)))
+
+        return FollowSummary(*follow_edges(viewer_id, user_id), *cached)
+
+    def _forget(self, key):
+        self.entries.pop(key, None)
+        for user_id in key:
+            pairs = self.pairs.get(user_id)
+            if pairs is not None:
+                pairs.discard(key)
+                if not pairs:
+                    del self.pairs[user_id]
+
+    def invalidate(self, user_id):
+        """Drop every cached pair `user_id` is in."""
+
+        with self.lock:
+            for key in list(self.pairs.get(user_id, ())):
+                self._forget(key)
+
+    def apply(self, changes):
+        for change in changes:
+            if change.model == 'User':
+                if change.action == 'delete':
+                    self.clear()
+                continue
+
+            for column in ('user_following_id', 'user_being_followed_id'):
+                user_id = change.values.get(column)
+                if user_id is None:
+                    # can't tell whose follows changed
+                    self.clear()
+                    return
+                self.invalidate(user_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pairs.clear()
+
+
+# Shared by every request in this worker.
+summaries = SummaryCache()
+changes.subscribe(summaries.apply, models={'Follows', 'User'})
@@ -0,0 +1,190 @@
+"""Notification inboxes.
+
+The write paths in app.py describe what happened (a message mentioning
+people, a new follower, a like) and deliver() fans it out to the recipients'
+inboxes with one multi-row INSERT, however many recipients there are. Each
+row is just the recipient, a kind code, the actor and a message id; an
+event already in the inbox (say, liking a warble again after unliking it)
+isn't added twice.
+
+A user's unread count (capped at MAX_UNREAD) is shown on every page, so
+each worker caches it for CACHE_TTL seconds; a delivery or reading the
+inbox invalidates it in that worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import and_, func
+
+from models import db, User, Notification, Inbox
+from sharding import router
+
+MENTION, FOLLOW, LIKE = 1, 2, 3
+
+VERBS = {
+    MENTION: "mentioned you",
+    FOLLOW: "followed you",
+    LIKE: "liked your warble",
+}
+
+MAX_UNREAD = 99
+CACHE_TTL = 30
+MAX_USERS = 100000
+PAGE_SIZE = 30
+
+
+def mention_events(msg, user_ids):
+    return [{'user_id': user_id, 'kind': MENTION, 'actor_id': msg.user_id,
+             'message_id': msg.id}
+            for user_id in user_ids]
+
+
+def follow_event(follower_id, followed_id):
+    return {'user_id': followed_id, 'kind': FOLLOW, 'actor_id': follower_id,
+            'message_id': None}
+
+
+def like_event(liker_id, msg):
+    return {'user_id': msg.user_id, 'kind': LIKE, 'actor_id': liker_id,
+            'message_id': msg.id}
+
+
+def _insert_ignoring_conflicts(model):
+    table = model.__table__
+
+    if db.session.get_bind(model.__mapper__).dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+
+    return table.insert().prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def deliver(events):
+    """Add `events` to their recipients' inboxes; the caller commits.
+
+    Events are dicts of Notification columns. Nobody is notified of their
+    own actions.
+    """
+
+    rows = [event for event in events if event['user_id'] != event['actor_id']]
+    if not rows:
+        return
+
+    db.session.execute(_insert_ignoring_conflicts(Notification), rows)
+
+    for row in rows:
+        unread_counts.invalidate(row['user_id'])
+
+
+def count_unread(user_id):
+    """Unread notifications, counting no further than MAX_UNREAD + 1."""
+
+    last_read_id = (db.session
+                    .query(Inbox.last_read_id)
+                    .filter(Inbox.user_id == user_id)
+                    .scalar()) or 0
+
+    unread = (db.session
+              .query(Notification.id)
+              .filter(Notification.user_id == user_id,
+                      Notification.id > last_read_id)
+              .limit(MAX_UNREAD + 1)
+              .subquery())
+
+    return db.session.query(func.count()).select_from(unread).scalar()
+
+
+class UnreadCounts:
+    """LRU cache of user id -> unread notification count."""
+
+    def __init__(self, ttl=CACHE_TTL, max_users=MAX_USERS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        now = self.clock()
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+
+        # counted outside the lock, so other users' lookups don't wait on it
+        count = count_unread(user_id)
+
+        with self.lock:
+            self.entries[user_id] = (now, count)
+            self.entries.move_to_end(user_id)
+
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+        return count
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def inbox_page(user_id, before=None, limit=PAGE_SIZE):
+    """A page of a user's notifications, newest first.
+
+    Returns ([(notification, actor, message or None)], id to pass as
+    `before` for the next page, or None). Actors and messages are loaded
+    in one batch each; notifications about deleted messages are skipped.
+    """
+
+    query = Notification.query.filter(Notification.user_id == user_id)
+    if before:
+        query = query.filter(Notification.id < before)
+
+    rows = query.order_by(Notification.id.desc()).limit(limit + 1).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    rows = rows[:limit]
+
+    actor_ids = {row.actor_id for row in rows}
+    actors = {user.id: user for user in
+              User.query.filter(User.id.in_(actor_ids))} if actor_ids else {}
+    messages = router.get_messages(
+        [row.message_id for row in rows if row.message_id])
+
+    items = [(row, actors[row.actor_id], messages.get(row.message_id))
+             for row in rows
+             if row.actor_id in actors
+             and (row.message_id is None or row.message_id in messages)]
+
+    return items, next_before
+
+
+def mark_read(user_id, up_to_id):
+    """Mark a user's notifications up to `up_to_id` read.
+
+    An upsert, so two requests marking the same inbox read at once can't
+    both insert it, or move it back.
+    """
+
+    table = Inbox.__table__
+
+    db.session.execute(_insert_ignoring_conflicts(Inbox),
+                       {'user_id': user_id, 'last_read_id': 0})
+    db.session.execute(table.update()
+                       .where(and_(table.c.user_id == user_id,
+                                   table.c.last_read_id < up_to_id))
+                       .values(last_read_id=up_to_id))
+    db.session.commit()
+
+    unread_counts.invalidate(user_id)
+
+
+# Cache shared by every request in this worker.
+unread_counts = UnreadCounts()
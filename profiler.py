@@ -0,0 +1,238 @@
+"""Sampling profiler for single requests.
+
+A profiled request gets a thread that, every PROFILE_INTERVAL_MS, looks at
+the Python stack of the thread handling it, so time spent rendering
+templates, validating forms or loading ORM objects shows up where it's
+spent (template frames are labelled with the template's name). When the
+request is done the samples are written to PROFILE_DIR, either as
+collapsed stacks (for flamegraph.pl, inferno or speedscope) or as a
+speedscope JSON profile.
+
+A busy thread only lets the sampler in when the interpreter switches
+threads, so sampling more often than sys.getswitchinterval() (5 ms by
+default) gains nothing.
+
+A request is profiled if it carries PROFILE_TOKEN, in an X-Profile header
+or a _profile query parameter (add _profile_format=speedscope to choose the
+format), or, if PROFILE_SAMPLE_RATE is N, at random one time in N. Such
+requests get an X-Profile response header naming the file written. With no
+token and no sample rate, nothing is installed, so unprofiled requests pay
+nothing.
+"""
+
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+FORMATS = {
+    'collapsed': 'collapsed.txt',
+    'speedscope': 'speedscope.json',
+}
+
+
+def frame_label(frame, root_path):
+    """How a frame is shown: function and where it's defined."""
+
+    code = frame.f_code
+    template = frame.f_globals.get('__jinja_template__')
+
+    if template is not None:
+        return f"{code.co_name} ({template.name})"
+
+    filename = code.co_filename
+    if filename.startswith(root_path):
+        filename = os.path.relpath(filename, root_path)
+    else:
+        # trim site-packages and the like down to the package path
+        for path in sorted(sys.path, key=len, reverse=True):
+            if path and filename.startswith(path):
+                filename = os.path.relpath(filename, path)
+                break
+
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Sample one thread's stack on a background thread."""
+
+    def __init__(self, thread_id, interval, root_path='',
+                 clock=time.perf_counter):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_path = root_path
+        self.clock = clock
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='warbler-profiler')
+
+    def start(self):
+        self.started = self.clock()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.elapsed = self.clock() - self.started
+        return self
+
+    def run(self):
+        labels = {}
+
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+
+            stack = []
+            while frame is not None:
+                # code objects are shared, so label each one only once
+                key = (frame.f_code, frame.f_globals.get('__jinja_template__'))
+                label = labels.get(key)
+                if label is None:
+                    label = labels[key] = frame_label(frame, self.root_path)
+                stack.append(label)
+                frame = frame.f_back
+
+            # root first
+            self.stacks[tuple(reversed(stack))] += 1
+
+
+def collapsed(stacks):
+    """Stacks in the collapsed format: 'root;...;leaf count' per line."""
+
+    return ''.join(f"{';'.join(stack)} {count}\n"
+                   for stack, count in stacks.most_common())
+
+
+def speedscope(stacks, interval, name):
+    """Stacks as a speedscope 'sampled' profile, weighted in milliseconds."""
+
+    frames = []
+    indexes = {}
+    samples = []
+    weights = []
+
+    for stack, count in stacks.most_common():
+        sample = []
+        for label in stack:
+            if label not in indexes:
+                indexes[label] = len(frames)
+                frames.append({'name': label})
+            sample.append(indexes[label])
+
+        samples.append(sample)
+        weights.append(count * interval * 1000)
+
+    return json.dumps({
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': name,
+        'exporter': 'warbler profiler.py',
+    })
+
+
+class RequestProfiler:
+    """Decide which requests to profile, and profile them."""
+
+    def __init__(self, directory, token='', sample_rate=0, interval_ms=5,
+                 format='collapsed', root_path='', random=random.random):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.format = format
+        self.root_path = root_path
+        self.random = random
+
+    def requested(self):
+        """Did this request ask (with the token) to be profiled?"""
+
+        if not self.token:
+            return False
+
+        given = (request.headers.get('X-Profile')
+                 or request.args.get('_profile') or '')
+        return hmac.compare_digest(given.encode(), self.token.encode())
+
+    def sampled(self):
+        return self.sample_rate > 0 and self.random() * self.sample_rate < 1
+
+    def before_request(self):
+        if not (self.requested() or self.sampled()):
+            return
+
+        format = request.args.get('_profile_format', self.format)
+        if format not in FORMATS:
+            format = self.format
+
+        name = (f"{datetime.utcnow():%Y%m%dT%H%M%S}-{request.endpoint}-"
+                f"{uuid.uuid4().hex[:8]}.{FORMATS[format]}")
+
+        g.profile = (Sampler(threading.get_ident(), self.interval,
+                             self.root_path).start(),
+                     format, name)
+
+    def after_request(self, response):
+        if 'profile' in g:
+            response.headers['X-Profile'] = g.profile[2]
+        return response
+
+    def teardown_request(self, exc):
+        # after the response (even a streamed one) is done
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        sampler, format, name = profile
+        sampler.stop()
+
+        if format == 'speedscope':
+            output = speedscope(sampler.stacks, self.interval,
+                                f"{request.method} {request.path}")
+        else:
+            output = collapsed(sampler.stacks)
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), 'w') as file:
+            file.write(output)
+
+
+def init_app(app):
+    """Profile requests if PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set."""
+
+    if not (app.config.get('PROFILE_TOKEN')
+            or app.config.get('PROFILE_SAMPLE_RATE')):
+        return
+
+    profiler = app.extensions['profiler'] = RequestProfiler(
+        directory=app.config['PROFILE_DIR'],
+        token=app.config.get('PROFILE_TOKEN', ''),
+        sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0),
+        interval_ms=app.config.get('PROFILE_INTERVAL_MS', 5),
+        format=app.config.get('PROFILE_FORMAT', 'collapsed'),
+        root_path=app.root_path,
+    )
+
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
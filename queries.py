@@ -0,0 +1,188 @@
+"""Baked queries for the hot paths.
+
+Every request builds the same few ORM queries and compiles them to the same
+SQL: building the Query and its compiled SELECT costs more CPU than SQLite
+takes to run a primary key lookup. The queries here are baked (see
+sqlalchemy.ext.baked): the Query the lambdas build and the SQL it compiles
+to are made once per worker and cached, keyed by the lambdas' code, so a
+call only binds its parameters. Call one with a session, then .params():
+
+    user = user_by_username(db.session).params(username='alice').first()
+
+To see what compiling costs, set QUERY_TIMING: every statement's time is
+then split into compiling (from execute() to the DBAPI cursor, including
+parameter processing) and executing (the cursor's own time), totalled by
+endpoint and served at /metrics/queries.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from flask import has_request_context, request
+from sqlalchemy import bindparam, event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session
+
+from models import User, Message, Likes, Follows, Recommendation
+
+bakery = baked.bakery()
+
+
+class BakedQuery:
+    """A named baked query, called with a session (scoped or not)."""
+
+    def __init__(self, name, *steps):
+        self.name = name
+        self.baked = bakery(steps[0])
+        for step in steps[1:]:
+            self.baked += step
+
+    def __call__(self, session):
+        # baked queries need the Session itself, not a scoped_session
+        if isinstance(session, scoped_session):
+            session = session()
+        return self.baked(session)
+
+    def __repr__(self):
+        return f"<BakedQuery {self.name}>"
+
+
+# the logged-in user, on every request: use .get(id), which looks in the
+# session's identity map first, like Query.get
+user_by_id = BakedQuery(
+    'user_by_id',
+    lambda session: session.query(User))
+
+# logging in
+user_by_username = BakedQuery(
+    'user_by_username',
+    lambda session: session.query(User),
+    lambda query: query.filter(User.username == bindparam('username')))
+
+# the home feed's authors
+following_ids = BakedQuery(
+    'following_ids',
+    lambda session: session.query(Follows.user_being_followed_id),
+    lambda query: query.filter(
+        Follows.user_following_id == bindparam('user_id')))
+
+# the home page's "who to follow"
+suggestions = BakedQuery(
+    'suggestions',
+    lambda session: session.query(User),
+    lambda query: query
+    .join(Recommendation, Recommendation.recommended_user_id == User.id)
+    .filter(Recommendation.user_id == bindparam('user_id'))
+    .order_by(Recommendation.score.desc()))
+
+# profile pages, from whichever shard the user is on
+user_messages = BakedQuery(
+    'user_messages',
+    lambda session: session.query(Message),
+    lambda query: query
+    .filter(Message.user_id == bindparam('user_id'))
+    .order_by(Message.timestamp.desc())
+    .limit(bindparam('limit')))
+
+count_messages = BakedQuery(
+    'count_messages',
+    lambda session: session.query(func.count(Message.id)),
+    lambda query: query.filter(Message.user_id == bindparam('user_id')))
+
+count_likes = BakedQuery(
+    'count_likes',
+    lambda session: session.query(func.count(Likes.id)),
+    lambda query: query.filter(Likes.user_id == bindparam('user_id')))
+
+REGISTRY = {query.name: query for query in (
+    user_by_id, user_by_username, following_ids, suggestions, user_messages,
+    count_messages, count_likes)}
+
+
+class StatementTimer:
+    """Time spent compiling statements and executing them, by endpoint."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        # endpoint -> [statements, compiling seconds, executing seconds]
+        self.totals = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def before_execute(self, conn, clauseelement, multiparams, params):
+        conn.info['compile_started'] = self.clock()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        now = self.clock()
+        conn.info['compile_seconds'] = now - conn.info.pop('compile_started',
+                                                           now)
+        conn.info['execute_started'] = now
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        now = self.clock()
+        executing = now - conn.info.pop('execute_started', now)
+        compiling = conn.info.pop('compile_seconds', 0.0)
+
+        endpoint = (request.endpoint or '-') if has_request_context() else '-'
+        with self.lock:
+            totals = self.totals[endpoint]
+            totals[0] += 1
+            totals[1] += compiling
+            totals[2] += executing
+
+    def listen(self):
+        if event.contains(Engine, 'before_execute', self.before_execute):
+            return
+
+        event.listen(Engine, 'before_execute', self.before_execute)
+        event.listen(Engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def remove(self):
+        if not event.contains(Engine, 'before_execute', self.before_execute):
+            return
+
+        event.remove(Engine, 'before_execute', self.before_execute)
+        event.remove(Engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def metrics(self):
+        """Totals in Prometheus text format."""
+
+        lines = ['# TYPE warbler_sql_statements_total counter',
+                 '# TYPE warbler_sql_compile_seconds_total counter',
+                 '# TYPE warbler_sql_execute_seconds_total counter']
+
+        with self.lock:
+            totals = sorted(self.totals.items())
+
+        for endpoint, (statements, compiling, executing) in totals:
+            label = f'{{endpoint="{endpoint}"}}'
+            lines.append(f'warbler_sql_statements_total{label} {statements}')
+            lines.append(f'warbler_sql_compile_seconds_total{label} '
+                         f'{compiling:.6f}')
+            lines.append(f'warbler_sql_execute_seconds_total{label} '
+                         f'{executing:.6f}')
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+
+
+# Shared by every engine in this worker.
+timer = StatementTimer()
+
+
+def init_app(app):
+    """Time compiling and executing statements, if QUERY_TIMING is set."""
+
+    if app.config.get('QUERY_TIMING'):
+        timer.listen()
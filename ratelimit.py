@@ -0,0 +1,237 @@
+"""Token-bucket rate limiting for expensive routes.
+
+Login, signup and profile updates all do bcrypt work, and posting writes to
+the database, so a burst against any of them can tie up every worker. Views
+declare limits with `@limiter.limit(...)`; the check runs in a before_request
+hook registered ahead of the app's own, so rejected requests never reach the
+database or bcrypt.
+
+Bucket state lives in a pluggable backend. `SQLiteBackend` keeps it in a
+local SQLite file so every worker process on the machine shares the same
+buckets; `MemoryBackend` keeps it in-process (handy for tests). Keys can
+come from the request (a submitted username, say), so at most every
+SWEEP_INTERVAL seconds each backend drops buckets left idle long enough to
+have refilled: they'd start full again anyway.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import request, session
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'warbler-ratelimit.sqlite')
+
+SWEEP_INTERVAL = 60
+
+
+class _Sweeps:
+    """When to drop idle buckets, and which are idle."""
+
+    def __init__(self):
+        self.max_idle = 0
+        self.last = None
+
+    def due(self, capacity, refill_rate, now):
+        """Cutoff time for idle buckets, if it's time to sweep, or None.
+
+        A bucket untouched for capacity / refill_rate seconds is full, so
+        buckets older than the longest such time seen are safe to drop.
+        """
+
+        self.max_idle = max(self.max_idle, capacity / refill_rate)
+
+        if self.last is None:
+            self.last = now
+        if now - self.last < SWEEP_INTERVAL:
+            return None
+
+        self.last = now
+        return now - self.max_idle
+
+
+class MemoryBackend:
+    """Keep token buckets in this process."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.sweeps = _Sweeps()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take a token from bucket `key`; return seconds to wait, or 0."""
+
+        with self.lock:
+            cutoff = self.sweeps.due(capacity, refill_rate, now)
+            if cutoff is not None:
+                self.buckets = {name: bucket for name, bucket
+                                in self.buckets.items() if bucket[1] >= cutoff}
+
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens, wait = _take(tokens, updated, capacity, refill_rate, now)
+            self.buckets[key] = (tokens, now)
+
+        return wait
+
+
+class SQLiteBackend:
+    """Keep token buckets in a SQLite file shared by local processes."""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.sweeps = _Sweeps()
+
+    def _connection(self):
+        # connections can't cross threads or a fork, so open one per
+        # thread and reopen if we're in a new (forked) process
+        conn = getattr(self.local, 'conn', None)
+
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS buckets_updated '
+                         'ON buckets (updated)')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+
+        return conn
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take a token from bucket `key`; return seconds to wait, or 0."""
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets '
+                               'WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row or (capacity, now)
+            tokens, wait = _take(tokens, updated, capacity, refill_rate, now)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) '
+                         'VALUES (?, ?, ?)', (key, tokens, now))
+            conn.execute('COMMIT')
+
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        cutoff = self.sweeps.due(capacity, refill_rate, now)
+        if cutoff is not None:
+            conn.execute('DELETE FROM buckets WHERE updated < ?', (cutoff,))
+
+        return wait
+
+
+def _take(tokens, updated, capacity, refill_rate, now):
+    """Refill a bucket up to `now` and try to take one token.
+
+    Returns the new token count and how long to wait if it was empty.
+    """
+
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0
+
+    return tokens, (1 - tokens) / refill_rate
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def form_username():
+    return request.form.get('username') or None
+
+
+def session_id(session_key):
+    """Key by logged-in user id, falling back to the client's IP."""
+
+    def key():
+        user_id = session.get(session_key)
+        return f"user:{user_id}" if user_id is not None else client_ip()
+
+    return key
+
+
+class RateLimiter:
+    """Reject requests early once a view's token buckets run dry."""
+
+    def __init__(self, backend=None, clock=time.time):
+        self.backend = backend
+        self.clock = clock
+        self.rejections = Counter()
+
+    def init_app(self, app):
+        """Install the limit check.
+
+        Call this before registering other before_request handlers, so that
+        it runs first.
+        """
+
+        if self.backend is None:
+            self.backend = SQLiteBackend(
+                app.config.get('RATELIMIT_STORAGE', DEFAULT_SQLITE_PATH))
+
+        app.before_request(lambda: self.check(app))
+
+    def limit(self, name, key, rate, per, methods=('POST',)):
+        """Allow `rate` requests every `per` seconds for each value of `key`.
+
+        `key` is a function returning the bucket key for the current request
+        (or None to skip this limit); `name` labels it in the counters.
+        """
+
+        def decorator(view):
+            view.rate_limits = (getattr(view, 'rate_limits', [])
+                                + [(name, key, rate, per, methods)])
+            return view
+
+        return decorator
+
+    def check(self, app):
+        """Consume a token from each limit on this request's view."""
+
+        if not app.config.get('RATELIMIT_ENABLED', True):
+            return None
+
+        if request.endpoint is None:
+            return None
+
+        view = app.view_functions.get(request.endpoint)
+
+        for name, key, rate, per, methods in getattr(view, 'rate_limits', []):
+            if request.method not in methods:
+                continue
+
+            value = key()
+            if value is None:
+                continue
+
+            wait = self.backend.consume(f"{request.endpoint}:{name}:{value}",
+                                        capacity=rate,
+                                        refill_rate=rate / per,
+                                        now=self.clock())
+            if wait:
+                self.rejections[(request.endpoint, name)] += 1
+                return ("Too many requests. Please try again later.", 429,
+                        {'Retry-After': str(int(wait) + 1)})
+
+        return None
+
+    def metrics(self):
+        """Rejection counters in Prometheus text format."""
+
+        lines = ['# TYPE warbler_ratelimit_rejections_total counter']
+        for (endpoint, name), count in sorted(self.rejections.items()):
+            lines.append(f'warbler_ratelimit_rejections_total'
+                         f'{{endpoint="{endpoint}",limit="{name}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,247 @@
+"""Batch job computing "who to follow" recommendations.
+
+Loads the whole follows table into a sparse adjacency matrix and scores
+friends-of-friends candidates with sparse matrix products. Accounts the
+user already follows (and the user themself) are excluded, and the top-K
+candidates for each user are stored in the recommendations table.
+
+Rows are scored a chunk at a time. A chunk's product holds up to one entry
+per two-hop path from its rows, and scoring it peaks at about
+BYTES_PER_PATH bytes per path, so chunks are cut to at most
+--max-paths paths (and --chunk-size rows) rather than a fixed row count:
+a few users following celebrities don't blow up a worker. Size
+--max-paths so that workers times its peak fits in memory. If a worker
+dies anyway (say, killed for running out of memory), the job fails
+rather than waiting for its chunk forever.
+
+run it like:
+
+    python recommendations.py --top-k 5 --workers 8
+
+and see benchmarks/bench_recommendations.py for timings and peak memory.
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from scipy import sparse
+
+DEFAULT_TOP_K = 5
+DEFAULT_CHUNK_SIZE = 10000
+
+# two-hop paths per chunk; measured peak while scoring a chunk is about
+# BYTES_PER_PATH bytes per path, so about 450 MB per worker
+DEFAULT_MAX_PATHS = 5000000
+BYTES_PER_PATH = 90
+
+# Adjacency matrix shared with worker processes, set by _share() as each
+# worker starts. Under fork a worker inherits it; under spawn (the default
+# on macOS and Windows) it's pickled once per worker, not once per chunk.
+_adjacency = None
+
+
+def _share(adjacency):
+    global _adjacency
+    _adjacency = adjacency
+
+
+def build_adjacency(follower_ids, followed_ids):
+    """Build a follower -> followed CSR matrix from two id arrays.
+
+    User ids are remapped to dense row/column indexes; returns the matrix
+    and the array of user ids, where ids[index] is the original id.
+    """
+
+    follower_ids = np.asarray(follower_ids, dtype=np.int64)
+    followed_ids = np.asarray(followed_ids, dtype=np.int64)
+
+    ids = np.unique(np.concatenate([follower_ids, followed_ids]))
+    rows = np.searchsorted(ids, follower_ids)
+    cols = np.searchsorted(ids, followed_ids)
+    data = np.ones(len(rows), dtype=np.int32)
+
+    adjacency = sparse.csr_matrix((data, (rows, cols)),
+                                  shape=(len(ids), len(ids)))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+
+    return adjacency, ids
+
+
+def chunk_bounds(adjacency, max_rows, max_paths):
+    """[(start, stop), ...] row ranges of at most `max_rows` rows and (but
+    for single rows with more) `max_paths` two-hop paths each.
+    """
+
+    n = adjacency.shape[0]
+
+    # paths from each row: the sum of the out-degrees of the users it follows
+    degrees = np.diff(adjacency.indptr)
+    paths = np.cumsum(adjacency @ degrees, dtype=np.int64)
+
+    bounds = []
+    start = 0
+    while start < n:
+        before = paths[start - 1] if start else 0
+        stop = int(np.searchsorted(paths, before + max_paths, side='right'))
+        stop = min(max(stop, start + 1), start + max_rows, n)
+        bounds.append((start, stop))
+        start = stop
+
+    return bounds
+
+
+def _score_chunk(args):
+    """Score candidates for rows [start, stop) of the shared adjacency.
+
+    Returns (rows, cols, scores) of the top-K candidates for each row,
+    with row indexes relative to the whole matrix.
+    """
+
+    start, stop, top_k = args
+    adjacency = _adjacency
+    n = adjacency.shape[0]
+
+    chunk = adjacency[start:stop]
+    candidates = (chunk @ adjacency).tocoo()
+
+    rows = candidates.row.astype(np.int64)
+    cols = candidates.col.astype(np.int64)
+    scores = candidates.data
+
+    # drop the user themself and anyone they already follow
+    followed = chunk.tocoo()
+    followed_keys = followed.row.astype(np.int64) * n + followed.col
+    keys = rows * n + cols
+    keep = (cols != rows + start) & ~np.isin(keys, followed_keys)
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+    # order by row, then best score first, then lowest index for ties
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+
+    # rank of each candidate within its row; keep the first top_k
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = (np.arange(len(rows)) - row_starts) < top_k
+
+    return rows[keep] + start, cols[keep], scores[keep]
+
+
+def compute_recommendations(follower_ids, followed_ids,
+                            top_k=DEFAULT_TOP_K,
+                            workers=None,
+                            chunk_size=DEFAULT_CHUNK_SIZE,
+                            max_paths=DEFAULT_MAX_PATHS):
+    """Compute friends-of-friends recommendations for every user.
+
+    Takes parallel arrays of follower / followed user ids (one entry per
+    row of the follows table). A candidate's score is the number of
+    accounts the user follows that also follow the candidate.
+
+    Returns (user_ids, recommended_user_ids, scores) numpy arrays, sorted
+    by user id and then best score first. Raises RuntimeError if a worker
+    process dies.
+    """
+
+    if len(follower_ids) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+
+    adjacency, ids = build_adjacency(follower_ids, followed_ids)
+
+    tasks = [(start, stop, top_k) for start, stop
+             in chunk_bounds(adjacency, chunk_size, max_paths)]
+
+    if workers == 1 or len(tasks) == 1:
+        _share(adjacency)
+        try:
+            results = [_score_chunk(task) for task in tasks]
+        finally:
+            _share(None)
+    else:
+        # unlike multiprocessing.Pool, which replaces a dead worker and
+        # waits for its lost chunk forever, the executor fails at once
+        try:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                     initializer=_share,
+                                     initargs=(adjacency,)) as executor:
+                results = list(executor.map(_score_chunk, tasks))
+        except BrokenProcessPool as error:
+            raise RuntimeError(
+                "a recommendation worker died (out of memory? try a "
+                "lower --max-paths or fewer --workers)") from error
+
+    rows = np.concatenate([r[0] for r in results])
+    cols = np.concatenate([r[1] for r in results])
+    scores = np.concatenate([r[2] for r in results])
+
+    return ids[rows], ids[cols], scores.astype(np.int64)
+
+
+def load_follows():
+    """Load the follows table as (follower_ids, followed_ids) arrays."""
+
+    from models import db, Follows
+
+    rows = (db.session
+            .query(Follows.user_following_id, Follows.user_being_followed_id)
+            .all())
+
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    pairs = np.array(rows, dtype=np.int64)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def store_recommendations(user_ids, recommended_user_ids, scores,
+                          batch_size=10000):
+    """Replace the contents of the recommendations table."""
+
+    from models import db, Recommendation
+
+    Recommendation.query.delete()
+
+    for start in range(0, len(user_ids), batch_size):
+        stop = start + batch_size
+        db.session.bulk_insert_mappings(Recommendation, [
+            dict(user_id=int(u), recommended_user_id=int(r), score=int(s))
+            for u, r, s in zip(user_ids[start:stop],
+                               recommended_user_ids[start:stop],
+                               scores[start:stop])
+        ])
+
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='most users per chunk')
+    parser.add_argument('--max-paths', type=int, default=DEFAULT_MAX_PATHS,
+                        help=f'most two-hop paths per chunk (about '
+                             f'{BYTES_PER_PATH} bytes each at the peak)')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        follower_ids, followed_ids = load_follows()
+        results = compute_recommendations(follower_ids, followed_ids,
+                                          top_k=args.top_k,
+                                          workers=args.workers,
+                                          chunk_size=args.chunk_size,
+                                          max_paths=args.max_paths)
+        store_recommendations(*results)
+
+    print(f"Stored {len(results[0])} recommendations.")
+
+
+if __name__ == '__main__':
+    main()
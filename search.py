@@ -0,0 +1,238 @@
+"""Full-text search over messages.
+
+PostgreSQL searches with a GIN index on to_tsvector('english', text);
+SQLite (local development and tests) with an FTS5 table kept in step with
+messages by triggers. Both are created along with the messages table (on
+every shard, too), and because the database maintains them, new, deleted,
+imported and archived messages are reflected as soon as they're committed.
+Archived messages aren't searchable.
+
+A search takes the newest MAX_CANDIDATES matches from each shard, which
+both indexes can find without ranking every match of a common word, then
+ranks those by relevance discounted by age, and highlights just the page
+being shown. So the work per query stays bounded as the table grows; a
+query for a very common word sees only its recent matches.
+
+Add the index to an existing database with:
+
+    python search.py rebuild
+"""
+
+import argparse
+import re
+from datetime import datetime
+
+from markupsafe import Markup, escape
+from sqlalchemy import (DDL, DateTime, Float, Integer, bindparam, event, func,
+                        text)
+
+from models import Message
+from sharding import router, shard_messages
+
+MAX_CANDIDATES = 1000
+PAGE_SIZE = 20
+
+# a message this many days old scores half as much as a new one
+RECENCY_DAYS = 30
+
+# snippet highlight markers, swapped for <mark> once the text is escaped
+START, STOP = '\x02', '\x03'
+
+WORD = re.compile(r'\w+')
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+    "text, content='messages', content_rowid='id', "
+    "tokenize='porter unicode61')",
+
+    "CREATE TRIGGER IF NOT EXISTS message_search_insert "
+    "AFTER INSERT ON messages BEGIN "
+    "INSERT INTO message_search(rowid, text) VALUES (new.id, new.text); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS message_search_delete "
+    "AFTER DELETE ON messages BEGIN "
+    "INSERT INTO message_search(message_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS message_search_update "
+    "AFTER UPDATE OF text ON messages BEGIN "
+    "INSERT INTO message_search(message_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO message_search(rowid, text) VALUES (new.id, new.text); "
+    "END",
+]
+
+POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_search ON messages "
+    "USING gin (to_tsvector('english', text))",
+]
+
+
+def _install(table):
+    """Create (and drop) the search index with `table`."""
+
+    for statement in SQLITE_DDL:
+        event.listen(table, 'after_create',
+                     DDL(statement).execute_if(dialect='sqlite'))
+    for statement in POSTGRES_DDL:
+        event.listen(table, 'after_create',
+                     DDL(statement).execute_if(dialect='postgresql'))
+
+    event.listen(table, 'before_drop',
+                 DDL("DROP TABLE IF EXISTS message_search")
+                 .execute_if(dialect='sqlite'))
+
+
+_install(Message.__table__)
+_install(shard_messages)
+
+
+def fts5_query(query):
+    """`query` as an FTS5 query matching all its words, or None."""
+
+    words = WORD.findall(query)
+    if not words:
+        return None
+
+    return ' '.join(f'"{word}"' for word in words)
+
+
+class SQLiteSearch:
+    """Queries against the FTS5 table."""
+
+    def candidates(self, session, query, limit):
+        match = fts5_query(query)
+        if match is None:
+            return []
+
+        # bm25() is lower for better matches
+        return session.execute(
+            text("SELECT message_search.rowid AS id, messages.timestamp, "
+                 "-bm25(message_search) AS relevance "
+                 "FROM message_search "
+                 "JOIN messages ON messages.id = message_search.rowid "
+                 "WHERE message_search MATCH :match "
+                 "ORDER BY message_search.rowid DESC LIMIT :limit")
+            .columns(id=Integer, timestamp=DateTime, relevance=Float),
+            {'match': match, 'limit': limit}).fetchall()
+
+    def snippets(self, session, query, ids):
+        return dict(session.execute(
+            text("SELECT rowid, snippet(message_search, 0, :start, :stop, "
+                 "'…', 24) FROM message_search "
+                 "WHERE message_search MATCH :match AND rowid IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'match': fts5_query(query), 'start': START, 'stop': STOP,
+             'ids': ids}).fetchall())
+
+
+class PostgresSearch:
+    """Queries against the GIN-indexed tsvector expression."""
+
+    def _tsquery(self, query):
+        return func.plainto_tsquery('english', query)
+
+    def candidates(self, session, query, limit):
+        vector = func.to_tsvector('english', Message.text)
+        tsquery = self._tsquery(query)
+
+        return (session
+                .query(Message.id, Message.timestamp,
+                       func.ts_rank(vector, tsquery).label('relevance'))
+                .filter(vector.op('@@')(tsquery))
+                .order_by(Message.id.desc())
+                .limit(limit)
+                .all())
+
+    def snippets(self, session, query, ids):
+        options = f"StartSel={START}, StopSel={STOP}, MaxWords=35, MinWords=15"
+
+        return dict(session
+                    .query(Message.id,
+                           func.ts_headline('english', Message.text,
+                                            self._tsquery(query), options))
+                    .filter(Message.id.in_(ids)))
+
+
+def engine_for(session):
+    if session.get_bind(Message.__mapper__).dialect.name == 'postgresql':
+        return PostgresSearch()
+    return SQLiteSearch()
+
+
+def score(relevance, timestamp, now):
+    """Relevance discounted by age."""
+
+    age_days = max((now - timestamp).total_seconds(), 0) / 86400
+    return relevance / (1 + age_days / RECENCY_DAYS)
+
+
+def highlight(snippet):
+    """Escape a snippet and turn its markers into <mark> tags."""
+
+    return Markup(str(escape(snippet))
+                  .replace(START, '<mark>')
+                  .replace(STOP, '</mark>'))
+
+
+def search(query, page=0, per_page=PAGE_SIZE, now=None):
+    """One page of messages matching `query`, best first.
+
+    Returns ([(message, highlighted snippet)], whether there's a next page).
+    """
+
+    now = now or datetime.utcnow()
+
+    ranked = []
+    for session in router.sessions():
+        for row in engine_for(session).candidates(session, query,
+                                                  MAX_CANDIDATES):
+            ranked.append((score(row.relevance, row.timestamp, now),
+                           row.id, session))
+
+    ranked.sort(key=lambda hit: (hit[0], hit[1]), reverse=True)
+    hits = ranked[page * per_page:(page + 1) * per_page]
+
+    snippets = {}
+    for session in {session for _, _, session in hits}:
+        ids = [id for _, id, hit_session in hits if hit_session is session]
+        snippets.update(engine_for(session).snippets(session, query, ids))
+
+    found = router.get_messages([id for _, id, _ in hits])
+    results = [(found[id], highlight(snippets.get(id, found[id].text)))
+               for _, id, _ in hits if id in found]
+
+    return results, len(ranked) > (page + 1) * per_page
+
+
+def rebuild():
+    """Create the search index where missing and re-index every message."""
+
+    for session in router.sessions():
+        bind = session.get_bind(Message.__mapper__)
+        statements = (POSTGRES_DDL if bind.dialect.name == 'postgresql'
+                      else SQLITE_DDL + ["INSERT INTO message_search"
+                                         "(message_search) VALUES ('rebuild')"])
+        for statement in statements:
+            session.execute(text(statement))
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='create and fill the search index')
+    parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        rebuild()
+
+    print("Search index rebuilt.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,617 @@
+"""Optional horizontal sharding of messages and likes by user id.
+
+Set SHARD_DATABASE_URLS to a comma-separated list of database URLs and each
+user's messages (with their hashtag and mention index entries), and the
+likes they've made, are kept on one of those shard databases; users,
+follows and everything else stay on the main database.
+With no shards configured (the default) every call here just uses
+db.session, so the app works exactly as before.
+
+Users hash into NUM_BUCKETS buckets (user_id % NUM_BUCKETS), and the
+shard_ranges table on the main database assigns contiguous ranges of
+buckets to shards. Message and like ids come from counters on the main
+database, handed to each worker a block at a time, so they are unique
+across shards and don't change when rows move.
+
+Reads that span authors (the home feed, trending, a message by id) ask
+every shard and merge the results. Messages read from a shard get their
+author attached from the main database in one query.
+
+Create the shard tables, id counters and an even split of buckets, then
+move bucket ranges between shards, with:
+
+    python sharding.py init
+    python sharding.py show
+    python sharding.py move FIRST_BUCKET LAST_BUCKET SHARD
+"""
+
+import argparse
+import bisect
+import threading
+import time
+from collections import deque
+
+from flask import current_app, g
+from sqlalchemy import MetaData, Table, Column, Index, and_, or_, func, select
+from sqlalchemy.orm import Session, contains_eager, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from changes import changes, Change
+from models import (db, User, Message, Likes, MessageArchive, MessageTerm,
+                    ShardRange, IdCounter)
+import queries
+
+NUM_BUCKETS = 1024
+
+# ids a worker takes from a counter at a time
+ID_BLOCK = 100
+
+# seconds a worker trusts its copy of the shard map
+MAP_TTL = 10
+
+# rows copied per statement when moving buckets
+MOVE_BATCH = 1000
+
+
+def _shard_table(table, metadata):
+    """Copy of `table` without foreign keys, which can't cross databases."""
+
+    copy = Table(table.name, metadata, *[
+        Column(column.name, column.type, primary_key=column.primary_key,
+               nullable=column.nullable, autoincrement=False)
+        for column in table.columns])
+
+    for index in table.indexes:
+        Index(index.name, *[copy.c[column.name] for column in index.columns])
+
+    return copy
+
+
+# The tables as created on each shard.
+shard_metadata = MetaData()
+shard_messages = _shard_table(Message.__table__, shard_metadata)
+shard_likes = _shard_table(Likes.__table__, shard_metadata)
+shard_archive = _shard_table(MessageArchive.__table__, shard_metadata)
+shard_terms = _shard_table(MessageTerm.__table__, shard_metadata)
+
+SHARDED_TABLES = (shard_messages, shard_likes, shard_archive, shard_terms)
+
+
+def even_split(shards):
+    """Shard map giving each shard an equal run of buckets."""
+
+    size = -(-NUM_BUCKETS // len(shards))
+
+    return [(first, min(first + size, NUM_BUCKETS) - 1, shard)
+            for first, shard in zip(range(0, NUM_BUCKETS, size), shards)]
+
+
+def load_shard_map(shards):
+    """The shard map as [(first bucket, last bucket, shard)], in order."""
+
+    ranges = [(r.first_bucket, r.last_bucket, r.bind_key)
+              for r in ShardRange.query.order_by(ShardRange.first_bucket)]
+
+    return ranges or even_split(shards)
+
+
+def save_shard_map(ranges):
+    ShardRange.query.delete()
+    for first, last, shard in ranges:
+        db.session.add(ShardRange(first_bucket=first, last_bucket=last,
+                                  bind_key=shard))
+    db.session.commit()
+
+
+def assign_buckets(ranges, first, last, shard):
+    """Shard map `ranges` with buckets `first`..`last` moved to `shard`."""
+
+    result = [(first, last, shard)]
+
+    for start, end, key in ranges:
+        if start < first:
+            result.append((start, min(end, first - 1), key))
+        if end > last:
+            result.append((max(start, last + 1), end, key))
+
+    # join neighbouring ranges on the same shard
+    merged = []
+    for start, end, key in sorted(result):
+        if merged and merged[-1][2] == key and merged[-1][1] + 1 == start:
+            merged[-1] = (merged[-1][0], end, key)
+        else:
+            merged.append((start, end, key))
+
+    return merged
+
+
+def _allocate_ids(name, count):
+    """Take the next `count` ids for table `name` from its counter."""
+
+    counters = IdCounter.__table__
+
+    # in a transaction of its own, so the block is never handed out twice
+    with db.get_engine().begin() as conn:
+        conn.execute(counters
+                     .update()
+                     .where(counters.c.name == name)
+                     .values(next_id=counters.c.next_id + count))
+        end = conn.execute(select([counters.c.next_id])
+                           .where(counters.c.name == name)).scalar()
+
+    if end is None:
+        raise RuntimeError(f"no id counter for {name}; "
+                           f"run `python sharding.py init`")
+
+    return range(end - count, end)
+
+
+class _State:
+    """Per-app shard map cache and id blocks."""
+
+    def __init__(self):
+        self.firsts = None
+        self.shards = None
+        self.loaded = None
+        self.ids = {}
+        self.lock = threading.Lock()
+
+
+class ShardRouter:
+    """Send message and like queries to the shard holding their user."""
+
+    def __init__(self, map_ttl=MAP_TTL, clock=time.monotonic):
+        self.map_ttl = map_ttl
+        self.clock = clock
+
+    def init_app(self, app):
+        app.config.setdefault('SHARDS', [])
+        app.extensions['sharding'] = _State()
+        app.teardown_appcontext(self._close_sessions)
+
+    @property
+    def enabled(self):
+        # db.get_app() rather than current_app, like db.session, so the
+        # router also works outside a request (in scripts and tests)
+        return bool(db.get_app().config['SHARDS'])
+
+    ##########################################################################
+    # Routing
+
+    def shard_for(self, user_id):
+        """Bind key of the shard holding a user's rows; None if unsharded."""
+
+        if not self.enabled:
+            return None
+
+        state = db.get_app().extensions['sharding']
+        now = self.clock()
+
+        if state.loaded is None or now - state.loaded > self.map_ttl:
+            ranges = load_shard_map(db.get_app().config['SHARDS'])
+            state.firsts = [first for first, _, _ in ranges]
+            state.shards = [shard for _, _, shard in ranges]
+            state.loaded = now
+
+        i = bisect.bisect_right(state.firsts, user_id % NUM_BUCKETS) - 1
+        return state.shards[i]
+
+    def forget_shard_map(self):
+        db.get_app().extensions['sharding'].loaded = None
+
+    def session(self, shard):
+        """Session for `shard`, or db.session for None (unsharded)."""
+
+        if shard is None:
+            return db.session
+
+        sessions = g.setdefault('_shard_sessions', {})
+        if shard not in sessions:
+            sessions[shard] = Session(bind=db.get_engine(bind=shard),
+                                      expire_on_commit=False)
+
+        return sessions[shard]
+
+    def session_for(self, user_id):
+        return self.session(self.shard_for(user_id))
+
+    def sessions(self):
+        """A session for every shard."""
+
+        shards = db.get_app().config['SHARDS'] or [None]
+        return [self.session(shard) for shard in shards]
+
+    def group_by_shard(self, user_ids):
+        """[(session, user ids on that session's shard)]"""
+
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_for(user_id), []).append(user_id)
+
+        return [(self.session(shard), ids) for shard, ids in groups.items()]
+
+    def next_id(self, name):
+        """A new id for a row of sharded table `name`."""
+
+        state = db.get_app().extensions['sharding']
+
+        with state.lock:
+            block = state.ids.get(name)
+            if not block:
+                block = state.ids[name] = deque(_allocate_ids(name, ID_BLOCK))
+            return block.popleft()
+
+    def _close_sessions(self, exception):
+        for session in g.pop('_shard_sessions', {}).values():
+            session.close()
+
+    def _loaded(self, session, messages):
+        """Detach messages read from a shard and attach their authors."""
+
+        if not self.enabled:
+            return messages
+
+        for msg in messages:
+            session.expunge(msg)
+
+        return self.attach_authors(messages)
+
+    def attach_authors(self, messages):
+        """Set each message's user from the main database, in one query."""
+
+        ids = {msg.user_id for msg in messages}
+        users = {user.id: user
+                 for user in User.query.filter(User.id.in_(ids))} if ids else {}
+
+        for msg in messages:
+            set_committed_value(msg, 'user', users.get(msg.user_id))
+
+        return messages
+
+    ##########################################################################
+    # Messages
+
+    def add_message(self, user, text):
+        """Post a new message by `user`; the caller commits the session
+        for `user` (with anything else, like the message's index entries,
+        that belongs in the same transaction).
+        """
+
+        session = self.session_for(user.id)
+        msg = Message(text=text, user_id=user.id)
+        if self.enabled:
+            msg.id = self.next_id('messages')
+
+        session.add(msg)
+        session.flush()
+
+        if self.enabled:
+            session.expunge(msg)
+            set_committed_value(msg, 'user', user)
+
+        return msg
+
+    def get_messages(self, ids):
+        """{id: message} for those of `ids` that exist, with their authors."""
+
+        if not ids:
+            return {}
+
+        if not self.enabled:
+            return {msg.id: msg for msg in (Message
+                                             .query
+                                             .options(joinedload(Message.user))
+                                             .filter(Message.id.in_(ids)))}
+
+        found = []
+        for session in self.sessions():
+            messages = session.query(Message).filter(Message.id.in_(ids)).all()
+            for msg in messages:
+                session.expunge(msg)
+            found.extend(messages)
+
+        return {msg.id: msg for msg in self.attach_authors(found)}
+
+    def get_message(self, message_id):
+        return self.get_messages([message_id]).get(message_id)
+
+    def user_messages(self, user_id, limit):
+        """A user's newest `limit` messages."""
+
+        session = self.session_for(user_id)
+        messages = (queries.user_messages(session)
+                    .params(user_id=user_id, limit=limit)
+                    .all())
+
+        return self._loaded(session, messages)
+
+    def count_messages(self, user_id):
+        return (queries.count_messages(self.session_for(user_id))
+                .params(user_id=user_id)
+                .scalar())
+
+    def delete_message(self, msg):
+        """Delete `msg` (as returned by get_message) and its likes."""
+
+        if not self.enabled:
+            db.session.delete(msg)
+            db.session.commit()
+            return
+
+        # likes of it can be on any shard
+        for session in self.sessions():
+            (session
+             .query(Likes)
+             .filter(Likes.message_id == msg.id)
+             .delete(synchronize_session=False))
+            session.commit()
+
+        session = self.session_for(msg.user_id)
+        (session
+         .query(Message)
+         .filter(Message.id == msg.id)
+         .delete(synchronize_session=False))
+        # the bulk delete alone wouldn't say whose message it was
+        changes.record(session, Change('Message', 'delete', {
+            'id': msg.id, 'user_id': msg.user_id}, frozenset()))
+        session.commit()
+
+    def delete_user_data(self, user_id):
+        """Delete a user's messages, likes and archive from their shard.
+
+        Unsharded, deleting the user cascades to them in the database.
+        """
+
+        if not self.enabled:
+            return
+
+        session = self.session_for(user_id)
+        message_ids = [id for (id,) in (session
+                                        .query(Message.id)
+                                        .filter(Message.user_id == user_id))]
+
+        if message_ids:
+            for other in self.sessions():
+                (other
+                 .query(Likes)
+                 .filter(Likes.message_id.in_(message_ids))
+                 .delete(synchronize_session=False))
+                other.commit()
+
+        session.query(Likes).filter(Likes.user_id == user_id).delete(
+            synchronize_session=False)
+        session.query(MessageArchive).filter(
+            MessageArchive.user_id == user_id).delete(synchronize_session=False)
+        session.query(Message).filter(Message.user_id == user_id).delete(
+            synchronize_session=False)
+        session.query(MessageTerm).filter(
+            MessageTerm.user_id == user_id).delete(synchronize_session=False)
+        session.commit()
+
+    ##########################################################################
+    # Likes
+
+    def liked_ids(self, user_id, message_ids):
+        """Which of `message_ids` has the user liked?"""
+
+        if not message_ids:
+            return set()
+
+        return {message_id for (message_id,) in (
+            self.session_for(user_id)
+            .query(Likes.message_id)
+            .filter(Likes.user_id == user_id,
+                    Likes.message_id.in_(message_ids)))}
+
+    def like(self, user_id, message_id):
+        session = self.session_for(user_id)
+        like = Likes(user_id=user_id, message_id=message_id)
+        if self.enabled:
+            like.id = self.next_id('likes')
+
+        session.add(like)
+        session.commit()
+
+    def unlike(self, user_id, message_id):
+        session = self.session_for(user_id)
+        (session
+         .query(Likes)
+         .filter(Likes.user_id == user_id, Likes.message_id == message_id)
+         .delete(synchronize_session=False))
+        session.commit()
+
+    def count_likes(self, user_id):
+        return (queries.count_likes(self.session_for(user_id))
+                .params(user_id=user_id)
+                .scalar())
+
+    def liked_page(self, user_id, before=None, limit=50):
+        """A page of a user's likes, newest first.
+
+        Returns [(message, liked at, like id)]; pass the last row's (liked at,
+        like id) as `before` to get the next page. Unsharded, messages and
+        authors come from the same query as the likes.
+        """
+
+        session = self.session_for(user_id)
+
+        if self.enabled:
+            query = session.query(Likes.message_id, Likes.created_at, Likes.id)
+        else:
+            query = (session
+                     .query(Message, Likes.created_at, Likes.id)
+                     .join(Likes, Likes.message_id == Message.id)
+                     .join(Message.user)
+                     .options(contains_eager(Message.user)))
+
+        query = query.filter(Likes.user_id == user_id)
+
+        if before:
+            liked_at, like_id = before
+            query = query.filter(or_(
+                Likes.created_at < liked_at,
+                and_(Likes.created_at == liked_at, Likes.id < like_id)))
+
+        rows = (query
+                .order_by(Likes.created_at.desc(), Likes.id.desc())
+                .limit(limit)
+                .all())
+
+        if not self.enabled:
+            return rows
+
+        found = self.get_messages([message_id for message_id, _, _ in rows])
+        return [(found[message_id], liked_at, like_id)
+                for message_id, liked_at, like_id in rows
+                if message_id in found]
+
+
+# Router shared by every request in this worker.
+router = ShardRouter()
+
+
+##############################################################################
+# Setting up and rebalancing shards
+
+
+def init_shards():
+    """Create shard tables, id counters and (if unset) an even shard map."""
+
+    shards = current_app.config['SHARDS']
+    if not shards:
+        raise ValueError("no shards configured; set SHARD_DATABASE_URLS")
+
+    for shard in shards:
+        shard_metadata.create_all(db.get_engine(bind=shard))
+
+    engine = db.get_engine()
+    ShardRange.__table__.create(engine, checkfirst=True)
+    IdCounter.__table__.create(engine, checkfirst=True)
+
+    # start above any ids already used on the main database
+    for table in (Message.__table__, Likes.__table__):
+        if not IdCounter.query.get(table.name):
+            used = db.session.query(func.max(table.c.id)).scalar() or 0
+            db.session.add(IdCounter(name=table.name, next_id=used + 1))
+    db.session.commit()
+
+    if not ShardRange.query.count():
+        save_shard_map(even_split(shards))
+
+
+def _copy_rows(table, source, dest, first, last, batch_size):
+    """Copy rows of users in buckets `first`..`last` not yet on `dest`."""
+
+    in_range = (table.c.user_id % NUM_BUCKETS).between(first, last)
+    primary_key = list(table.primary_key.columns)
+    # index entries are copied a batch of messages (all their terms) at a time
+    key = table.c.message_id if table is shard_terms else primary_key[0]
+    source = db.get_engine(bind=source)
+    dest = db.get_engine(bind=dest)
+
+    copied = 0
+    last_key = 0
+
+    while True:
+        keys = [value for (value,) in source.execute(
+            select([key])
+            .where(and_(in_range, key > last_key))
+            .distinct()
+            .order_by(key)
+            .limit(batch_size))]
+        if not keys:
+            return copied
+
+        last_key = keys[-1]
+        rows = source.execute(select([table])
+                              .where(and_(in_range, key.in_(keys)))).fetchall()
+
+        with dest.begin() as conn:
+            present = {tuple(row) for row in conn.execute(
+                select(primary_key).where(key.in_(keys)))}
+            new = [dict(row) for row in rows
+                   if tuple(row[column] for column in primary_key)
+                   not in present]
+            if new:
+                conn.execute(table.insert(), new)
+
+        copied += len(new)
+
+
+def move_buckets(first, last, dest, wait=MAP_TTL, batch_size=MOVE_BATCH):
+    """Move the rows of users in buckets `first`..`last` to shard `dest`.
+
+    Rows are copied while the old shards keep serving, then the shard map
+    is switched. After `wait` seconds every worker has reloaded the map;
+    anything written to the old shards meanwhile is copied over too, and
+    only then are the old copies deleted. (An unlike that lands on the old
+    shard in that window is lost.) Returns the number of rows copied.
+    """
+
+    shards = current_app.config['SHARDS']
+    if dest not in shards:
+        raise ValueError(f"unknown shard {dest}; expected one of {shards}")
+    if not 0 <= first <= last < NUM_BUCKETS:
+        raise ValueError(f"buckets must be in 0..{NUM_BUCKETS - 1}")
+
+    ranges = load_shard_map(shards)
+    sources = sorted({shard for start, end, shard in ranges
+                      if start <= last and end >= first and shard != dest})
+
+    def copy():
+        return sum(_copy_rows(table, source, dest, first, last, batch_size)
+                   for source in sources for table in SHARDED_TABLES)
+
+    copied = copy()
+    save_shard_map(assign_buckets(ranges, first, last, dest))
+    router.forget_shard_map()
+
+    time.sleep(wait)
+    copied += copy()
+
+    for source in sources:
+        engine = db.get_engine(bind=source)
+        for table in SHARDED_TABLES:
+            engine.execute(table.delete().where(
+                (table.c.user_id % NUM_BUCKETS).between(first, last)))
+
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('init', help='create shard tables and an even map')
+    commands.add_parser('show', help='print the shard map')
+
+    move = commands.add_parser('move', help='move a range of buckets')
+    move.add_argument('first', type=int)
+    move.add_argument('last', type=int)
+    move.add_argument('shard')
+    move.add_argument('--wait', type=float, default=MAP_TTL,
+                      help='seconds for workers to pick up the new map')
+    move.add_argument('--batch-size', type=int, default=MOVE_BATCH)
+
+    args = parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        if not current_app.config['SHARDS']:
+            parser.error("no shards configured; set SHARD_DATABASE_URLS")
+
+        if args.command == 'init':
+            init_shards()
+
+        elif args.command == 'move':
+            copied = move_buckets(args.first, args.last, args.shard,
+                                  wait=args.wait, batch_size=args.batch_size)
+            print(f"Copied {copied} rows to {args.shard}.")
+
+        for first, last, shard in load_shard_map(current_app.config['SHARDS']):
+            print(f"{first:>5}..{last:<5} {shard}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Slow query log.
+
+Times every statement the app sends to a database (the main one and any
+shards). One that takes SLOW_QUERY_MS or longer is written, as a line of
+JSON, to the rotating log at SLOW_QUERY_LOG, along with:
+
+- its parameters, redacted: numbers and None are kept, anything else is
+  replaced by its type name, so passwords and email addresses stay out of
+  the log;
+- the endpoint of the request running it;
+- the innermost frame of our own code that ran it, and the template line,
+  if it came from a template (say, a lazy relationship like user.messages);
+- the database's plan for it (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on
+  Postgres), for SELECTs. Plans are cached by statement, so a statement
+  that is often slow is only explained once per worker. The EXPLAIN runs
+  in a SAVEPOINT on the request's own connection, so if it fails (on
+  Postgres, an error aborts the whole transaction) it is rolled back
+  without taking the request's transaction with it.
+
+Summarize the log, slowest statements (by total time) first, with:
+
+    python slowlog.py summary [--top N] [--plans]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'warbler-slow-queries.log')
+
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+# plans cached per worker before the cache starts over
+MAX_PLANS = 1000
+
+SAVEPOINT = 'slowlog_explain'
+
+PARAMETER_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+'
+                            r'\s*(?:\?|%\(\w+\)s|:\w+)\s*\)')
+SPACE = re.compile(r'\s+')
+
+
+def redact(parameters):
+    """`parameters` with everything but numbers and None hidden."""
+
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (bool, int, float)):
+        return parameters
+
+    return f"<{type(parameters).__name__}>"
+
+
+def normalize(statement):
+    """`statement` with whitespace collapsed and IN lists of any length alike."""
+
+    return PARAMETER_LIST.sub('(...)', SPACE.sub(' ', statement).strip())
+
+
+def origin(frame, root_path):
+    """(innermost frame of our code, template line) that led to `frame`.
+
+    Each is a 'file:line' string, or None.
+    """
+
+    caller = template = None
+
+    while frame is not None and (caller is None or template is None):
+        jinja_template = frame.f_globals.get('__jinja_template__')
+        filename = frame.f_code.co_filename
+
+        if jinja_template is not None:
+            if template is None:
+                template = (f"{jinja_template.name}:"
+                            f"{jinja_template.get_corresponding_lineno(frame.f_lineno)}")
+        elif (caller is None and filename.startswith(root_path)
+              and filename != __file__ and 'site-packages' not in filename):
+            caller = (f"{os.path.relpath(filename, root_path)}:"
+                      f"{frame.f_lineno} in {frame.f_code.co_name}")
+
+        frame = frame.f_back
+
+    return caller, template
+
+
+class SlowQueryLog:
+    """Where and when one app logs slow statements."""
+
+    def __init__(self, path=DEFAULT_PATH, threshold_ms=250,
+                 max_bytes=10 * 1024 * 1024, backups=5, root_path=''):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.root_path = root_path
+        self.plans = {}
+
+        # a logger of our own, so nothing else's records end up in the file
+        self.logger = logging.Logger('warbler.slow_queries')
+        handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                      backupCount=backups, delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(handler)
+
+    def explain(self, connection, statement, parameters, executemany):
+        """The plan for a SELECT, or None; errors are returned as the plan."""
+
+        prefix = EXPLAIN.get(connection.dialect.name)
+        if (prefix is None or executemany
+                or statement.lstrip()[:6].upper() not in ('SELECT', 'WITH ')):
+            return None
+
+        if statement in self.plans:
+            return self.plans[statement]
+
+        # a raw DBAPI cursor, so the EXPLAIN isn't itself timed and logged
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(f'SAVEPOINT {SAVEPOINT}')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            except Exception as e:
+                plan = f"EXPLAIN failed: {e}"
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {SAVEPOINT}')
+            cursor.execute(f'RELEASE SAVEPOINT {SAVEPOINT}')
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        finally:
+            cursor.close()
+
+        if len(self.plans) >= MAX_PLANS:
+            self.plans.clear()
+        self.plans[statement] = plan
+
+        return plan
+
+    def record(self, connection, statement, parameters, executemany, seconds):
+        caller, template = origin(sys._getframe(), self.root_path)
+
+        entry = {
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'ms': round(seconds * 1000, 2),
+            'statement': statement,
+            'parameters': redact(parameters[0] if executemany else parameters),
+            'rows': len(parameters) if executemany else None,
+            'endpoint': request.endpoint if has_request_context() else None,
+            'caller': caller,
+            'template': template,
+            'plan': self.explain(connection, statement, parameters,
+                                 executemany),
+        }
+
+        self.logger.warning(json.dumps(entry, default=str))
+
+
+def init_app(app):
+    """Log `app`'s slow statements, if SLOW_QUERY_MS is set."""
+
+    app.extensions.pop('slow_queries', None)
+
+    if not app.config.get('SLOW_QUERY_MS'):
+        return
+
+    app.extensions['slow_queries'] = SlowQueryLog(
+        path=app.config.get('SLOW_QUERY_LOG', DEFAULT_PATH),
+        threshold_ms=app.config['SLOW_QUERY_MS'],
+        max_bytes=app.config.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024),
+        backups=app.config.get('SLOW_QUERY_LOG_BACKUPS', 5),
+        root_path=app.root_path,
+    )
+    _listen()
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+
+    if not has_app_context():
+        return
+
+    log = current_app.extensions.get('slow_queries')
+    if log is not None and seconds >= log.threshold:
+        log.record(conn, statement, parameters, executemany, seconds)
+
+
+def _on_error(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is None or exception_context.cursor is None:
+        return
+
+    started = connection.info.get('query_started')
+    if started:
+        started.pop()
+
+
+def _listen():
+    # every engine, including ones Flask-SQLAlchemy creates later
+    if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_execute)
+        event.listen(Engine, 'handle_error', _on_error)
+
+
+##############################################################################
+# Summary
+
+def read_entries(path):
+    """Entries from the log at `path` and its rotated backups, oldest first."""
+
+    paths = [path]
+    backup = 1
+    while os.path.exists(f"{path}.{backup}"):
+        paths.append(f"{path}.{backup}")
+        backup += 1
+
+    for log_path in reversed(paths):
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path) as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def summarize(entries):
+    """Statistics for each distinct statement, by total time spent, descending.
+
+    Returns a list of dicts of statement, count, total_ms, max_ms,
+    endpoints and origins (Counters) and the slowest entry.
+    """
+
+    groups = defaultdict(lambda: {'count': 0, 'total_ms': 0, 'max_ms': 0,
+                                  'endpoints': Counter(),
+                                  'origins': Counter(), 'slowest': None})
+
+    for entry in entries:
+        statement = normalize(entry['statement'])
+        group = groups[statement]
+        group['statement'] = statement
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        group['endpoints'][entry.get('endpoint') or '-'] += 1
+        group['origins'][entry.get('template')
+                         or entry.get('caller') or '-'] += 1
+
+        if entry['ms'] >= group['max_ms']:
+            group['max_ms'] = entry['ms']
+            group['slowest'] = entry
+
+    return sorted(groups.values(), key=lambda group: group['total_ms'],
+                  reverse=True)
+
+
+def _top(counter, n=3):
+    return ', '.join(f"{name} ({count})" for name, count in counter.most_common(n))
+
+
+def print_summary(groups, top=20, plans=False, width=100):
+    print(f"{'total ms':>10} {'count':>6} {'mean ms':>8} {'max ms':>8}  statement")
+
+    for group in groups[:top]:
+        statement = group['statement']
+        if len(statement) > width:
+            statement = statement[:width - 1] + '…'
+
+        print(f"{group['total_ms']:>10.1f} {group['count']:>6} "
+              f"{group['total_ms'] / group['count']:>8.1f} "
+              f"{group['max_ms']:>8.1f}  {statement}")
+        print(f"{'':>36}endpoints: {_top(group['endpoints'])}")
+        print(f"{'':>36}from: {_top(group['origins'])}")
+
+        if plans and group['slowest'].get('plan'):
+            for line in group['slowest']['plan'].splitlines():
+                print(f"{'':>38}{line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    summary = commands.add_parser(
+        'summary', help='show the statements that took the most time')
+    summary.add_argument('--log', help='log file (default: SLOW_QUERY_LOG)')
+    summary.add_argument('--top', type=int, default=20)
+    summary.add_argument('--endpoint', help='only statements run by this endpoint')
+    summary.add_argument('--plans', action='store_true',
+                         help='show the plan of each statement\'s slowest run')
+
+    args = parser.parse_args()
+
+    path = args.log
+    if path is None:
+        from app import create_app
+        path = create_app().config.get('SLOW_QUERY_LOG', DEFAULT_PATH)
+
+    entries = read_entries(path)
+    if args.endpoint:
+        entries = (entry for entry in entries
+                   if entry.get('endpoint') == args.endpoint)
+
+    print_summary(summarize(entries), top=args.top, plans=args.plans)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Hashtags and mentions.
+
+Each message's #hashtags and @mentions are extracted when it's posted and
+stored in an inverted index, message_terms, keyed by term ('#topic', or
+'@' and the mentioned user's id) with the message's timestamp, so a tag or
+mention timeline is an index range scan rather than a LIKE over every
+message. With sharding, a message's entries live on its author's shard,
+written in the same transaction as the message, and a timeline merges
+every shard's. The index keeps entries for archived messages; timelines
+load the messages themselves by id.
+
+Entries are written in batches: one multi-row INSERT per call, however
+many messages are passed; an import re-indexes its user once at the end.
+Index existing messages (for example after turning this on) with:
+
+    python tags.py rebuild
+"""
+
+import argparse
+import heapq
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_, or_
+
+from archive import CHUNK_SIZE, archived_messages_by_ids, unpack
+from models import db, User, Message, MessageArchive, MessageTerm
+from sharding import router
+
+HASHTAG = re.compile(r'(?<![\w#])#(\w{1,50})')
+MENTION = re.compile(r'(?<![\w@])@(\w+)')
+TERM = re.compile(f'{HASHTAG.pattern}|{MENTION.pattern}')
+
+REBUILD_BATCH = 1000
+
+
+def extract(text):
+    """Return (set of lowercased hashtags, set of mentioned usernames)."""
+
+    return ({tag.lower() for tag in HASHTAG.findall(text)},
+            set(MENTION.findall(text)))
+
+
+def tag_term(tag):
+    return f"#{tag.lower()}"
+
+
+def mention_term(user_id):
+    return f"@{user_id}"
+
+
+def user_ids_by_name(usernames, session=None):
+    """{username: id} for those of `usernames` that exist, in one query."""
+
+    if not usernames:
+        return {}
+
+    return dict((session or db.session)
+                .query(User.username, User.id)
+                .filter(User.username.in_(usernames)))
+
+
+def mentioned_user_ids(text):
+    """Ids of the existing users mentioned in `text`."""
+
+    _, usernames = extract(text)
+    return set(user_ids_by_name(usernames).values())
+
+
+def index_messages(messages, session=None):
+    """Add index entries for `messages`, in one INSERT; the caller commits.
+
+    `session` is the one for the messages' shard (db.session by default).
+    """
+
+    session = session or db.session
+
+    extracted = [(msg, *extract(msg.text)) for msg in messages]
+
+    usernames = set().union(*(names for _, _, names in extracted))
+    user_ids = user_ids_by_name(usernames)
+
+    rows = []
+    for msg, tags, names in extracted:
+        terms = {tag_term(tag) for tag in tags}
+        terms.update(mention_term(user_ids[name])
+                     for name in names if name in user_ids)
+
+        rows.extend({'term': term, 'message_id': msg.id,
+                     'timestamp': msg.timestamp, 'user_id': msg.user_id}
+                    for term in terms)
+
+    if rows:
+        session.execute(MessageTerm.__table__.insert(), rows)
+
+    return len(rows)
+
+
+def unindex_message(message_id, user_id):
+    """Remove a message's entries; unsharded, the caller commits."""
+
+    session = router.session_for(user_id)
+    (session
+     .query(MessageTerm)
+     .filter(MessageTerm.message_id == message_id)
+     .delete(synchronize_session=False))
+    if router.enabled:
+        session.commit()
+
+
+def unindex_user(user_id):
+    """Remove entries for a user's messages and for mentions of them (on
+    every shard); unsharded, the caller commits.
+    """
+
+    for session in router.sessions():
+        (session
+         .query(MessageTerm)
+         .filter(or_(MessageTerm.user_id == user_id,
+                     MessageTerm.term == mention_term(user_id)))
+         .delete(synchronize_session=False))
+        if router.enabled:
+            session.commit()
+
+
+def timeline(term, before=None, limit=50):
+    """A page of the messages indexed under `term`, newest first.
+
+    Returns (messages, key of the next page or None); pass the key back as
+    `before` to get that page.
+    """
+
+    pages = []
+    for session in router.sessions():
+        query = (session
+                 .query(MessageTerm.timestamp, MessageTerm.message_id,
+                        MessageTerm.user_id)
+                 .filter(MessageTerm.term == term))
+
+        if before:
+            timestamp, message_id = before
+            query = query.filter(or_(
+                MessageTerm.timestamp < timestamp,
+                and_(MessageTerm.timestamp == timestamp,
+                     MessageTerm.message_id < message_id)))
+
+        pages.append(query
+                     .order_by(MessageTerm.timestamp.desc(),
+                               MessageTerm.message_id.desc())
+                     .limit(limit + 1)
+                     .all())
+
+    # each shard's page is newest first; merge them
+    keys = list(heapq.merge(*pages, key=lambda key: tuple(key[:2]),
+                            reverse=True))[:limit + 1]
+
+    next_key = tuple(keys[limit - 1][:2]) if len(keys) > limit else None
+    authors = {message_id: user_id for _, message_id, user_id in keys[:limit]}
+    found = router.get_messages(list(authors))
+
+    # the rest may have been moved to the archive
+    missing = [message_id for message_id in authors if message_id not in found]
+    if missing:
+        found.update(archived_messages_by_ids(missing, authors))
+
+    messages = [found[message_id] for message_id in authors
+                if message_id in found]
+
+    return messages, next_key
+
+
+def link_terms(text):
+    """Escape `text`, linking its hashtags and mentions."""
+
+    parts = []
+    end = 0
+
+    for match in TERM.finditer(text):
+        parts.append(escape(text[end:match.start()]))
+        tag, username = match.groups()
+
+        if tag:
+            parts.append(Markup('<a href="/tags/{}">#{}</a>').format(
+                tag.lower(), tag))
+        else:
+            parts.append(Markup('<a href="/users?q={}">@{}</a>').format(
+                username, username))
+
+        end = match.end()
+
+    parts.append(escape(text[end:]))
+    return Markup('').join(parts)
+
+
+def _index_stored(session, batch_size, user_id=None):
+    """Index the messages, hot and archived, stored on `session`'s database."""
+
+    added = 0
+    last_id = 0
+
+    while True:
+        messages = (session
+                    .query(Message.id, Message.user_id, Message.timestamp,
+                           Message.text)
+                    .filter(Message.id > last_id))
+        if user_id is not None:
+            messages = messages.filter(Message.user_id == user_id)
+        messages = messages.order_by(Message.id).limit(batch_size).all()
+        if not messages:
+            break
+
+        last_id = messages[-1].id
+        added += index_messages(messages, session)
+        session.commit()
+
+    # archived messages, a few chunks at a time
+    last_id = 0
+
+    while True:
+        chunks = (session
+                  .query(MessageArchive)
+                  .filter(MessageArchive.first_id > last_id))
+        if user_id is not None:
+            chunks = chunks.filter(MessageArchive.user_id == user_id)
+        chunks = (chunks
+                  .order_by(MessageArchive.first_id)
+                  .limit(max(batch_size // CHUNK_SIZE, 1))
+                  .all())
+        if not chunks:
+            break
+
+        last_id = chunks[-1].first_id
+        added += index_messages(
+            [msg for chunk in chunks for msg in unpack(chunk)], session)
+        session.commit()
+
+    return added
+
+
+def reindex_user(user_id, batch_size=REBUILD_BATCH):
+    """Index all of one user's messages again (say, after an import)."""
+
+    session = router.session_for(user_id)
+    session.query(MessageTerm).filter(MessageTerm.user_id == user_id).delete(
+        synchronize_session=False)
+    session.commit()
+
+    return _index_stored(session, batch_size, user_id)
+
+
+def rebuild(batch_size=REBUILD_BATCH):
+    """Index every message, hot or archived, again; returns entries added."""
+
+    for session in router.sessions():
+        session.query(MessageTerm).delete(synchronize_session=False)
+        session.commit()
+
+    return sum(_index_stored(session, batch_size)
+               for session in router.sessions())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_command = commands.add_parser(
+        'rebuild', help='index every message again')
+    rebuild_command.add_argument('--batch-size', type=int,
+                                 default=REBUILD_BATCH)
+
+    args = parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        added = rebuild(batch_size=args.batch_size)
+
+    print(f"Indexed {added} hashtags and mentions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import db
+from testing import DatabaseTestCase, make_user, make_message, make_follow
+
+
+class APITestCase(DatabaseTestCase):
+    """Test batch JSON endpoints."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user(bio="Hi, I'm Alice")
+        self.bob = make_user()
+        make_follow(self.bob, self.alice)
+
+        start = datetime(2020, 1, 1)
+        self.messages = [make_message(self.alice,
+                                      timestamp=start + timedelta(minutes=i))
+                         for i in range(5)]
+
+    def count_queries(self, url):
+        """GET `url`, returning (json, number of SQL statements run)."""
+
+        statements = []
+
+        def record(*args):
+            statements.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            resp = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json(), len(statements)
+
+    def test_messages_batch(self):
+        """Are messages returned in the requested order, skipping unknowns?"""
+
+        first, last = self.messages[0], self.messages[-1]
+        data, queries = self.count_queries(
+            f"/api/v1/messages?ids={last.id},999999,{first.id}")
+
+        self.assertEqual([m['id'] for m in data['messages']],
+                         [last.id, first.id])
+        self.assertEqual(data['messages'][0]['user'],
+                         {'id': self.alice.id,
+                          'username': self.alice.username,
+                          'image_url': self.alice.image_url})
+
+        more, more_queries = self.count_queries(
+            "/api/v1/messages?ids=" + ",".join(str(m.id) for m in self.messages))
+        self.assertEqual(len(more['messages']), 5)
+        # an unknown id costs one more query, looking for it in the archive
+        self.assertEqual(queries, more_queries + 1)
+
+    def test_users_batch(self):
+        """Are profiles and counts returned in a fixed number of queries?"""
+
+        data, queries = self.count_queries(
+            f"/api/v1/users?ids={self.alice.id},{self.bob.id}")
+
+        alice, bob = data['users']
+        self.assertEqual(alice['bio'], "Hi, I'm Alice")
+        self.assertEqual((alice['messages'], alice['followers'],
+                          alice['following']), (5, 1, 0))
+        self.assertEqual((bob['messages'], bob['followers'],
+                          bob['following']), (0, 0, 1))
+        self.assertNotIn('password', alice)
+        self.assertNotIn('email', alice)
+
+        _, one_user_queries = self.count_queries(
+            f"/api/v1/users?ids={self.alice.id}")
+        self.assertEqual(queries, one_user_queries)
+
+    def test_bad_ids(self):
+        """Are missing, malformed or too many ids rejected?"""
+
+        for query in ["", "?ids=", "?ids=1,x",
+                      "?ids=" + ",".join(map(str, range(101)))]:
+            resp = self.client.get(f"/api/v1/messages{query}")
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('error', resp.get_json())
+
+    def test_timeline_pages(self):
+        """Does the cursor walk the timeline newest first without overlap?"""
+
+        url = f"/api/v1/users/{self.alice.id}/timeline?limit=2"
+        seen = []
+
+        data = self.client.get(url).get_json()
+        seen += [m['id'] for m in data['messages']]
+
+        while data['next_cursor']:
+            data = self.client.get(
+                f"{url}&cursor={data['next_cursor']}").get_json()
+            seen += [m['id'] for m in data['messages']]
+
+        self.assertEqual(seen, [m.id for m in reversed(self.messages)])
+
+    def test_timeline_errors(self):
+        resp = self.client.get("/api/v1/users/999999/timeline")
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.get(
+            f"/api/v1/users/{self.alice.id}/timeline?cursor=nope")
+        self.assertEqual(resp.status_code, 400)
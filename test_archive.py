@@ -0,0 +1,154 @@
+"""Message archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import archive
+from archive import (archive_messages, archived_message, archived_messages,
+                     archived_messages_by_ids, count_archived)
+from models import Message, MessageArchive
+from testing import DatabaseTestCase, make_user, make_message, make_like
+
+CUTOFF = datetime(2020, 1, 1)
+
+
+class ArchiveTestCase(DatabaseTestCase):
+    """Test moving old messages to the compressed archive and reading them."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+        self.old = [make_message(self.user, text=f"Old {i}.",
+                                 timestamp=CUTOFF - timedelta(days=10 - i))
+                    for i in range(5)]
+        self.new = make_message(self.user, text="New.",
+                                timestamp=CUTOFF + timedelta(days=1))
+
+        # the archived rows are gone once the job commits
+        self.old_ids = [msg.id for msg in self.old]
+        self.old_timestamps = [msg.timestamp for msg in self.old]
+
+    def test_archive(self):
+        """Are only old messages moved, into compressed chunks?"""
+
+        archived = archive_messages(CUTOFF, chunk_size=2)
+
+        self.assertEqual(archived, 5)
+        self.assertEqual([msg.text for msg in Message.query.all()], ["New."])
+        self.assertEqual(MessageArchive.query.count(), 3)
+        self.assertEqual(count_archived(self.user.id), 5)
+        self.assertEqual(self.user.count_messages(), 6)
+
+    def test_liked_messages_stay(self):
+        make_like(make_user(), self.old[0])
+
+        archived = archive_messages(CUTOFF, batch_size=2)
+
+        self.assertEqual(archived, 4)
+        self.assertEqual(Message.query.count(), 2)
+
+    def test_read_back(self):
+        archive_messages(CUTOFF)
+
+        msg = archived_message(self.old_ids[2])
+        self.assertEqual((msg.text, msg.timestamp, msg.user.username),
+                         ("Old 2.", self.old_timestamps[2], self.user.username))
+
+        newest = archived_messages(self.user.id, limit=2)
+        self.assertEqual([msg.text for msg in newest], ["Old 4.", "Old 3."])
+
+        self.assertIsNone(archived_message(self.new.id))
+
+    def test_views_fall_back(self):
+        """Do profiles and message pages show archived messages?"""
+
+        archive_messages(CUTOFF)
+
+        html = self.client.get(f"/users/{self.user.id}").get_data(as_text=True)
+        self.assertLess(html.index("New."), html.index("Old 4."))
+        self.assertLess(html.index("Old 4."), html.index("Old 0."))
+
+        resp = self.client.get(f"/messages/{self.old_ids[1]}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Old 1.", resp.get_data(as_text=True))
+
+    def test_delete_archived(self):
+        archive_messages(CUTOFF, chunk_size=2)
+
+        self.login(self.user)
+        self.client.post(f"/messages/{self.old_ids[1]}/delete")
+
+        self.assertIsNone(archived_message(self.old_ids[1]))
+        self.assertEqual(count_archived(self.user.id), 4)
+        self.assertEqual(archived_message(self.old_ids[0]).text, "Old 0.")
+
+    def test_lookup_by_ids(self):
+        """Are only the chunks that can hold the ids decompressed?"""
+
+        other = make_user()
+        others = [make_message(other, text=f"Other {i}.",
+                               timestamp=CUTOFF - timedelta(days=1))
+                  for i in range(2)]
+        other_ids = [msg.id for msg in others]
+        archive_messages(CUTOFF, chunk_size=2)
+
+        # the other user's chunk overlaps none of self.user's three
+        wanted = [self.old_ids[0], self.old_ids[4], other_ids[1]]
+        with patch.object(archive, 'unpack', wraps=archive.unpack) as unpack:
+            found = archived_messages_by_ids(wanted)
+        self.assertEqual({id: msg.text for id, msg in found.items()},
+                         {self.old_ids[0]: "Old 0.", self.old_ids[4]: "Old 4.",
+                          other_ids[1]: "Other 1."})
+        self.assertEqual(unpack.call_count, 3)
+
+        # knowing the author skips other users' chunks
+        with patch.object(archive, 'unpack', wraps=archive.unpack) as unpack:
+            found = archived_messages_by_ids([self.old_ids[4]],
+                                             {self.old_ids[4]: self.user.id})
+        self.assertEqual(found[self.old_ids[4]].user.id, self.user.id)
+        self.assertEqual(unpack.call_count, 1)
+
+    def test_api_and_export(self):
+        """Do the API's timelines and the export include the archive?"""
+
+        archive_messages(CUTOFF)
+
+        texts = []
+        url = f"/api/v1/users/{self.user.id}/timeline?limit=4"
+        while url:
+            data = self.client.get(url).get_json()
+            texts.extend(msg['text'] for msg in data['messages'])
+            url = data['next_cursor'] and (
+                f"/api/v1/users/{self.user.id}/timeline?limit=4"
+                f"&cursor={data['next_cursor']}")
+        self.assertEqual(texts, ["New.", "Old 4.", "Old 3.", "Old 2.",
+                                 "Old 1.", "Old 0."])
+
+        self.login(self.user)
+        lines = self.client.get(f"/users/{self.user.id}/export").get_data(
+            as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['text'] for line in lines],
+                         [f"Old {i}." for i in range(5)] + ["New."])
+
+    def test_messages_batch(self):
+        """Does the batch endpoint find archived messages too?"""
+
+        archive_messages(CUTOFF)
+
+        ids = f"{self.new.id},{self.old_ids[3]},{self.old_ids[0]}"
+        data = self.client.get(f"/api/v1/messages?ids={ids}").get_json()
+        self.assertEqual([(msg['text'], msg['user']['username'])
+                          for msg in data['messages']],
+                         [("New.", self.user.username),
+                          ("Old 3.", self.user.username),
+                          ("Old 0.", self.user.username)])
+
+    def test_missing_message(self):
+        self.assertEqual(self.client.get("/messages/999999").status_code, 404)
@@ -0,0 +1,195 @@
+"""Change event tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_changes.py
+
+
+import json
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from changes import Change, ChangeBus, SQLiteChannel, changes
+from feed import timelines
+from models import db
+from sharding import router
+from testing import DatabaseTestCase, make_user, make_message
+
+
+class ChangeCaptureTestCase(DatabaseTestCase):
+    """Test which changes are published, and when."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user()
+        self.bob = make_user()
+        db.session.commit()
+
+        self.published = []
+        changes.subscribe(self.published.append)
+        self.addCleanup(changes.subscribers.remove,
+                        (self.published.append, None))
+
+    def test_insert_and_update(self):
+        msg = router.add_message(self.alice, "Hello.")
+        db.session.commit()
+
+        self.alice.username = "alice2"
+        db.session.commit()
+
+        self.assertEqual(self.published, [
+            [Change('Message', 'insert', {'id': msg.id,
+                                          'user_id': self.alice.id,
+                                          'timestamp': msg.timestamp},
+                    frozenset())],
+            [Change('User', 'update', {'id': self.alice.id},
+                    frozenset({'username'}))],
+        ])
+
+    def test_follow_edges(self):
+        """Are follows through User.following seen, once each?"""
+
+        self.alice.following.append(self.bob)
+        db.session.commit()
+        self.alice.following.remove(self.bob)
+        db.session.commit()
+
+        edge = {'user_following_id': self.alice.id,
+                'user_being_followed_id': self.bob.id}
+        self.assertEqual(self.published, [
+            [Change('Follows', 'insert', edge, frozenset())],
+            [Change('Follows', 'delete', edge, frozenset())],
+        ])
+
+    def test_bulk_delete(self):
+        msg = make_message(self.bob)
+        router.like(self.alice.id, msg.id)
+        self.published.clear()
+
+        router.unlike(self.alice.id, msg.id)
+
+        self.assertEqual(self.published, [[Change(
+            'Likes', 'delete', {'user_id': self.alice.id, 'message_id': msg.id},
+            frozenset())]])
+
+    def test_only_after_commit(self):
+        make_message(self.alice)
+        db.session.flush()
+        self.assertEqual(self.published, [])
+
+        db.session.rollback()
+        db.session.commit()
+        self.assertEqual(self.published, [])
+
+    def test_feed_cache_follows_changes(self):
+        timelines.set(self.alice.id, [])
+
+        msg = router.add_message(self.alice, "Hello.")
+        db.session.commit()
+        self.assertEqual(timelines.entries[self.alice.id][1],
+                         [(msg.timestamp, msg.id)])
+
+        router.delete_message(msg)
+        self.assertNotIn(self.alice.id, timelines.entries)
+
+
+class ChangeBusTestCase(TestCase):
+    """Test publishing to subscribers and other processes."""
+
+    def test_broken_subscriber(self):
+        bus = ChangeBus()
+        got = []
+
+        def broken(changes):
+            raise ValueError
+
+        bus.subscribe(broken)
+        bus.subscribe(got.append, models={'Message'})
+        change = Change('Message', 'delete', {'id': 1}, frozenset())
+
+        with self.assertLogs('changes', 'ERROR'):
+            bus.publish([change, Change('User', 'delete', {'id': 2},
+                                        frozenset())])
+
+        self.assertEqual(got, [[change]])
+
+    def test_remote_subscriber(self):
+        """Is a remote subscriber given only other workers' changes?"""
+
+        bus = ChangeBus()
+        got = []
+        bus.subscribe(got.append, remote=True)
+        change = Change('Message', 'delete', {'id': 1}, frozenset())
+
+        bus.publish([change])
+        self.assertEqual(got, [])
+
+        bus.publish([change], remote=True)
+        self.assertEqual(got, [[change]])
+
+    def test_broken_channel(self):
+        bus = ChangeBus()
+        bus.channel = SQLiteChannel('/nonexistent/changes.sqlite')
+        got = []
+        bus.subscribe(got.append)
+        change = Change('Message', 'delete', {'id': 1}, frozenset())
+
+        with self.assertLogs('changes', 'ERROR'):
+            bus.publish([change])
+
+        self.assertEqual(got, [[change]])
+
+    def test_channel_pruned_now_and_then(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        now = [1000]
+
+        channel = SQLiteChannel(os.path.join(directory.name, 'changes.sqlite'),
+                                retention=10, prune_interval=60,
+                                clock=lambda: now[0])
+        change = Change('Message', 'delete', {'id': 1}, frozenset())
+
+        def rows():
+            return channel._connection().execute(
+                'SELECT count(*) FROM changes').fetchone()[0]
+
+        channel.send([change])
+        now[0] += 30
+        channel.send([change])
+        self.assertEqual(rows(), 2)
+
+        now[0] += 30
+        channel.send([change])
+        self.assertEqual(rows(), 1)
+
+    def test_channel(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'changes.sqlite')
+
+        channel = SQLiteChannel(path, poll_interval=0)
+        self.assertEqual(channel.receive(), [])
+
+        change = Change('Message', 'insert',
+                        {'id': 1, 'user_id': 2,
+                         'timestamp': datetime(2020, 1, 2, 3, 4, 5)},
+                        frozenset())
+
+        # our own changes aren't handed back to us
+        channel.send([change])
+        self.assertEqual(channel.receive(), [])
+
+        # another worker's are
+        channel._connection().execute(
+            'INSERT INTO changes (pid, at, data) VALUES (?, ?, ?)',
+            (0, channel.clock(), json.dumps([change.to_json()])))
+
+        bus = ChangeBus()
+        got = []
+        bus.subscribe(got.append)
+        channel.poll(bus)
+
+        self.assertEqual(got, [[change]])
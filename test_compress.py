@@ -0,0 +1,77 @@
+"""Streaming and compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compress.py
+
+
+import gzip
+import zlib
+from unittest import TestCase
+
+from compress import accepted_encodings
+from testing import DatabaseTestCase, make_user, make_follow
+
+
+class AcceptEncodingTestCase(TestCase):
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings("gzip, deflate;q=0.5, br;q=0"),
+                         {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings(""), {''})
+
+
+class StreamingTestCase(DatabaseTestCase):
+    """Test streamed pages and compressed responses."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+        for _ in range(30):
+            make_follow(make_user(), self.user)
+
+        self.login(self.user)
+
+    def test_streamed(self):
+        resp = self.client.get(f"/users/{self.user.id}/followers",
+                               buffered=False)
+
+        self.assertTrue(resp.is_streamed)
+        chunks = list(resp.response)
+        self.assertGreater(len(chunks), 1)
+        self.assertIn(b"</html>", b"".join(chunks))
+
+    def test_gzip(self):
+        plain = self.client.get("/users").get_data()
+        resp = self.client.get("/users", headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.get_data()), plain)
+        self.assertLess(len(resp.get_data()), len(plain) / 2)
+
+    def test_chunks_decode_as_they_arrive(self):
+        """Can each compressed chunk be decoded without waiting for the rest?"""
+
+        resp = self.client.get("/users", headers={'Accept-Encoding': 'gzip'},
+                               buffered=False)
+
+        decoder = zlib.decompressobj(31)
+        chunks = list(resp.response)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(decoder.decompress(chunks[0]).startswith(b"<!DOCTYPE"))
+
+    def test_small_responses_uncompressed(self):
+        resp = self.client.get("/api/v1/users/999999",
+                               headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_flash_shown_once(self):
+        """Are messages flashed before a streamed page used up?"""
+
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', "Flashed!")]
+
+        self.assertIn("Flashed!", self.client.get("/users").get_data(as_text=True))
+        self.assertNotIn("Flashed!", self.client.get("/users").get_data(as_text=True))
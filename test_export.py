@@ -0,0 +1,83 @@
+"""Data export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_export.py
+
+
+import csv
+import gzip
+import io
+import json
+
+from export import chunked
+from testing import (DatabaseTestCase, make_user, make_message, make_follow,
+                     make_like)
+
+
+class ExportTestCase(DatabaseTestCase):
+    """Test streaming a user's data out."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+        self.friend = make_user()
+
+        self.message = make_message(self.user, text="Mine")
+        self.liked = make_message(self.friend, text="Theirs")
+        make_like(self.user, self.liked)
+        make_follow(self.user, self.friend)
+        make_follow(self.friend, self.user)
+
+        self.login(self.user)
+
+    def get(self, query=""):
+        resp = self.client.get(f"/users/{self.user.id}/export{query}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        return resp
+
+    def test_ndjson(self):
+        """Is every section exported as a JSON line?"""
+
+        resp = self.get()
+        records = [json.loads(line) for line in resp.data.splitlines()]
+
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertEqual([r['type'] for r in records],
+                         ['message', 'like', 'follower', 'following'])
+        self.assertEqual(records[0]['text'], "Mine")
+        self.assertEqual(records[1]['id'], self.liked.id)
+        self.assertEqual(records[2]['username'], self.friend.username)
+
+    def test_csv(self):
+        resp = self.get("?format=csv")
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+        self.assertEqual(resp.mimetype, 'text/csv')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1]['text'], "Theirs")
+
+    def test_gzip(self):
+        resp = self.get("?gzip=1")
+        lines = gzip.decompress(resp.data).splitlines()
+
+        self.assertEqual(resp.mimetype, 'application/gzip')
+        self.assertIn('.ndjson.gz', resp.headers['Content-Disposition'])
+        self.assertEqual(len(lines), 4)
+
+    def test_other_user(self):
+        """Can someone else export this user's data?"""
+
+        self.login(self.friend)
+        resp = self.client.get(f"/users/{self.user.id}/export")
+
+        self.assertEqual(resp.status_code, 302)
+
+    def test_chunked(self):
+        """Are small lines batched into larger chunks?"""
+
+        chunks = list(chunked([b'ab', b'cd', b'ef', b'g'], size=4))
+
+        self.assertEqual(chunks, [b'abcd', b'efg'])
@@ -0,0 +1,120 @@
+"""Home feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_feed.py
+
+
+from datetime import datetime, timedelta
+
+from feed import TimelineCache, feed_message_ids, home_feed, timelines
+from testing import DatabaseTestCase, make_user, make_message, make_follow
+
+START = datetime(2020, 1, 1)
+
+
+class FeedTestCase(DatabaseTestCase):
+    """Test merging cached author timelines into a feed."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user()
+        self.bob = make_user()
+        self.carol = make_user()
+
+        # interleave the authors' messages in time
+        self.messages = [
+            make_message(author, timestamp=START + timedelta(minutes=i))
+            for i, author in enumerate([self.alice, self.bob, self.carol] * 3)
+        ]
+
+    def expected_ids(self, authors, limit):
+        author_ids = {author.id for author in authors}
+        newest_first = sorted(self.messages, key=lambda msg: msg.timestamp,
+                              reverse=True)
+        return [msg.id for msg in newest_first
+                if msg.user_id in author_ids][:limit]
+
+    def test_matches_sql_order(self):
+        """Does the merged feed match ordering the messages by time?"""
+
+        cache = TimelineCache(per_author=10)
+        ids = feed_message_ids([self.alice.id, self.bob.id], limit=4,
+                               cache=cache)
+
+        self.assertEqual(ids, self.expected_ids([self.alice, self.bob], 4))
+
+    def test_uses_cache(self):
+        """Are authors loaded from SQL only on a cache miss?"""
+
+        cache = TimelineCache(per_author=10)
+        feed_message_ids([self.alice.id, self.bob.id], cache=cache)
+        feed_message_ids([self.alice.id, self.carol.id], cache=cache)
+
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.hits, 1)
+
+    def test_author_without_messages(self):
+        """Is an author with no messages cached as an empty timeline?"""
+
+        quiet = make_user()
+        cache = TimelineCache(per_author=10)
+
+        self.assertEqual(feed_message_ids([quiet.id], cache=cache), [])
+        self.assertEqual(cache.get_many([quiet.id]), ({quiet.id: []}, []))
+
+    def test_per_author_limit(self):
+        """Is each cached timeline bounded?"""
+
+        cache = TimelineCache(per_author=2)
+        ids = feed_message_ids([self.alice.id], cache=cache)
+
+        self.assertEqual(ids, self.expected_ids([self.alice], 2))
+
+    def test_push_and_invalidate(self):
+        """Do new and deleted messages update the cached timeline?"""
+
+        cache = TimelineCache(per_author=10)
+        feed_message_ids([self.alice.id], cache=cache)
+
+        new = make_message(self.alice, timestamp=START + timedelta(hours=1))
+        cache.push(self.alice.id, new.timestamp, new.id)
+        self.assertEqual(feed_message_ids([self.alice.id], 1, cache), [new.id])
+
+        cache.invalidate(self.alice.id)
+        self.assertEqual(cache.get_many([self.alice.id])[1], [self.alice.id])
+
+    def test_ttl(self):
+        """Do entries expire?"""
+
+        now = [0]
+        cache = TimelineCache(ttl=60, clock=lambda: now[0])
+        cache.set(self.alice.id, [])
+
+        now[0] = 61
+        self.assertEqual(cache.get_many([self.alice.id]), ({}, [self.alice.id]))
+
+    def test_home_feed_messages(self):
+        """Does home_feed return loaded messages, newest first?"""
+
+        messages = home_feed([self.carol.id], limit=2)
+
+        self.assertEqual([msg.id for msg in messages],
+                         self.expected_ids([self.carol], 2))
+
+    def test_homepage_sees_new_message(self):
+        """Does a post show up on a follower's already-cached feed?"""
+
+        make_follow(self.alice, self.bob)
+        self.login(self.alice)
+        self.client.get("/")
+
+        self.login(self.bob)
+        self.client.post("/messages/new", data={"text": "Fresh warble"})
+
+        self.login(self.alice)
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertIn("Fresh warble", html)
+        self.assertIn(self.bob.id, timelines.entries)
@@ -0,0 +1,140 @@
+"""Follow and unfollow write tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follows.py
+
+
+from unittest.mock import patch
+
+import follows
+from app import limiter
+from changes import changes
+from follows import follow, unfollow, parse_ids
+from graph import follow_graph
+from models import db, Follows, Notification
+from ratelimit import MemoryBackend
+from testing import DatabaseTestCase, make_user, make_follow
+
+
+class FollowsTestCase(DatabaseTestCase):
+    """Test bulk and single follows and unfollows."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+        self.others = [make_user() for _ in range(4)]
+        make_follow(self.user, self.others[0])
+        db.session.commit()
+
+        self.ids = [other.id for other in self.others]
+
+    def following(self):
+        return {followed_id for (followed_id,) in db.session.query(
+            Follows.user_being_followed_id).filter(
+            Follows.user_following_id == self.user.id)}
+
+    def test_follow(self):
+        followed = follow(self.user.id, self.ids + [self.user.id, 99999],
+                          batch_size=2)
+        db.session.commit()
+
+        self.assertEqual(followed, self.ids[1:])
+        self.assertEqual(self.following(), set(self.ids))
+
+        # again changes nothing
+        self.assertEqual(follow(self.user.id, self.ids), [])
+
+    def test_follow_added_meanwhile(self):
+        """Are follows another request added first left out?"""
+
+        real_insert = follows._insert_new
+
+        def insert_after_another_request(session, follower_id, user_ids):
+            make_follow(self.user, self.others[1])
+            return real_insert(session, follower_id, user_ids)
+
+        with patch.object(follows, '_insert_new',
+                          insert_after_another_request):
+            followed = follow(self.user.id, self.ids[1:3])
+
+        self.assertEqual(followed, [self.ids[2]])
+
+    def test_unfollow(self):
+        follow(self.user.id, self.ids[:2])
+        unfollowed = unfollow(self.user.id, self.ids + [99999])
+        db.session.commit()
+
+        self.assertEqual(sorted(unfollowed), self.ids[:2])
+        self.assertEqual(self.following(), set())
+
+    def test_changes_published(self):
+        graph = follow_graph.get()
+        published = []
+        changes.subscribe(published.append, models={'Follows'})
+        self.addCleanup(changes.subscribers.remove,
+                        (published.append, {'Follows'}))
+
+        follow(self.user.id, self.ids)
+        self.assertFalse(published)
+        db.session.commit()
+
+        self.assertEqual(len(published[0]), 3)
+        self.assertEqual(graph.following_count(self.user.id), 4)
+
+        unfollow(self.user.id, self.ids[:3])
+        db.session.commit()
+        self.assertEqual(graph.following_ids(self.user.id).tolist(),
+                         self.ids[3:])
+
+    def test_bulk_endpoints(self):
+        self.login(self.user)
+
+        resp = self.client.post('/users/follow',
+                                data={'ids': ','.join(map(str, self.ids))})
+        self.assertEqual(resp.get_json(), {'followed': self.ids[1:]})
+        self.assertEqual(Notification.query.filter(
+            Notification.actor_id == self.user.id).count(), 3)
+
+        resp = self.client.post('/users/stop-following',
+                                data={'ids': [str(self.ids[0]),
+                                              str(self.ids[1])]})
+        self.assertEqual(sorted(resp.get_json()['unfollowed']), self.ids[:2])
+        self.assertEqual(self.following(), set(self.ids[2:]))
+
+        resp = self.client.post('/users/follow', data={'ids': 'x'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_follow_limited(self):
+        self.login(self.user)
+        self.app.config['RATELIMIT_ENABLED'] = True
+        backend = patch.object(limiter, 'backend', MemoryBackend())
+        backend.start()
+        self.addCleanup(backend.stop)
+        self.addCleanup(self.app.config.__setitem__, 'RATELIMIT_ENABLED',
+                        False)
+
+        data = {'ids': str(self.ids[1])}
+        statuses = [self.client.post('/users/follow', data=data).status_code
+                    for _ in range(11)]
+        self.assertEqual(statuses, [200] * 10 + [429])
+
+    def test_single_follow(self):
+        self.login(self.user)
+
+        resp = self.client.post(f'/users/follow/{self.ids[1]}')
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn(self.ids[1], self.following())
+
+        resp = self.client.post('/users/follow/99999')
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.post(f'/users/stop-following/{self.ids[1]}')
+        self.assertEqual(resp.status_code, 302)
+        self.assertNotIn(self.ids[1], self.following())
+
+    def test_parse_ids(self):
+        self.assertEqual(parse_ids(['1,2', ' 3\n4 ', '']), [1, 2, 3, 4])
+        with self.assertRaises(ValueError):
+            parse_ids(['1,a'])
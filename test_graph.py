@@ -0,0 +1,200 @@
+"""Social graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from graph import (SocialGraph, follow_graph, journal_seq, prune_journal,
+                   read_journal, REPLAY_OVERLAP)
+from models import db
+from testing import DatabaseTestCase, make_user, make_follow
+
+# 1 -> 2, 1 -> 3, 2 -> 1, 3 -> 4, 4 -> 5, 5 -> 1
+EDGES = [(1, 2), (1, 3), (2, 1), (3, 4), (4, 5), (5, 1)]
+
+
+def make_graph(edges=EDGES, **kwargs):
+    followers, followed = zip(*edges)
+    return SocialGraph.from_edges(followers, followed, **kwargs)
+
+
+class SocialGraphTestCase(TestCase):
+    """Test graph queries and changes."""
+
+    def test_queries(self):
+        graph = make_graph(EDGES + [(1, 2)])
+
+        self.assertTrue(graph.is_following(1, 3))
+        self.assertFalse(graph.is_following(3, 1))
+        self.assertFalse(graph.is_following(99, 1))
+        self.assertEqual(graph.following_count(1), 2)
+        self.assertEqual(graph.followers_count(1), 2)
+        self.assertEqual(graph.followers_count(99), 0)
+        self.assertEqual(graph.edge_count(), 6)
+
+        self.assertEqual(graph.mutuals(1).tolist(), [2])
+        self.assertEqual(graph.common_followers(2, 3).tolist(), [1])
+        self.assertEqual(graph.common_following(2, 5).tolist(), [1])
+
+    def test_neighborhood(self):
+        graph = make_graph()
+
+        self.assertEqual([layer.tolist() for layer in graph.neighborhood(1, 3)],
+                         [[2, 3], [4], [5]])
+        self.assertEqual([layer.tolist() for layer in
+                          graph.neighborhood(1, 2, followers=True)],
+                         [[2, 5], [4]])
+        self.assertEqual([layer.tolist() for layer in
+                          graph.neighborhood(1, 3, limit=2)], [[2, 3]])
+
+    def test_changes(self):
+        graph = make_graph(max_delta=2)
+
+        graph.follow(3, 1)
+        graph.unfollow(1, 2)
+        graph.follow(1, 2)
+        graph.unfollow(1, 3)
+        graph.follow(7, 1)
+
+        self.assertTrue(graph.is_following(3, 1))
+        self.assertTrue(graph.is_following(1, 2))
+        self.assertFalse(graph.is_following(1, 3))
+        self.assertEqual(graph.following_ids(1).tolist(), [2])
+        self.assertEqual(graph.follower_ids(1).tolist(), [2, 3, 5, 7])
+        self.assertEqual(graph.followers_count(1), 4)
+        self.assertEqual(graph.mutuals(1).tolist(), [2])
+        self.assertEqual([layer.tolist() for layer in
+                          graph.neighborhood(3, 2)], [[1, 4], [2, 5]])
+
+        # the last change took it past max_delta, and they were merged in
+        self.assertEqual(graph.following.delta_size(), 0)
+        self.assertEqual(graph.edge_count(), 7)
+
+    def test_save_and_load(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        graph = make_graph()
+        graph.follow(3, 1)
+        graph.save(directory.name, seq=12)
+
+        loaded, meta = SocialGraph.load(directory.name)
+
+        self.assertEqual((meta['seq'], meta['edges']), (12, 7))
+        self.assertIsInstance(loaded.following.base.indices, np.memmap)
+        self.assertEqual(loaded.follower_ids(1).tolist(), [2, 3, 5])
+
+        # memory-mapped arrays are read-only; changes go on top of them
+        loaded.unfollow(1, 2)
+        loaded.compact()
+        self.assertEqual(loaded.following_ids(1).tolist(), [3])
+        self.assertTrue(os.path.exists(
+            os.path.join(directory.name, 'meta.json')))
+
+
+class FollowGraphTestCase(DatabaseTestCase):
+    """Test loading the graph and following committed changes."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user()
+        self.bob = make_user()
+        make_follow(self.alice, self.bob)
+        db.session.commit()
+
+    def test_follows_commits(self):
+        graph = follow_graph.get()
+        self.assertTrue(graph.is_following(self.alice.id, self.bob.id))
+
+        self.bob.following.append(self.alice)
+        db.session.commit()
+        self.assertEqual(graph.mutuals(self.alice.id).tolist(), [self.bob.id])
+
+        self.alice.following.remove(self.bob)
+        db.session.commit()
+        self.assertFalse(graph.is_following(self.alice.id, self.bob.id))
+
+        carol = make_user()
+        make_follow(carol, self.bob)
+        db.session.commit()
+        self.assertEqual(graph.followers_count(self.bob.id), 1)
+
+        db.session.delete(carol)
+        db.session.commit()
+        self.assertEqual(graph.followers_count(self.bob.id), 0)
+
+    def use_snapshot(self):
+        """Journal follows from here on, and save a snapshot to load."""
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, follow_graph, 'path', follow_graph.path)
+        follow_graph.path = directory.name
+
+        follow_graph.get().save(directory.name, seq=journal_seq(db.session))
+        follow_graph.clear()
+
+    def test_journal(self):
+        self.use_snapshot()
+
+        self.bob.following.append(self.alice)
+        db.session.commit()
+        db.session.delete(self.alice)
+        db.session.commit()
+
+        self.assertEqual(
+            [(change.model, change.action) for batch
+             in read_journal(db.session, 0) for change in batch],
+            [('Follows', 'insert'), ('User', 'delete')])
+
+    def test_snapshot_catches_up(self):
+        """Is a snapshot loaded with only the journal after it replayed?"""
+
+        self.use_snapshot()
+
+        # as many follows as the snapshot, but not the same ones
+        self.alice.following.remove(self.bob)
+        make_follow(self.bob, self.alice)
+        db.session.commit()
+
+        with patch.object(SocialGraph, 'from_database') as from_database:
+            graph = follow_graph.get()
+        from_database.assert_not_called()
+
+        self.assertIsInstance(graph.following.base.indices, np.memmap)
+        self.assertTrue(graph.is_following(self.bob.id, self.alice.id))
+        self.assertFalse(graph.is_following(self.alice.id, self.bob.id))
+
+    def test_pruned_journal(self):
+        """Is a snapshot the journal no longer covers rebuilt?"""
+
+        self.use_snapshot()
+        make_follow(self.bob, self.alice)
+        db.session.commit()
+        prune_journal(db.session, journal_seq(db.session) + REPLAY_OVERLAP)
+        make_follow(make_user(), self.alice)
+        db.session.commit()
+
+        with self.assertLogs('graph', 'WARNING'):
+            graph = follow_graph.get()
+        self.assertEqual(graph.followers_count(self.alice.id), 2)
+
+    def test_preload(self):
+        # disposing of the engine would lose the in-memory database
+        with patch.object(type(db.engine), 'dispose') as dispose:
+            follow_graph.preload(self.app)
+        dispose.assert_called_once_with()
+
+        with patch.object(follow_graph, 'load') as load:
+            graph = follow_graph.get()
+        load.assert_not_called()
+        self.assertTrue(graph.is_following(self.alice.id, self.bob.id))
@@ -0,0 +1,124 @@
+"""Message import tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_importer.py
+
+
+import io
+import json
+from datetime import datetime, timedelta
+
+from importer import ImportJob, JOB_TTL, expire_jobs, run_import
+from models import Message, ImportStatus
+from testing import DatabaseTestCase, make_user
+
+
+def ndjson(*rows):
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+class ImporterTestCase(DatabaseTestCase):
+    """Test validating and batch-inserting imported messages."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+
+    def run_import(self, data, format='ndjson', batch_size=1000):
+        job = ImportJob(self.user.id)
+        run_import(job, io.BytesIO(data), format, batch_size=batch_size)
+        return job
+
+    def test_ndjson(self):
+        job = self.run_import(ndjson(
+            {"text": "First", "timestamp": "2019-05-01T10:00:00"},
+            {"text": "Second"},
+        ))
+
+        self.assertEqual((job.status, job.imported, job.skipped),
+                         ('done', 2, 0))
+
+        first = Message.query.filter_by(text="First").one()
+        self.assertEqual(first.user_id, self.user.id)
+        self.assertEqual(first.timestamp, datetime(2019, 5, 1, 10))
+
+    def test_timezones(self):
+        """Are timestamps with an offset stored as naive UTC?"""
+
+        self.run_import(ndjson(
+            {"text": "Offset", "timestamp": "2019-05-01T10:00:00+02:00"}))
+
+        self.assertEqual(Message.query.filter_by(text="Offset").one().timestamp,
+                         datetime(2019, 5, 1, 8))
+
+    def test_status_saved(self):
+        """Can any worker read a job's progress, until it expires?"""
+
+        job = self.run_import(ndjson({"text": "Saved"}))
+
+        saved = ImportJob.load(job.id)
+        self.assertEqual(saved.to_dict(), job.to_dict())
+        self.assertEqual(saved.user_id, self.user.id)
+
+        expire_jobs(datetime.utcnow() + JOB_TTL - timedelta(minutes=1))
+        self.assertIsNotNone(ImportJob.load(job.id))
+
+        expire_jobs(datetime.utcnow() + JOB_TTL + timedelta(minutes=1))
+        self.assertIsNone(ImportStatus.query.get(job.id))
+
+    def test_csv(self):
+        job = self.run_import(
+            b"text,timestamp\n"
+            b"Hello,2017-01-21 11:04:53.522807\n"
+            b"\"Quoted, with comma\",\n",
+            format='csv')
+
+        self.assertEqual(job.imported, 2)
+        self.assertEqual(Message.query.filter_by(
+            text="Quoted, with comma").count(), 1)
+
+    def test_invalid_rows_skipped(self):
+        """Are rows breaking MessageForm's rules skipped and reported?"""
+
+        job = self.run_import(
+            ndjson({"text": "ok"}, {"text": ""}, {"text": "x" * 141},
+                   {"text": "bad date", "timestamp": "yesterday"})
+            + b"not json\n")
+
+        self.assertEqual((job.processed, job.imported, job.skipped),
+                         (5, 1, 4))
+        self.assertTrue(job.errors[0].startswith("line 2:"))
+        self.assertEqual(Message.query.count(), 1)
+
+    def test_batches(self):
+        """Is every row inserted when they span several batches?"""
+
+        job = self.run_import(ndjson(*[{"text": f"m{i}"} for i in range(25)]),
+                              batch_size=10)
+
+        self.assertEqual(job.imported, 25)
+        self.assertEqual(Message.query.filter_by(user_id=self.user.id).count(),
+                         25)
+
+    def test_endpoint(self):
+        """Can a logged-in user upload a file and check on the job?"""
+
+        self.login(self.user)
+        resp = self.client.post(
+            "/messages/import?format=ndjson",
+            data={"file": (io.BytesIO(ndjson({"text": "Uploaded"})),
+                           "history.ndjson")})
+
+        self.assertEqual(resp.status_code, 202)
+        job = resp.get_json()
+
+        status = self.client.get(job['status_url']).get_json()
+        self.assertEqual((status['status'], status['imported']), ('done', 1))
+        self.assertEqual(Message.query.filter_by(text="Uploaded").count(), 1)
+
+    def test_endpoint_logged_out(self):
+        resp = self.client.post("/messages/import", data=ndjson({"text": "x"}))
+
+        self.assertEqual(resp.status_code, 401)
@@ -0,0 +1,144 @@
+"""Live feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import json
+import os
+import queue
+import tempfile
+from unittest import TestCase
+
+from changes import Change, SQLiteChannel, changes
+from live import Hub, MAX_PENDING, hub
+from models import db
+from testing import DatabaseTestCase, make_user, make_follow, make_message
+
+
+class HubTestCase(TestCase):
+    """Test fanning events out to subscribers."""
+
+    def setUp(self):
+        self.hub = Hub()
+
+    def test_publish_to_followers(self):
+        """Do only subscriptions following the author get the event?"""
+
+        follower = self.hub.subscribe([1, 2])
+        other = self.hub.subscribe([3])
+
+        self.hub.publish(1, {'id': 10})
+
+        self.assertEqual(follower.get(timeout=0), {'id': 10})
+        with self.assertRaises(queue.Empty):
+            other.get(timeout=0)
+
+    def test_unsubscribe(self):
+        subscription = self.hub.subscribe([1])
+        self.hub.unsubscribe(subscription)
+
+        self.hub.publish(1, {'id': 10})
+
+        self.assertEqual(self.hub.by_author, {})
+        self.assertEqual(self.hub.subscriber_count(), 0)
+
+    def test_slow_subscriber_dropped(self):
+        """Is a subscriber that falls too far behind closed?"""
+
+        subscription = self.hub.subscribe([1])
+        for i in range(MAX_PENDING + 1):
+            self.hub.publish(1, {'id': i})
+
+        self.assertEqual(self.hub.subscriber_count(), 0)
+
+        events = []
+        while not subscription.events.empty():
+            events.append(subscription.get(timeout=0))
+        self.assertIsNone(events[-1])
+
+
+class FeedStreamTestCase(DatabaseTestCase):
+    """Test the /feed/stream endpoint."""
+
+    def test_logged_out(self):
+        self.assertEqual(self.client.get("/feed/stream").status_code, 401)
+
+    def test_streams_followed_messages(self):
+        """Does a followed user's new message arrive on the stream?"""
+
+        reader, author = make_user(), make_user()
+        make_follow(reader, author)
+
+        self.login(reader)
+        resp = self.client.get("/feed/stream")
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+
+        events = iter(resp.response)
+        self.assertEqual(next(events), b"retry: 5000\n\n")
+
+        self.login(author)
+        self.client.post("/messages/new", data={"text": "Live!"})
+
+        event = next(events).decode()
+        self.assertTrue(event.startswith("event: message\n"))
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual(data['text'], "Live!")
+        self.assertEqual(data['user']['username'], author.username)
+
+        resp.close()
+        self.assertEqual(hub.subscriber_count(), 0)
+
+    def test_other_workers_messages(self):
+        """Does a message posted through another worker arrive, with the
+        stream itself polling the change channel?
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        channel = SQLiteChannel(os.path.join(directory.name, 'changes.sqlite'),
+                                poll_interval=0)
+        channel.receive()
+        changes.channel = channel
+        self.addCleanup(setattr, changes, 'channel', None)
+
+        self.app.config['CHANGES_POLL_SECONDS'] = 0
+        self.addCleanup(self.app.config.__setitem__, 'CHANGES_POLL_SECONDS',
+                        1)
+
+        reader, author = make_user(), make_user()
+        make_follow(reader, author)
+        msg = make_message(author, text="From elsewhere")
+        db.session.commit()
+
+        self.login(reader)
+        resp = self.client.get("/feed/stream")
+        events = iter(resp.response)
+        self.assertEqual(next(events), b"retry: 5000\n\n")
+
+        # as another worker's commit would send it
+        change = Change('Message', 'insert',
+                        {'id': msg.id, 'user_id': author.id}, frozenset())
+        channel._connection().execute(
+            'INSERT INTO changes (pid, at, data) VALUES (?, ?, ?)',
+            (0, channel.clock(), json.dumps([change.to_json()])))
+
+        event = next(events).decode()
+        data = json.loads(event.split("data: ", 1)[1])
+        self.assertEqual((data['id'], data['text']),
+                         (msg.id, "From elsewhere"))
+
+        resp.close()
+
+    def test_off_by_default(self):
+        """With LIVE_FEED off, is there no stream to open?"""
+
+        self.app.config['LIVE_FEED'] = False
+        self.addCleanup(self.app.config.__setitem__, 'LIVE_FEED', True)
+
+        self.login(make_user())
+
+        self.assertEqual(self.client.get("/feed/stream").status_code, 404)
+        self.assertNotIn("EventSource",
+                         self.client.get("/").get_data(as_text=True))
@@ -5,40 +5,19 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
 from sqlalchemy.exc import IntegrityError  
 
 from models import db, Message, User, Likes
+from testing import DatabaseTestCase
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-
-class MessageModelTestCase(TestCase):
+class MessageModelTestCase(DatabaseTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        Likes.query.delete()
-        User.query.delete()
-        Message.query.delete()
+        super().setUp()
 
         # create 2 test users to test creating messages and likes
         u1 = User(
@@ -68,7 +47,6 @@ class MessageModelTestCase(TestCase):
         self.test_user2 = u2
         self.message = m
 
-        self.client = app.test_client()
 
     def test_message_model(self):
         """Does basic model work?"""
@@ -0,0 +1,88 @@
+"""Follow summary tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_mutuals.py
+
+
+from graph import follow_graph
+from models import db, Follows
+from mutuals import SHOWN, FollowSummary, summaries
+from testing import DatabaseTestCase, make_user, make_follow
+
+
+class FollowSummaryTestCase(DatabaseTestCase):
+    """Test profile follow summaries and their cache."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.viewer = make_user()
+        self.profile = make_user()
+        self.friends = [make_user() for _ in range(SHOWN + 2)]
+
+        for friend in self.friends:
+            make_follow(self.viewer, friend)
+            make_follow(friend, self.profile)
+        make_follow(self.profile, self.viewer)
+        db.session.commit()
+
+    def test_summary(self):
+        summary = summaries.get(self.viewer.id, self.profile.id)
+
+        self.assertEqual(summary, FollowSummary(
+            follows_you=True,
+            you_follow=False,
+            followed_by=[(friend.id, friend.username)
+                         for friend in self.friends[:SHOWN]],
+            others=2))
+
+    def test_cache_follows_changes(self):
+        cached = summaries.get(self.viewer.id, self.profile.id)
+        self.assertIs(summaries.get(self.viewer.id, self.profile.id)
+                      .followed_by, cached.followed_by)
+
+        self.viewer.following.append(self.profile)
+        self.profile.following.remove(self.viewer)
+        db.session.commit()
+
+        summary = summaries.get(self.viewer.id, self.profile.id)
+        self.assertTrue(summary.you_follow)
+        self.assertFalse(summary.follows_you)
+
+        self.friends[0].following.remove(self.profile)
+        db.session.commit()
+
+        self.assertEqual(summaries.get(self.viewer.id, self.profile.id).others,
+                         1)
+
+    def test_follow_on_another_worker(self):
+        """Is the follow button right when the graph hasn't heard yet?"""
+
+        summaries.get(self.viewer.id, self.profile.id)
+
+        # around the change bus, as another worker's commit would be
+        db.session.execute(Follows.__table__.insert().values(
+            user_following_id=self.viewer.id,
+            user_being_followed_id=self.profile.id))
+
+        self.assertFalse(follow_graph.get().is_following(self.viewer.id,
+                                                         self.profile.id))
+        self.assertTrue(summaries.get(self.viewer.id,
+                                      self.profile.id).you_follow)
+
+    def test_profile_page(self):
+        self.login(self.viewer)
+
+        resp = self.client.get(f"/users/{self.profile.id}")
+        html = resp.get_data(as_text=True)
+
+        self.assertIn('Follows you', html)
+        self.assertIn(f'@{self.friends[0].username}</a>,', html)
+        self.assertIn('and 2 others you follow', html)
+
+        # nothing about yourself on your own profile
+        html = self.client.get(f"/users/{self.viewer.id}").get_data(
+            as_text=True)
+        self.assertNotIn('Follows you', html)
+        self.assertNotIn('Followed by', html)
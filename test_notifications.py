@@ -0,0 +1,120 @@
+"""Notification inbox tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_notifications.py
+
+
+from models import Notification, Inbox
+from notifications import (MENTION, FOLLOW, LIKE, MAX_UNREAD, deliver,
+                           follow_event, inbox_page, mark_read, unread_counts)
+from testing import DatabaseTestCase, make_user, make_message
+
+
+class NotificationsTestCase(DatabaseTestCase):
+    """Test producing, counting and reading notifications."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user(username="alice")
+        self.bob = make_user(username="bob")
+
+    def kinds(self, user):
+        return [(n.kind, n.actor_id) for n in
+                Notification.query.filter_by(user_id=user.id)
+                .order_by(Notification.id)]
+
+    def test_mentions(self):
+        """Does a warble notify each mentioned user, but not its author?"""
+
+        carol = make_user(username="carol")
+
+        self.login(self.alice)
+        self.client.post("/messages/new",
+                         data={"text": "@bob @carol @alice @nobody hi"})
+
+        self.assertEqual(self.kinds(self.bob), [(MENTION, self.alice.id)])
+        self.assertEqual(self.kinds(carol), [(MENTION, self.alice.id)])
+        self.assertEqual(self.kinds(self.alice), [])
+
+    def test_follow_and_like(self):
+        msg = make_message(self.bob)
+
+        self.login(self.alice)
+        self.client.post(f"/users/follow/{self.bob.id}")
+        self.client.post(f"/users/add_like/{msg.id}")
+        # unliking doesn't notify, and liking again doesn't either
+        self.client.post(f"/users/add_like/{msg.id}")
+        self.client.post(f"/users/add_like/{msg.id}")
+
+        self.assertEqual(self.kinds(self.bob),
+                         [(FOLLOW, self.alice.id), (LIKE, self.alice.id)])
+
+    def test_unread_count(self):
+        deliver([follow_event(self.alice.id, self.bob.id)] * 3)
+        self.assertEqual(unread_counts.get(self.bob.id), 3)
+
+        # delivering invalidates the cached count
+        deliver([follow_event(self.alice.id, self.bob.id)])
+        self.assertEqual(unread_counts.get(self.bob.id), 4)
+
+        newest = Notification.query.order_by(Notification.id.desc()).first()
+        mark_read(self.bob.id, newest.id)
+        self.assertEqual(unread_counts.get(self.bob.id), 0)
+
+    def test_mark_read_never_goes_back(self):
+        deliver([follow_event(self.alice.id, self.bob.id)] * 2)
+        first, second = Notification.query.order_by(Notification.id)
+
+        mark_read(self.bob.id, second.id)
+        mark_read(self.bob.id, first.id)
+
+        self.assertEqual(Inbox.query.get(self.bob.id).last_read_id, second.id)
+        self.assertEqual(Inbox.query.count(), 1)
+
+    def test_unread_count_capped(self):
+        deliver([follow_event(self.alice.id, self.bob.id)] * (MAX_UNREAD + 10))
+
+        self.assertEqual(unread_counts.get(self.bob.id), MAX_UNREAD + 1)
+
+        self.login(self.bob)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn(f"{MAX_UNREAD}+", html)
+
+    def test_pages(self):
+        deliver([follow_event(self.alice.id, self.bob.id)] * 5)
+
+        items, next_before = inbox_page(self.bob.id, limit=3)
+        self.assertEqual(len(items), 3)
+
+        older, last = inbox_page(self.bob.id, before=next_before, limit=3)
+        self.assertEqual(len(older), 2)
+        self.assertIsNone(last)
+        self.assertLess(older[0][0].id, items[-1][0].id)
+
+    def test_deleted_message_skipped(self):
+        msg = make_message(self.bob)
+
+        self.login(self.alice)
+        self.client.post(f"/users/add_like/{msg.id}")
+        self.client.post(f"/users/follow/{self.bob.id}")
+
+        self.login(self.bob)
+        self.client.post(f"/messages/{msg.id}/delete")
+
+        items, _ = inbox_page(self.bob.id)
+        self.assertEqual([n.kind for n, _, _ in items], [FOLLOW])
+
+    def test_view_marks_read(self):
+        self.login(self.alice)
+        self.client.post(f"/users/follow/{self.bob.id}")
+
+        self.login(self.bob)
+        resp = self.client.get("/notifications")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@alice", html)
+        self.assertIn("followed you", html)
+        self.assertEqual(unread_counts.get(self.bob.id), 0)
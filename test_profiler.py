@@ -0,0 +1,107 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiler.py
+
+
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from unittest import TestCase
+
+from flask import Flask, render_template_string
+
+import profiler
+from profiler import collapsed, speedscope
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class FormatsTestCase(TestCase):
+    """Test writing samples out."""
+
+    stacks = Counter({('main', 'view', 'render'): 3, ('main', 'view'): 1})
+
+    def test_collapsed(self):
+        self.assertEqual(collapsed(self.stacks),
+                         "main;view;render 3\nmain;view 1\n")
+
+    def test_speedscope(self):
+        profile = json.loads(speedscope(self.stacks, 0.005, "GET /"))
+
+        self.assertEqual([frame['name'] for frame in profile['shared']['frames']],
+                         ['main', 'view', 'render'])
+        self.assertEqual(profile['profiles'][0]['samples'], [[0, 1, 2], [0, 1]])
+        self.assertEqual(profile['profiles'][0]['weights'], [15, 5])
+
+
+class RequestProfilerTestCase(TestCase):
+    """Test choosing and profiling requests in a small app."""
+
+    def make_app(self, **config):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        app = Flask(__name__)
+        app.config.update(PROFILE_DIR=self.directory, PROFILE_INTERVAL_MS=1,
+                          **config)
+        profiler.init_app(app)
+
+        @app.route('/')
+        def index():
+            busy(0.05)
+            return render_template_string("{% for i in range(3) %}{{ i }}{% endfor %}")
+
+        return app.test_client()
+
+    def profiles(self):
+        return os.listdir(self.directory) if os.path.exists(self.directory) else []
+
+    def test_off(self):
+        client = self.make_app()
+
+        resp = client.get('/', headers={'X-Profile': ''})
+
+        self.assertNotIn('X-Profile', resp.headers)
+        self.assertEqual(self.profiles(), [])
+
+    def test_token(self):
+        client = self.make_app(PROFILE_TOKEN='sesame')
+
+        self.assertNotIn('X-Profile', client.get('/?_profile=wrong').headers)
+
+        resp = client.get('/', headers={'X-Profile': 'sesame'})
+        name = resp.headers['X-Profile']
+
+        self.assertEqual(self.profiles(), [name])
+        with open(os.path.join(self.directory, name)) as file:
+            lines = file.read().splitlines()
+
+        # most samples land in the busy loop, under the view
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn('index (test_profiler.py', stack)
+        self.assertTrue(stack.endswith(f'busy (test_profiler.py:{busy.__code__.co_firstlineno})'))
+        self.assertGreater(int(count), 3)
+
+    def test_speedscope_format(self):
+        client = self.make_app(PROFILE_TOKEN='sesame')
+
+        resp = client.get('/?_profile=sesame&_profile_format=speedscope')
+
+        with open(os.path.join(self.directory, resp.headers['X-Profile'])) as file:
+            self.assertEqual(json.load(file)['profiles'][0]['type'], 'sampled')
+
+    def test_sample_rate(self):
+        client = self.make_app(PROFILE_SAMPLE_RATE=1)
+
+        client.get('/')
+
+        self.assertEqual(len(self.profiles()), 1)
@@ -0,0 +1,100 @@
+"""Baked query and statement timing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_queries.py
+
+
+from app import find_user
+from models import db, User
+from queries import (REGISTRY, StatementTimer, timer, user_by_id,
+                     user_by_username, user_messages, following_ids)
+from testing import DatabaseTestCase, make_user, make_message, make_follow
+
+
+class BakedQueryTestCase(DatabaseTestCase):
+    """Test the baked queries give what the ORM queries they replace did."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = make_user()
+        self.bob = make_user()
+        make_follow(self.alice, self.bob)
+        self.messages = [make_message(self.alice) for _ in range(3)]
+        db.session.commit()
+
+    def test_queries(self):
+        self.assertIs(user_by_id(db.session).get(self.alice.id), self.alice)
+        self.assertIsNone(user_by_id(db.session).get(99999))
+
+        self.assertEqual(user_by_username(db.session)
+                         .params(username=self.bob.username).first(),
+                         self.bob)
+
+        self.assertEqual(following_ids(db.session)
+                         .params(user_id=self.alice.id).all(),
+                         [(self.bob.id,)])
+
+        newest = sorted(self.messages, key=lambda msg: msg.timestamp,
+                        reverse=True)
+        self.assertEqual(user_messages(db.session)
+                         .params(user_id=self.alice.id, limit=2).all(),
+                         newest[:2])
+
+    def test_registry(self):
+        self.assertEqual(REGISTRY['user_by_id'], user_by_id)
+
+    def test_authenticate(self):
+        self.assertEqual(User.authenticate(self.alice.username, 'password',
+                                           find=find_user),
+                         self.alice)
+        self.assertFalse(User.authenticate('nobody', 'password',
+                                           find=find_user))
+
+
+class StatementTimerTestCase(DatabaseTestCase):
+    """Test splitting statement time into compiling and executing."""
+
+    def test_timing(self):
+        ticks = iter(range(100))
+        timing = StatementTimer(clock=lambda: next(ticks))
+        timing.listen()
+        self.addCleanup(timing.remove)
+
+        self.connection.execute(User.__table__.select())
+        timing.remove()
+
+        # clock readings 0 (execute()), 1 (the cursor) and 2 (its result)
+        self.assertEqual(dict(timing.totals), {'-': [1, 1, 1]})
+        self.assertIn('warbler_sql_compile_seconds_total{endpoint="-"} '
+                      '1.000000', timing.metrics())
+
+    def test_metrics_endpoint(self):
+        timer.listen()
+        self.addCleanup(timer.clear)
+        self.addCleanup(timer.remove)
+
+        user = make_user()
+        db.session.commit()
+
+        self.client.get(f'/users/{user.id}')
+        resp = self.client.get('/metrics/queries')
+
+        self.assertIn('warbler_sql_statements_total'
+                      '{endpoint="warbler.users_show"}',
+                      resp.get_data(as_text=True))
+
+    def test_metrics_not_public(self):
+        remote = {'REMOTE_ADDR': '203.0.113.9'}
+
+        for path in ('/metrics/queries', '/metrics/ratelimit'):
+            resp = self.client.get(path, environ_base=remote)
+            self.assertEqual(resp.status_code, 403)
+
+        self.app.config['METRICS_TOKEN'] = 'sesame'
+        self.addCleanup(self.app.config.__setitem__, 'METRICS_TOKEN', '')
+
+        resp = self.client.get('/metrics/queries', environ_base=remote,
+                               headers={'Authorization': 'Bearer sesame'})
+        self.assertEqual(resp.status_code, 200)
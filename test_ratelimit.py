@@ -0,0 +1,150 @@
+"""Rate limiter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from ratelimit import (RateLimiter, MemoryBackend, SQLiteBackend,
+                       SWEEP_INTERVAL, client_ip, form_username)
+
+
+class Clock:
+    """A clock tests can move by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class BackendTestCase(TestCase):
+    """Test token buckets in each backend."""
+
+    def check_bucket(self, backend):
+        for _ in range(3):
+            self.assertEqual(backend.consume('k', 3, 1, now=0), 0)
+
+        # empty: wait one second for the next token
+        self.assertEqual(backend.consume('k', 3, 1, now=0), 1)
+
+        # other keys have their own bucket
+        self.assertEqual(backend.consume('other', 3, 1, now=0), 0)
+
+        # refilled after a second
+        self.assertEqual(backend.consume('k', 3, 1, now=1), 0)
+
+    def check_sweep(self, backend, count):
+        backend.consume('idle', 3, 1, now=0)
+        backend.consume('busy', 3, 1, now=SWEEP_INTERVAL - 1)
+        backend.consume('busy', 3, 1, now=SWEEP_INTERVAL)
+
+        self.assertEqual(count(), 1)
+
+    def test_memory_backend(self):
+        self.check_bucket(MemoryBackend())
+
+    def test_idle_buckets_dropped(self):
+        backend = MemoryBackend()
+        self.check_sweep(backend, lambda: len(backend.buckets))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteBackend(os.path.join(tmp, 'rl.sqlite'))
+            self.check_sweep(backend, lambda: backend._connection().execute(
+                'SELECT count(*) FROM buckets').fetchone()[0])
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.check_bucket(SQLiteBackend(os.path.join(tmp, 'rl.sqlite')))
+
+    def test_sqlite_backend_is_shared(self):
+        """Do two backends on the same file share buckets?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rl.sqlite')
+            first, second = SQLiteBackend(path), SQLiteBackend(path)
+
+            self.assertEqual(first.consume('k', 1, 1, now=0), 0)
+            self.assertEqual(second.consume('k', 1, 1, now=0), 1)
+
+
+class RateLimiterTestCase(TestCase):
+    """Test rejecting requests in a Flask app."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(backend=MemoryBackend(), clock=self.clock)
+        self.calls = 0
+
+        app = Flask(__name__)
+        self.limiter.init_app(app)
+
+        @app.route('/login', methods=['GET', 'POST'])
+        @self.limiter.limit('ip', client_ip, rate=3, per=60)
+        @self.limiter.limit('username', form_username, rate=2, per=60)
+        def login():
+            self.calls += 1
+            return 'ok'
+
+        self.app = app
+        self.client = app.test_client()
+
+    def test_rejects_over_limit(self):
+        """Is a username rejected once its bucket is empty?"""
+
+        for _ in range(2):
+            resp = self.client.post('/login', data={'username': 'alice'})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post('/login', data={'username': 'alice'})
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+        # the view never ran for the rejected request
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(
+            self.limiter.rejections[('login', 'username')], 1)
+        self.assertIn('endpoint="login",limit="username"} 1',
+                      self.limiter.metrics())
+
+    def test_ip_limit_spans_usernames(self):
+        """Is the IP limit applied across different usernames?"""
+
+        for username in ['a', 'b', 'c']:
+            resp = self.client.post('/login', data={'username': username})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post('/login', data={'username': 'd'})
+        self.assertEqual(resp.status_code, 429)
+
+    def test_get_not_limited(self):
+        """Are form GETs, which don't hash anything, left alone?"""
+
+        for _ in range(10):
+            self.assertEqual(self.client.get('/login').status_code, 200)
+
+    def test_refill(self):
+        """Are requests allowed again once tokens refill?"""
+
+        for _ in range(3):
+            self.client.post('/login', data={'username': 'alice'})
+
+        self.clock.now = 60
+        resp = self.client.post('/login', data={'username': 'alice'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_disabled(self):
+        """Can limits be turned off through config?"""
+
+        self.app.config['RATELIMIT_ENABLED'] = False
+
+        for _ in range(10):
+            resp = self.client.post('/login', data={'username': 'alice'})
+            self.assertEqual(resp.status_code, 200)
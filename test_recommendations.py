@@ -0,0 +1,122 @@
+"""Recommendation batch job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from unittest import TestCase
+from unittest.mock import patch
+
+from recommendations import (build_adjacency, chunk_bounds,
+                             compute_recommendations)
+
+
+def die(args):
+    """A chunk that takes its worker down, as the OOM killer would."""
+
+    os._exit(1)
+
+
+class RecommendationsTestCase(TestCase):
+    """Test friends-of-friends scoring."""
+
+    def setUp(self):
+        """Build a small follow graph.
+
+        1 follows 2 and 3; 2 and 3 both follow 4; 3 follows 5 and 1.
+        """
+
+        follows = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (3, 1)]
+        self.followers = [f for f, _ in follows]
+        self.followed = [t for _, t in follows]
+
+    def recommendations_for(self, results, user_id):
+        users, recommended, scores = results
+        return [(int(r), int(s))
+                for u, r, s in zip(users, recommended, scores)
+                if u == user_id]
+
+    def test_scores_friends_of_friends(self):
+        """Are candidates ranked by how many followed accounts follow them?"""
+
+        results = compute_recommendations(self.followers, self.followed,
+                                          workers=1)
+
+        self.assertEqual(self.recommendations_for(results, 1),
+                         [(4, 2), (5, 1)])
+
+    def test_excludes_self_and_followed(self):
+        """Are the user and accounts they already follow left out?"""
+
+        results = compute_recommendations(self.followers, self.followed,
+                                          workers=1)
+
+        # 3 -> 1 -> {2, 3}: 3 is themself, so only 2 is a candidate
+        self.assertEqual(self.recommendations_for(results, 3), [(2, 1)])
+
+    def test_top_k(self):
+        """Are only the best top_k candidates kept?"""
+
+        results = compute_recommendations(self.followers, self.followed,
+                                          top_k=1, workers=1)
+
+        self.assertEqual(self.recommendations_for(results, 1), [(4, 2)])
+
+    def test_chunks_in_parallel(self):
+        """Do chunked, multi-process runs match a single chunk?"""
+
+        single = compute_recommendations(self.followers, self.followed,
+                                         workers=1)
+        chunked = compute_recommendations(self.followers, self.followed,
+                                          workers=2, chunk_size=2)
+
+        for expected, actual in zip(single, chunked):
+            self.assertEqual(list(expected), list(actual))
+
+    def test_spawned_workers(self):
+        """Do workers started with spawn (not fork) get the matrix too?"""
+
+        single = compute_recommendations(self.followers, self.followed,
+                                         workers=1)
+        spawn = partial(ProcessPoolExecutor,
+                        mp_context=multiprocessing.get_context('spawn'))
+        with patch('recommendations.ProcessPoolExecutor', spawn):
+            spawned = compute_recommendations(self.followers, self.followed,
+                                              workers=2, chunk_size=2)
+
+        for expected, actual in zip(single, spawned):
+            self.assertEqual(list(expected), list(actual))
+
+    def test_chunks_by_paths(self):
+        """Are chunks cut by two-hop paths as well as by rows?"""
+
+        adjacency, ids = build_adjacency(self.followers, self.followed)
+
+        # two-hop paths from users 1-5: 4, 0, 2, 0 and 0
+        self.assertEqual(chunk_bounds(adjacency, 10, 4),
+                         [(0, 2), (2, 5)])
+        self.assertEqual(chunk_bounds(adjacency, 2, 100),
+                         [(0, 2), (2, 4), (4, 5)])
+
+        # a row with more paths than allowed still gets a chunk of its own
+        self.assertEqual(chunk_bounds(adjacency, 10, 1)[0], (0, 1))
+
+    def test_dead_worker(self):
+        """Does the job fail, rather than hang, when a worker dies?"""
+
+        with patch('recommendations._score_chunk', die), \
+                self.assertRaises(RuntimeError):
+            compute_recommendations(self.followers, self.followed,
+                                    workers=2, chunk_size=2)
+
+    def test_empty_graph(self):
+        """Does an empty follows table produce no recommendations?"""
+
+        users, recommended, scores = compute_recommendations([], [])
+
+        self.assertEqual(len(users), 0)
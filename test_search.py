@@ -0,0 +1,85 @@
+"""Message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from datetime import datetime, timedelta
+
+from search import search, fts5_query
+from testing import DatabaseTestCase, make_user, make_message
+
+NOW = datetime(2020, 6, 1)
+
+
+class SearchTestCase(DatabaseTestCase):
+    """Test full-text search over messages."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user()
+
+    def post(self, text, days_ago=0):
+        return make_message(self.user, text=text,
+                            timestamp=NOW - timedelta(days=days_ago))
+
+    def texts(self, query, **kwargs):
+        results, _ = search(query, now=NOW, **kwargs)
+        return [msg.text for msg, _ in results]
+
+    def test_matches_stems(self):
+        self.post("Running in the park")
+        self.post("Nothing to see")
+
+        self.assertEqual(self.texts("runs"), ["Running in the park"])
+        self.assertEqual(self.texts("park running"), ["Running in the park"])
+        self.assertEqual(self.texts("swimming"), [])
+
+    def test_rank_by_relevance_and_recency(self):
+        """Do better and newer matches come first?"""
+
+        self.post("cats", days_ago=365)
+        self.post("cats and dogs and birds and fish", days_ago=1)
+        self.post("cats", days_ago=1)
+
+        self.assertEqual(self.texts("cats"),
+                         ["cats", "cats and dogs and birds and fish", "cats"])
+
+    def test_follows_deletes(self):
+        """Does the index follow deleted messages?"""
+
+        msg = self.post("ephemeral")
+        self.login(self.user)
+        self.client.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(self.texts("ephemeral"), [])
+
+    def test_pages(self):
+        for i in range(5):
+            self.post(f"paging {i}", days_ago=i)
+
+        results, has_next = search("paging", page=1, per_page=2, now=NOW)
+
+        self.assertEqual([msg.text for msg, _ in results],
+                         ["paging 2", "paging 3"])
+        self.assertTrue(has_next)
+
+    def test_endpoint_highlights(self):
+        """Are matches highlighted and the rest of the text escaped?"""
+
+        self.post("<b>tea</b> time")
+
+        resp = self.client.get("/search?q=tea")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("&lt;b&gt;<mark>tea</mark>&lt;/b&gt; time", html)
+
+    def test_query_syntax_ignored(self):
+        """Is FTS5 query syntax in the search treated as plain words?"""
+
+        self.assertEqual(fts5_query('"a" OR b*'), '"a" "OR" "b"')
+        self.assertEqual(fts5_query('***'), None)
+        self.assertEqual(self.client.get("/search?q=***").status_code, 200)
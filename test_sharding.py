@@ -0,0 +1,261 @@
+"""Sharding tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sharding.py
+
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from app import create_app, CURR_USER_KEY
+from config import TestConfig
+from feed import timelines
+from models import db, Message
+from sharding import (router, init_shards, move_buckets, assign_buckets,
+                      shard_messages, shard_likes, shard_terms,
+                      load_shard_map)
+from testing import make_user, make_follow
+
+
+class AssignBucketsTestCase(TestCase):
+    """Test editing the shard map."""
+
+    def test_split_range(self):
+        ranges = [(0, 511, 'shard0'), (512, 1023, 'shard1')]
+
+        self.assertEqual(assign_buckets(ranges, 100, 199, 'shard1'),
+                         [(0, 99, 'shard0'), (100, 199, 'shard1'),
+                          (200, 511, 'shard0'), (512, 1023, 'shard1')])
+
+    def test_merge_neighbours(self):
+        ranges = [(0, 511, 'shard0'), (512, 1023, 'shard1')]
+
+        self.assertEqual(assign_buckets(ranges, 256, 511, 'shard1'),
+                         [(0, 255, 'shard0'), (256, 1023, 'shard1')])
+
+
+class ShardingTestCase(TestCase):
+    """Test the app with messages and likes on two SQLite shards."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        def url(name):
+            return f"sqlite:///{os.path.join(self.dir, name)}.sqlite"
+
+        class ShardedConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = url('main')
+            SQLALCHEMY_BINDS = {'shard0': url('shard0'),
+                                'shard1': url('shard1')}
+            SHARDS = ['shard0', 'shard1']
+
+        # creating an app makes it Flask-SQLAlchemy's default; put the
+        # shared test app back afterwards
+        original_app = db.app
+        self.addCleanup(setattr, db, 'app', original_app)
+
+        self.app = create_app(ShardedConfig)
+        self.client = self.app.test_client()
+
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(self.close, context)
+
+        db.create_all()
+        init_shards()
+        timelines.clear()
+
+        # with two shards, buckets 0-511 are on shard0 and 512-1023 on shard1
+        self.alice = make_user(id=1, username="alice")
+        self.bob = make_user(id=600, username="bob")
+        self.carol = make_user(id=2, username="carol")
+        make_follow(self.carol, self.alice)
+        make_follow(self.carol, self.bob)
+        db.session.commit()
+
+    def close(self, context):
+        db.session.remove()
+        context.pop()
+        for engine in self.app.extensions['sqlalchemy'].connectors.values():
+            engine.get_engine().dispose()
+        timelines.clear()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+    def post(self, user, text):
+        self.login(user)
+        self.client.post("/messages/new", data={"text": text})
+
+    def rows(self, shard, table):
+        engine = db.get_engine(bind=shard)
+        return engine.execute(select([table])).fetchall()
+
+    def test_messages_on_authors_shard(self):
+        self.post(self.alice, "From alice")
+        self.post(self.bob, "From bob")
+
+        self.assertEqual([row.text for row in self.rows('shard0', shard_messages)],
+                         ["From alice"])
+        self.assertEqual([row.text for row in self.rows('shard1', shard_messages)],
+                         ["From bob"])
+        self.assertEqual(db.session.query(Message).count(), 0)
+
+    def test_home_feed_across_shards(self):
+        """Does the home feed merge followed authors from both shards?"""
+
+        self.post(self.alice, "Alice first")
+        self.post(self.bob, "Bob second")
+        self.post(self.alice, "Alice third")
+
+        self.login(self.carol)
+        html = self.client.get("/").get_data(as_text=True)
+
+        positions = [html.index(text)
+                     for text in ("Alice third", "Bob second", "Alice first")]
+        self.assertEqual(positions, sorted(positions))
+        self.assertIn("@bob", html)
+
+    def test_likes(self):
+        """Are likes stored with the liker and shown with their messages?"""
+
+        self.post(self.bob, "Likeable")
+        message_id = self.rows('shard1', shard_messages)[0].id
+
+        self.login(self.alice)
+        self.client.post(f"/users/add_like/{message_id}")
+
+        self.assertEqual([row.message_id for row in self.rows('shard0', shard_likes)],
+                         [message_id])
+
+        html = self.client.get(f"/users/{self.alice.id}/likes").get_data(
+            as_text=True)
+        self.assertIn("Likeable", html)
+        self.assertIn("@bob", html)
+
+        self.client.post(f"/users/add_like/{message_id}")
+        self.assertEqual(self.rows('shard0', shard_likes), [])
+
+    def test_api(self):
+        """Does the JSON API read messages from their authors' shards?"""
+
+        self.post(self.alice, "API alice")
+        self.post(self.bob, "API bob")
+        alice_id = self.rows('shard0', shard_messages)[0].id
+        bob_id = self.rows('shard1', shard_messages)[0].id
+
+        data = self.client.get(
+            f"/api/v1/messages?ids={alice_id},{bob_id}").get_json()
+        self.assertEqual([(msg['text'], msg['user']['username'])
+                          for msg in data['messages']],
+                         [("API alice", "alice"), ("API bob", "bob")])
+
+        data = self.client.get(f"/api/v1/users/{self.bob.id}/timeline").get_json()
+        self.assertEqual([msg['text'] for msg in data['messages']], ["API bob"])
+
+        data = self.client.get("/api/v1/users?ids=1,600,2").get_json()
+        self.assertEqual([user['messages'] for user in data['users']],
+                         [1, 1, 0])
+
+    def test_export(self):
+        """Does the export read messages and likes from their shards?"""
+
+        self.post(self.bob, "Exported")
+        message_id = self.rows('shard1', shard_messages)[0].id
+
+        self.login(self.alice)
+        self.client.post(f"/users/add_like/{message_id}")
+        self.post(self.alice, "Mine")
+
+        text = self.client.get(f"/users/{self.alice.id}/export").get_data(
+            as_text=True)
+        records = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([(record['type'], record.get('text'))
+                          for record in records
+                          if record['type'] in ('message', 'like')],
+                         [('message', "Mine"), ('like', "Exported")])
+
+    def test_tags(self):
+        """Are index entries on their message's shard, and merged?"""
+
+        self.post(self.alice, "#shared by alice")
+        self.post(self.bob, "#shared by bob")
+
+        self.assertEqual([row.term for row in self.rows('shard0', shard_terms)],
+                         ['#shared'])
+        self.assertEqual([row.user_id
+                          for row in self.rows('shard1', shard_terms)],
+                         [self.bob.id])
+
+        html = self.client.get("/tags/shared").get_data(as_text=True)
+        self.assertLess(html.index("by bob"), html.index("by alice"))
+
+        self.login(self.alice)
+        message_id = self.rows('shard0', shard_messages)[0].id
+        self.client.post(f"/messages/{message_id}/delete")
+        self.assertEqual(self.rows('shard0', shard_terms), [])
+
+    def test_delete_message(self):
+        """Are a message's likes on other shards deleted with it?"""
+
+        self.post(self.bob, "Short-lived")
+        message_id = self.rows('shard1', shard_messages)[0].id
+
+        self.login(self.alice)
+        self.client.post(f"/users/add_like/{message_id}")
+
+        self.login(self.bob)
+        self.client.post(f"/messages/{message_id}/delete")
+
+        self.assertEqual(self.rows('shard1', shard_messages), [])
+        self.assertEqual(self.rows('shard0', shard_likes), [])
+
+    def test_move_buckets(self):
+        """Do a user's rows follow their bucket to its new shard?"""
+
+        self.post(self.alice, "Moving #house")
+        self.post(self.bob, "Staying put")
+        message_id = self.rows('shard0', shard_messages)[0].id
+
+        self.login(self.carol)
+        self.client.post(f"/users/add_like/{message_id}")
+
+        copied = move_buckets(0, 1, 'shard1', wait=0)
+
+        # the message and its index entry
+        self.assertEqual(copied, 2)
+        self.assertEqual(self.rows('shard0', shard_terms), [])
+        self.assertEqual([row.message_id
+                          for row in self.rows('shard1', shard_terms)],
+                         [message_id])
+        self.assertEqual(load_shard_map(['shard0', 'shard1']),
+                         [(0, 1, 'shard1'), (2, 511, 'shard0'),
+                          (512, 1023, 'shard1')])
+        self.assertEqual(self.rows('shard0', shard_messages), [])
+        self.assertEqual(
+            sorted(row.id for row in self.rows('shard1', shard_messages))[0],
+            message_id)
+
+        # carol (bucket 2) stayed, and her like still points at the message
+        self.assertEqual([row.message_id for row in self.rows('shard0', shard_likes)],
+                         [message_id])
+
+        resp = self.client.get(f"/messages/{message_id}")
+        self.assertIn("Moving", resp.get_data(as_text=True))
+
+    def test_unique_ids(self):
+        """Do messages on different shards get different ids?"""
+
+        with self.app.test_request_context():
+            first = router.add_message(self.alice, "One")
+            second = router.add_message(self.bob, "Two")
+
+        self.assertNotEqual(first.id, second.id)
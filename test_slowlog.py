@@ -0,0 +1,126 @@
+"""Slow query log tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_slowlog.py
+
+
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+import slowlog
+from slowlog import normalize, read_entries, redact, summarize
+from testing import DatabaseTestCase, make_user, make_message
+
+
+class HelpersTestCase(TestCase):
+    """Test redacting parameters and grouping statements."""
+
+    def test_redact(self):
+        self.assertEqual(redact(('alice@example.com', 3, None, b'hash')),
+                         ['<str>', 3, None, '<bytes>'])
+        self.assertEqual(redact({'email': 'a@b.c', 'id': 1}),
+                         {'email': '<str>', 'id': 1})
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("SELECT *\n  FROM messages WHERE id IN (?, ?, ?)"),
+            "SELECT * FROM messages WHERE id IN (...)")
+
+    def test_summarize(self):
+        entries = [
+            {'statement': "SELECT 1 WHERE x IN (?, ?)", 'ms': 10,
+             'endpoint': 'warbler.homepage'},
+            {'statement': "SELECT 1 WHERE x IN (?, ?, ?)", 'ms': 30,
+             'endpoint': 'warbler.homepage', 'template': 'home.html:3'},
+            {'statement': "SELECT 2", 'ms': 5},
+        ]
+
+        groups = summarize(entries)
+
+        self.assertEqual([group['count'] for group in groups], [2, 1])
+        self.assertEqual(groups[0]['total_ms'], 40)
+        self.assertEqual(groups[0]['slowest']['template'], 'home.html:3')
+
+
+class FailingCursor:
+    """A DBAPI cursor whose EXPLAINs fail, recording what it was sent."""
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement, parameters=None):
+        self.executed.append(statement.split()[0])
+        if statement.startswith('EXPLAIN'):
+            raise ValueError("no such table")
+
+    def close(self):
+        pass
+
+
+class ExplainTestCase(TestCase):
+    """Test a failed EXPLAIN leaves the request's transaction alone."""
+
+    def test_rolled_back_to_savepoint(self):
+        executed = []
+        connection = SimpleNamespace(
+            dialect=SimpleNamespace(name='postgresql'),
+            connection=SimpleNamespace(
+                cursor=lambda: FailingCursor(executed)))
+
+        log = slowlog.SlowQueryLog(path=os.devnull)
+        plan = log.explain(connection, "SELECT 1", {}, False)
+
+        self.assertEqual(plan, "EXPLAIN failed: no such table")
+        self.assertEqual(executed,
+                         ['SAVEPOINT', 'EXPLAIN', 'ROLLBACK', 'RELEASE'])
+
+
+class SlowQueryLogTestCase(DatabaseTestCase):
+    """Test recording statements from requests."""
+
+    def setUp(self):
+        super().setUp()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'slow.log')
+
+        # log every statement
+        self.app.config.update(SLOW_QUERY_MS=1e-6, SLOW_QUERY_LOG=self.path)
+        slowlog.init_app(self.app)
+        self.addCleanup(self.app.extensions.pop, 'slow_queries', None)
+        self.addCleanup(self.app.config.update, SLOW_QUERY_MS=0)
+
+    def test_records_request(self):
+        user = make_user(email="secret@example.com")
+        make_message(user, text="Hello.")
+
+        self.client.get(f"/users/{user.id}")
+        self.app.extensions['slow_queries'].logger.handlers[0].flush()
+
+        entries = [entry for entry in read_entries(self.path)
+                   if entry['endpoint'] == 'warbler.users_show']
+        self.assertTrue(entries)
+
+        selects = [entry for entry in entries
+                   if entry['statement'].lstrip().startswith('SELECT')]
+        self.assertTrue(all(entry['plan'] for entry in selects))
+        self.assertTrue(any('app.py' in (entry['caller'] or '')
+                            for entry in entries))
+
+        # a statement run by a template is traced to its line
+        self.assertTrue(any((entry['template'] or '').startswith('users/')
+                            for entry in entries))
+
+        self.assertNotIn("secret@example.com", open(self.path).read())
+
+    def test_threshold(self):
+        self.app.config['SLOW_QUERY_MS'] = 60 * 1000
+        slowlog.init_app(self.app)
+
+        self.client.get("/")
+
+        self.assertEqual(list(read_entries(self.path)), [])
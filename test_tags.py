@@ -0,0 +1,111 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_tags.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from archive import archive_messages
+from models import db, Message, MessageTerm
+from tags import extract, link_terms, index_messages, rebuild, timeline, tag_term
+from testing import DatabaseTestCase, make_user, make_message
+
+
+class ExtractTestCase(TestCase):
+    """Test parsing and rendering hashtags and mentions."""
+
+    def test_extract(self):
+        tags, names = extract("#Flask and #flask, @alice & bob@example.com #1")
+
+        self.assertEqual(tags, {'flask', '1'})
+        self.assertEqual(names, {'alice'})
+
+    def test_link_terms(self):
+        """Are terms linked and everything else escaped?"""
+
+        html = link_terms("<b>#Hi</b> @bob it's")
+
+        self.assertEqual(html, '&lt;b&gt;<a href="/tags/hi">#Hi</a>&lt;/b&gt; '
+                               '<a href="/users?q=bob">@bob</a> it&#39;s')
+
+
+class TagsTestCase(DatabaseTestCase):
+    """Test the inverted index and tag and mention timelines."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = make_user(username="alice")
+        self.other = make_user(username="bob")
+
+    def test_index_on_post(self):
+        self.login(self.user)
+        self.client.post("/messages/new", data={"text": "#Python with @bob"})
+
+        self.assertEqual(
+            sorted(term.term for term in MessageTerm.query),
+            ['#python', f'@{self.other.id}'])
+
+        html = self.client.get("/tags/python").get_data(as_text=True)
+        self.assertIn('<a href="/tags/python">#Python</a>', html)
+
+        html = self.client.get(f"/users/{self.other.id}/mentions").get_data(
+            as_text=True)
+        self.assertIn("Mentions of @bob", html)
+        self.assertIn("@alice", html)
+
+    def test_post_is_one_transaction(self):
+        """Is a message stored only with its index entries and mentions?"""
+
+        self.login(self.user)
+        with patch('app.deliver', side_effect=RuntimeError("inbox down")):
+            with self.assertRaises(RuntimeError):
+                self.client.post("/messages/new", data={"text": "#lost @bob"})
+        db.session.rollback()
+
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(MessageTerm.query.count(), 0)
+
+    def test_unindex_on_delete(self):
+        self.login(self.user)
+        self.client.post("/messages/new", data={"text": "#gone"})
+        message_id = MessageTerm.query.one().message_id
+
+        self.client.post(f"/messages/{message_id}/delete")
+
+        self.assertEqual(MessageTerm.query.count(), 0)
+
+    def test_timeline_pages(self):
+        """Are tag timelines paged newest first by (timestamp, id)?"""
+
+        start = datetime(2020, 1, 1)
+        messages = [make_message(self.user, text=f"#paged {i}.",
+                                 timestamp=start + timedelta(minutes=i % 3))
+                    for i in range(5)]
+        index_messages(messages)
+
+        page, next_key = timeline(tag_term('paged'), limit=3)
+        self.assertEqual([msg.text for msg in page],
+                         ["#paged 2.", "#paged 4.", "#paged 1."])
+
+        page, next_key = timeline(tag_term('paged'), next_key, limit=3)
+        self.assertEqual([msg.text for msg in page],
+                         ["#paged 3.", "#paged 0."])
+        self.assertIsNone(next_key)
+
+    def test_rebuild(self):
+        """Does a rebuild index hot and archived messages?"""
+
+        make_message(self.user, text="#old", timestamp=datetime(2000, 1, 1))
+        make_message(self.other, text="#new hi @alice")
+        archive_messages(datetime(2010, 1, 1))
+
+        added = rebuild(batch_size=1)
+
+        self.assertEqual(added, 3)
+        old, = timeline(tag_term('old'))[0]
+        self.assertEqual(old.user.username, "alice")
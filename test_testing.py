@@ -0,0 +1,83 @@
+"""Test harness tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_testing.py
+
+
+from models import db, User, Message, Follows, Likes
+from testing import (DatabaseTestCase, make_user, make_message, make_follow,
+                     make_like, DEFAULT_PASSWORD)
+
+
+class DatabaseTestCaseTestCase(DatabaseTestCase):
+    """Test that each test's writes are rolled back.
+
+    The two test_isolation_* tests each commit a user with the same
+    username; whichever runs second would fail if the first one leaked.
+    """
+
+    def check_isolation(self):
+        self.assertEqual(User.query.count(), 0)
+
+        make_user(username="leaky")
+        db.session.commit()
+
+        self.assertEqual(User.query.count(), 1)
+
+    def test_isolation_first(self):
+        self.check_isolation()
+
+    def test_isolation_second(self):
+        self.check_isolation()
+
+    def test_rollback_inside_test(self):
+        """Does a rollback in the code under test keep earlier commits?"""
+
+        make_user(username="kept")
+        db.session.commit()
+
+        make_user(username="dropped")
+        db.session.rollback()
+
+        self.assertEqual([u.username for u in User.query.all()], ["kept"])
+
+    def test_requests_share_transaction(self):
+        """Do requests see (and keep) the test's data?"""
+
+        user = make_user()
+        self.login(user)
+
+        resp = self.client.post("/messages/new", data={"text": "Hi!"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.filter_by(user_id=user.id).count(), 1)
+
+
+class FactoriesTestCase(DatabaseTestCase):
+    """Test the fixture factories."""
+
+    def test_make_user(self):
+        """Can a made user log in with the default password?"""
+
+        user = make_user(bio="hi")
+
+        self.assertEqual(User.authenticate(user.username, DEFAULT_PASSWORD),
+                         user)
+        self.assertEqual(user.bio, "hi")
+
+    def test_make_message(self):
+        author = make_user()
+        msg = make_message(author, text="Hello")
+
+        self.assertEqual(msg.user, author)
+        self.assertEqual(msg.text, "Hello")
+
+    def test_make_follow_and_like(self):
+        follower, followed = make_user(), make_user()
+        make_follow(follower, followed)
+        like = make_like(follower, make_message(followed))
+
+        self.assertTrue(follower.is_following(followed))
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(Likes.query.get(like.id).user_id, follower.id)
@@ -0,0 +1,144 @@
+"""Trending counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import threading
+from unittest import TestCase
+
+from trending import TrendingTracker, RollingCounter, HOUR, DAY
+
+
+class Clock:
+    """A clock tests can move by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RollingCounterTestCase(TestCase):
+    """Test sliding-window bucket counts."""
+
+    def test_counts_within_window(self):
+        """Are likes inside the window counted?"""
+
+        counter = RollingCounter(length=60, bucket_width=10)
+        counter.add(1, 1, now=0)
+        counter.add(1, 1, now=25)
+        counter.add(2, 1, now=55)
+
+        self.assertEqual(counter.top(10, now=55), [(1, 2), (2, 1)])
+
+    def test_old_buckets_roll_out(self):
+        """Are likes older than the window dropped?"""
+
+        counter = RollingCounter(length=60, bucket_width=10)
+        counter.add(1, 1, now=0)
+        counter.add(2, 1, now=30)
+
+        self.assertEqual(counter.top(10, now=65), [(2, 1)])
+        self.assertNotIn(1, counter.totals)
+
+    def test_unlike(self):
+        """Does an unlike cancel a like?"""
+
+        counter = RollingCounter(length=60, bucket_width=10)
+        counter.add(1, 1, now=0)
+        counter.add(1, -1, now=5)
+
+        self.assertEqual(counter.top(10, now=5), [])
+
+    def test_unlike_in_a_later_bucket(self):
+        """Does an unlike still cancel its like as both roll out?"""
+
+        counter = RollingCounter(length=60, bucket_width=10)
+        counter.add(7, 1, now=0)
+        counter.add(7, -1, now=25)
+        self.assertEqual(counter.top(10, now=25), [])
+
+        # the like's bucket has gone, the unlike's hasn't
+        self.assertEqual(counter.top(10, now=65), [])
+
+        # and now both have
+        self.assertEqual(counter.top(10, now=95), [])
+        self.assertNotIn(7, counter.totals)
+
+
+class TrendingTrackerTestCase(TestCase):
+    """Test trending rankings."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.tracker = TrendingTracker(top_k=2, snapshot_interval=10,
+                                       clock=self.clock)
+
+    def test_ranks_by_velocity(self):
+        """Are messages ranked by likes per hour?"""
+
+        for _ in range(3):
+            self.tracker.record_like(1)
+        self.tracker.record_like(2)
+        self.tracker.record_like(3)
+        self.tracker.record_like(3)
+
+        self.assertEqual(self.tracker.trending('hour'), [(1, 3.0), (3, 2.0)])
+        self.assertEqual(self.tracker.trending('day'),
+                         [(1, 3 / 24), (3, 2 / 24)])
+
+    def test_hour_expires_before_day(self):
+        """Does a like leave the hour window but stay in the day window?"""
+
+        self.tracker.record_like(1)
+        self.clock.now = HOUR + 60
+
+        self.assertEqual(self.tracker.trending('hour'), [])
+        self.assertEqual(self.tracker.trending('day'), [(1, 1 / 24)])
+
+        self.clock.now = DAY + HOUR
+        self.assertEqual(self.tracker.snapshot('day'), [])
+
+    def test_snapshot_is_reused(self):
+        """Is the ranking cached until the snapshot interval passes?"""
+
+        self.tracker.record_like(1)
+        self.assertEqual(self.tracker.trending('hour'), [(1, 1.0)])
+
+        self.tracker.record_like(2)
+        self.tracker.record_like(2)
+        self.assertEqual(self.tracker.trending('hour'), [(1, 1.0)])
+
+        self.clock.now = 10
+        self.assertEqual(self.tracker.trending('hour'), [(2, 2.0), (1, 1.0)])
+
+    def test_threads(self):
+        """Can likes be recorded while another thread ranks them?"""
+
+        errors = []
+
+        def like(first):
+            for message_id in range(first, first + 2000):
+                self.tracker.record_like(message_id)
+
+        def rank():
+            try:
+                for _ in range(200):
+                    self.tracker.snapshot('hour')
+            except RuntimeError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=like, args=(first,))
+                   for first in (0, 10000)]
+        threads.append(threading.Thread(target=rank))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(self.tracker.counters['hour'].totals.values()),
+                         4000)
@@ -5,40 +5,19 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
 from sqlalchemy.exc import IntegrityError  
 
 from models import db, User, Message, Follows
+from testing import DatabaseTestCase
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DatabaseTestCase):
     """Test views for messages."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        User.query.delete()
-        Message.query.delete()
-        Follows.query.delete()
+        super().setUp()
 
         # create 2 test users to test the various methods and unique restraints
         u1 = User(
@@ -58,7 +37,6 @@ class UserModelTestCase(TestCase):
 
         self.test_user1 = u1
         self.test_user2 = u2
-        self.client = app.test_client()
 
     def test_user_model(self):
         """Does basic model work?"""
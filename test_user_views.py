@@ -5,45 +5,20 @@
 #    FLASK_ENV=production python -m unittest test_user_views.py
 
 
-import os
-from unittest import TestCase
+from datetime import datetime, timedelta
 
 from models import db, connect_db, Message, User, Likes
+from app import CURR_USER_KEY, LIKES_PAGE
+from testing import DatabaseTestCase, make_user, make_message, make_like
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
-
-class UserViewTestCase(TestCase):
+class UserViewTestCase(DatabaseTestCase):
     """Test views for user."""
 
     def setUp(self):
         """Create test client, add sample data."""
 
-        Likes.query.delete()
-        Message.query.delete()
-        User.query.delete()
-        
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -446,3 +421,60 @@ class UserViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn(f'<div class="alert alert-danger">Access unauthorized.</div>', html)
+
+    def test_other_users_likes(self):
+        """Are the profile user's likes shown, with the viewer's like state?"""
+
+        other = make_user()
+        author = make_user()
+        shared = make_message(author, text="Liked by both")
+        theirs = make_message(author, text="Liked by other only")
+        mine = make_message(author, text="Liked by testuser only")
+
+        make_like(other, shared)
+        make_like(other, theirs)
+        make_like(self.testuser, shared)
+        make_like(self.testuser, mine)
+
+        self.login(self.testuser)
+        resp = self.client.get(f"/users/{other.id}/likes")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Liked by both", html)
+        self.assertIn("Liked by other only", html)
+        self.assertNotIn("Liked by testuser only", html)
+        self.assertEqual(html.count("btn-primary"), 1)
+
+    def test_likes_pages(self):
+        """Are likes paged newest first with an older-likes cursor?"""
+
+        author = make_user()
+        start = datetime(2020, 1, 1)
+        for i in range(LIKES_PAGE + 5):
+            make_like(self.testuser, make_message(author, text=f"Liked {i}."),
+                      created_at=start + timedelta(minutes=i))
+
+        self.login(self.testuser)
+        html = self.client.get(f"/users/{self.testuser.id}/likes").get_data(
+            as_text=True)
+
+        self.assertIn(f"Liked {LIKES_PAGE + 4}.", html)
+        self.assertNotIn("Liked 4.", html)
+        self.assertIn(f"{LIKES_PAGE + 5}</a>", html)
+
+        next_page = html.split('likes?cursor=')[1].split('"')[0]
+        html = self.client.get(
+            f"/users/{self.testuser.id}/likes?cursor={next_page}").get_data(
+            as_text=True)
+
+        self.assertIn("Liked 4.", html)
+        self.assertIn("Liked 0.", html)
+        self.assertNotIn("Liked 5.", html)
+        self.assertNotIn("Older likes", html)
+
+    def test_likes_bad_cursor(self):
+        self.login(self.testuser)
+        resp = self.client.get(f"/users/{self.testuser.id}/likes?cursor=nope")
+
+        self.assertEqual(resp.status_code, 400)
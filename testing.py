@@ -0,0 +1,191 @@
+"""Test harness: transactional test cases and fixture factories.
+
+Tables are created once per process. Each test then runs inside a
+transaction that is rolled back afterwards, instead of deleting and
+re-creating data: the session is bound to a single connection, and every
+`db.session.commit()` in the code under test only releases a SAVEPOINT.
+
+By default the tests run against an in-memory SQLite database, which is
+private to each process, so parallel runners (e.g. pytest -n auto) are
+safe. Set TEST_DATABASE_URL to run against Postgres instead; each parallel
+worker then uses its own database named after the worker (for example
+warbler-test-gw0), which must already exist.
+
+use it like:
+
+    from testing import DatabaseTestCase, make_user
+
+    class MyTestCase(DatabaseTestCase):
+        def test_something(self):
+            user = make_user()
+            resp = self.client.get(f"/users/{user.id}")
+"""
+
+import os
+from functools import lru_cache
+from itertools import count
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import create_app, CURR_USER_KEY
+from feed import timelines
+from graph import follow_graph
+from mutuals import summaries
+from models import db, bcrypt, User, Message, Follows, Likes
+from notifications import unread_counts
+
+_app = None
+_sequence = count(1)
+
+DEFAULT_PASSWORD = "password"
+
+
+def get_app():
+    """Return the process-wide test app, creating its tables on first use."""
+
+    global _app
+
+    if _app is None:
+        _app = create_app('test')
+
+        uri = _app.config['SQLALCHEMY_DATABASE_URI']
+        worker = os.environ.get('PYTEST_XDIST_WORKER')
+        if worker and not uri.startswith('sqlite'):
+            _app.config['SQLALCHEMY_DATABASE_URI'] = f"{uri}-{worker}"
+
+        engine = db.get_engine(_app)
+        if engine.url.drivername == 'sqlite':
+            _fix_sqlite_transactions(engine)
+
+        db.create_all(app=_app)
+
+    return _app
+
+
+def _fix_sqlite_transactions(engine):
+    """Let pysqlite do SAVEPOINTs and enforce foreign keys.
+
+    pysqlite's own transaction handling doesn't support SAVEPOINT, so we
+    turn it off and emit BEGIN ourselves.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.execute('BEGIN')
+
+
+def _restart_savepoint(session, transaction):
+    """Open a new SAVEPOINT whenever the code under test ends one."""
+
+    if transaction.nested and not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
+
+
+class DatabaseTestCase(TestCase):
+    """Test case whose database changes are rolled back after each test."""
+
+    def setUp(self):
+        """Open the test transaction and a test client."""
+
+        self.app = get_app()
+        self.client = self.app.test_client()
+
+        # in-process caches would outlive the rolled-back rows they describe
+        timelines.clear()
+        unread_counts.clear()
+        follow_graph.clear()
+        summaries.clear()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+
+        self.original_session = db.session
+        session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+
+        # Flask-SQLAlchemy removes the session when each request's app
+        # context ends; keep it (and its SAVEPOINT) for the whole test.
+        session.remove = lambda: None
+        db.session = session
+
+        self.session = session()
+        self.session.begin_nested()
+        event.listen(self.session, 'after_transaction_end', _restart_savepoint)
+
+        self.addCleanup(self.rollback)
+
+    def rollback(self):
+        """Throw away everything the test wrote."""
+
+        event.remove(self.session, 'after_transaction_end', _restart_savepoint)
+        self.session.rollback()
+        self.session.close()
+
+        self.transaction.rollback()
+        self.connection.close()
+
+        db.session = self.original_session
+
+    def login(self, user):
+        """Log `user` in on this test's client."""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+
+##############################################################################
+# Fixture factories
+#
+# Each one adds a row with sensible defaults, flushes it so it has an id,
+# and returns it. Pass keyword arguments to override any column.
+
+
+@lru_cache()
+def _password_hash(password):
+    return bcrypt.generate_password_hash(password).decode('UTF-8')
+
+
+def make_user(**fields):
+    """Add a user who can log in with `password` (default "password")."""
+
+    n = next(_sequence)
+    fields.setdefault('username', f"user{n}")
+    fields.setdefault('email', f"user{n}@test.com")
+    fields['password'] = _password_hash(fields.get('password', DEFAULT_PASSWORD))
+
+    return _add(User(**fields))
+
+
+def make_message(user=None, **fields):
+    """Add a message by `user` (a new user if not given)."""
+
+    user = user or make_user()
+    fields.setdefault('text', f"Warble number {next(_sequence)}")
+
+    return _add(Message(user_id=user.id, **fields))
+
+
+def make_follow(follower, followed):
+    """Make `follower` follow `followed`."""
+
+    return _add(Follows(user_following_id=follower.id,
+                        user_being_followed_id=followed.id))
+
+
+def make_like(user, message, **fields):
+    """Make `user` like `message`."""
+
+    return _add(Likes(user_id=user.id, message_id=message.id, **fields))
+
+
+def _add(instance):
+    db.session.add(instance)
+    db.session.flush()
+    return instance
@@ -0,0 +1,146 @@
+"""Trending warbles from incremental, time-bucketed like counters.
+
+The like/unlike path calls `record_like()` with +1/-1. Each window keeps a
+ring of fixed-width buckets plus running totals, so expiring old likes is a
+matter of subtracting whole buckets as they roll out of the window -- the
+likes table is never scanned.
+
+Rankings are taken from the running totals with a bounded top-K heap and
+cached as a snapshot that is refreshed at most every `snapshot_interval`
+seconds, so a busy /trending page doesn't re-rank on every request.
+
+Every request thread shares the tracker, so changing the counters and
+copying their totals for a snapshot take its lock; the ranking itself
+runs on the copy, outside it.
+"""
+
+import heapq
+import threading
+import time
+from collections import Counter, deque
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# window name -> (window length, bucket width), in seconds
+WINDOWS = {
+    'hour': (HOUR, 60),
+    'day': (DAY, 15 * 60),
+}
+
+DEFAULT_TOP_K = 50
+DEFAULT_SNAPSHOT_INTERVAL = 10
+
+
+class RollingCounter:
+    """Per-message like counts over a sliding window of time buckets."""
+
+    def __init__(self, length, bucket_width):
+        self.length = length
+        self.bucket_width = bucket_width
+        self.buckets = deque()
+        self.totals = Counter()
+
+    def _bucket_start(self, now):
+        return int(now // self.bucket_width) * self.bucket_width
+
+    def expire(self, now):
+        """Drop buckets that have rolled out of the window."""
+
+        oldest = self._bucket_start(now) - self.length + self.bucket_width
+
+        while self.buckets and self.buckets[0][0] < oldest:
+            _, counts = self.buckets.popleft()
+            self.totals.subtract(counts)
+
+            # totals stay signed: an unlike whose like has already rolled
+            # out must still cancel the like's bucket when that goes
+            for message_id in counts:
+                if self.totals[message_id] == 0:
+                    del self.totals[message_id]
+
+    def add(self, message_id, delta, now):
+        """Add `delta` likes for `message_id` at time `now`."""
+
+        self.expire(now)
+
+        start = self._bucket_start(now)
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append((start, Counter()))
+
+        self.buckets[-1][1][message_id] += delta
+        self.totals[message_id] += delta
+
+        if self.totals[message_id] == 0:
+            del self.totals[message_id]
+
+    def top(self, k, now):
+        """Return the `k` most-liked (message_id, count) pairs, best first."""
+
+        self.expire(now)
+        return rank(self.totals.items(), k)
+
+
+def rank(totals, k):
+    """The `k` largest positive (message_id, count) pairs, best first."""
+
+    return heapq.nlargest(k, ((message_id, count) for message_id, count
+                              in totals if count > 0),
+                          key=lambda item: item[1])
+
+
+class TrendingTracker:
+    """Like velocity rankings for every window in `WINDOWS`."""
+
+    def __init__(self, top_k=DEFAULT_TOP_K,
+                 snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 clock=time.time):
+        self.top_k = top_k
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self.counters = {name: RollingCounter(length, width)
+                         for name, (length, width) in WINDOWS.items()}
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def record_like(self, message_id, delta=1):
+        """Record a like (+1) or unlike (-1) of a message."""
+
+        now = self.clock()
+        with self.lock:
+            for counter in self.counters.values():
+                counter.add(message_id, delta, now)
+
+    def snapshot(self, window):
+        """Re-rank `window` and cache the result."""
+
+        now = self.clock()
+        counter = self.counters[window]
+        hours = counter.length / HOUR
+
+        with self.lock:
+            counter.expire(now)
+            totals = list(counter.totals.items())
+
+        ranking = [(message_id, count / hours)
+                   for message_id, count in rank(totals, self.top_k)]
+        self.snapshots[window] = (now, ranking)
+        return ranking
+
+    def trending(self, window='hour'):
+        """Return [(message_id, likes per hour), ...] for `window`.
+
+        Served from the last snapshot unless it is older than
+        `snapshot_interval` seconds.
+        """
+
+        taken_at, ranking = self.snapshots.get(window, (None, None))
+
+        if taken_at is None or self.clock() - taken_at >= self.snapshot_interval:
+            ranking = self.snapshot(window)
+
+        return ranking
+
+
+# Tracker shared by the app's like/unlike path and the /trending page.
+tracker = TrendingTracker()
@@ -0,0 +1,34 @@
+"""WSGI entry point.
+
+Servers that preload the app before forking workers can point at this
+module, e.g.:
+
+    WARBLER_CONFIG=production gunicorn --preload -w 4 wsgi:app
+
+create_app() doesn't open any database connections, so each worker builds
+its own connection pool after the fork. This module then loads the follow
+graph (see graph.py) before serving, and closes the connections it used:
+with --preload the workers share the one loaded graph, and without it
+each loads its own as it starts, rather than in its first request.
+
+With more than one worker, set CHANGES_CHANNEL (see changes.py) too, so
+that each worker's caches and follow graph hear of the others' writes:
+
+    CHANGES_CHANNEL=/var/run/warbler/changes.sqlite \
+        gunicorn --preload -w 4 wsgi:app
+
+The live feed (LIVE_FEED=1) keeps a connection open per home page, which
+needs a cooperative worker rather than sync workers. Each worker's live
+streams only hear of messages posted through the others over
+CHANGES_CHANNEL, so set it here too:
+
+    pip install gevent
+    LIVE_FEED=1 CHANGES_CHANNEL=/var/run/warbler/changes.sqlite \
+        gunicorn --preload -k gevent -w 4 wsgi:app
+"""
+
+from app import create_app
+from graph import follow_graph
+
+app = create_app()
+follow_graph.preload(app)